@@ -3,6 +3,11 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (``uvicorn backend.asgi:application`` or
+gunicorn with ``-k uvicorn.workers.UvicornWorker``) so the conversation event
+streams in ``main.realtime`` are held by the event loop rather than a worker
+thread each.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -62,10 +63,17 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Static files before anything that touches the session or database
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Outermost after security and static files so session and auth queries are counted too
+    'main.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.middleware.ProfileCreationMiddleware',
+    # Per-user key for the service worker's page cache (main.service_worker)
+    'main.middleware.CachePartitionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
@@ -146,7 +154,13 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 if not os.path.exists(STATIC_ROOT):
     os.makedirs(STATIC_ROOT)
 
+# collectstatic hashes every file name and writes .gz (and, with Brotli
+# installed, .br) copies; WhiteNoiseMiddleware serves the hashed names with
+# a far-future immutable Cache-Control and the precompressed copy the browser
+# accepts. Inline template CSS/JS lives in static/bundles/ (manage.py
+# bundle_assets) so it is cached too.
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+WHITENOISE_MAX_AGE = 0 if DEBUG else 60 * 60  # unhashed names; hashed ones are cached for good
 
 # Media files
 MEDIA_URL = '/media/'
@@ -207,6 +221,93 @@ MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY', 'bfb279f9aa9bdbcf158e97dd71a467c
 MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', 'http://localhost:8000/mpesa-callback/')
 MPESA_ENVIRONMENT = 'sandbox'
 
+# Real-time push (Server-Sent Events, served through backend.asgi)
+# Swap for a Redis pub/sub broker with the same publish/subscribe interface
+# when running more than one ASGI process.
+REALTIME_BROKER = os.environ.get('REALTIME_BROKER', 'main.realtime.InProcessBroker')
+REALTIME_KEEPALIVE = 15  # seconds between SSE keepalive comments
+REALTIME_STREAM_LIFETIME = 300  # seconds before a stream is recycled
+
+# Long-polling (?wait=N on the conversation messages API) for WSGI deployments.
+# Each waiting request holds a worker thread, so only threaded servers wait:
+# gunicorn.conf.py runs gthread workers and lowers the cap to threads - 1.
+# Messages saved by another process are noticed within the check interval
+# through a version key in the cache, so use a shared cache (Redis,
+# Memcached) with several workers; with the default per-process cache the
+# waiter re-runs its query at that interval instead.
+LONG_POLL_MAX_WAITERS = 16  # per process, at most; extra requests return immediately
+LONG_POLL_MAX_WAIT = 25  # seconds
+LONG_POLL_CHECK_INTERVAL = 2  # seconds between checks for other processes' messages
+
+# Profile/post/video view counters are buffered per process and flushed as
+# batched UPDATEs (main.view_counters).
+VIEW_COUNT_FLUSH_INTERVAL = 10  # seconds between flushes
+VIEW_DEDUPE_WINDOW = 60 * 30  # seconds a repeat view by the same viewer is ignored
+
+# Per-request query counts, SQL time and repeated statements
+# (main.middleware.QueryBudgetMiddleware). Views declare their budget with
+# @query_budget(n); QUERY_BUDGET_DEFAULT applies to the rest (None = no limit).
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+QUERY_INSTRUMENTATION = True
+QUERY_BUDGET_DEFAULT = None
+QUERY_REPEAT_THRESHOLD = 5  # the same statement this many times in one request is logged as a likely N+1
+QUERY_BUDGET_STRICT = TESTING  # raise QueryBudgetExceeded instead of logging
+
+# Background tasks (main.tasks), run by `manage.py run_tasks`
+TASKS_EAGER = TESTING  # run tasks inside enqueue() instead of waiting for a worker
+TASK_CONCURRENCY = 2  # threads per worker process
+TASK_POLL_INTERVAL = 1.0  # seconds an idle worker thread sleeps
+TASK_LEASE_SECONDS = 600  # a running task not renewed for this long is requeued
+TASK_BACKOFF_BASE = 10  # seconds before the first retry, doubling per attempt
+TASK_BACKOFF_MAX = 60 * 60
+TASK_RETENTION_DAYS = 7  # succeeded tasks are pruned after this
+
+# Video transcoding (main.transcoding); found on PATH when None. Without
+# them uploads are served as-is.
+FFMPEG_BINARY = None
+FFPROBE_BINARY = None
+VIDEO_TRANSCODE_TIMEOUT = 60 * 60  # seconds per ffmpeg run
+
+# Upload limits and resumable uploads (main.uploads). Per-kind limits are in
+# main.uploads.UPLOAD_LIMITS; UPLOAD_LIMITS here overrides entries. Files
+# larger than FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to UPLOAD_STAGING_DIR,
+# which must be on the same filesystem as MEDIA_ROOT for saves to be renames.
+UPLOAD_STAGING_DIR = MEDIA_ROOT / '.uploads'
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # suggested chunk size for resumable uploads
+UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+UPLOAD_EXPIRY_HOURS = 24  # unfinished or unclaimed resumable uploads are deleted after this
+
+# Media fields store files by content hash (main.storage); unreferenced blobs
+# are deleted by main.blobs, but not within this many seconds of last being
+# written or re-used
+BLOB_GRACE_SECONDS = 15 * 60
+
+# Videos are served by views that check blocks (main.media_serving), with
+# byte ranges and sendfile. Behind nginx, set this to an `internal` location
+# aliased to MEDIA_ROOT and nginx sends the file after the check instead.
+# Whatever serves MEDIA_URL in production must not serve video/audio files
+# under /media/blobs/ (videos, post videos, message media) or anything under
+# a /media/**/derived/<name>/ directory (transcodes and posters) itself; the
+# checked views do. Make those `internal` only, e.g.
+#   location ~ ^/media/(.*/derived/[^/]+/|blobs/.*\.(mp4|mov|webm|m4v|mkv|avi|3gp|mp3|m4a|ogg|wav|aac)$) { internal; }
+#   location /protected-media/ { internal; alias /path/to/media/; }
+MEDIA_ACCEL_REDIRECT = None  # e.g. '/protected-media/'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'main.queries': {
+            'handlers': ['console'],
+            'level': 'INFO' if DEBUG else 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
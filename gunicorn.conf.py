@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+"""
+gunicorn settings for WSGI deployments: ``gunicorn`` from the project root.
+
+Conversation long-polls (``?wait=N``) hold a thread each, so workers are
+threaded (gthread) and each worker's wait registry is capped one below its
+thread count, leaving a thread for ordinary requests. Under the sync worker
+(one thread) the view does not wait at all.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'backend.wsgi:application'
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def post_worker_init(worker):
+    from main.realtime import limit_waiters
+    limit_waiters(worker.cfg.threads)
@@ -2,6 +2,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
+from django.utils import timezone
 from .models import *
 
 # Extend User Admin to show profile inline
@@ -45,16 +46,16 @@ class ProfileAdmin(admin.ModelAdmin):
 
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
-    list_display = ('title', 'profile', 'views', 'likes', 'duration', 'uploaded_at')
-    list_filter = ('uploaded_at',)
+    list_display = ('title', 'profile', 'views', 'likes', 'duration', 'processing_status', 'uploaded_at')
+    list_filter = ('processing_status', 'uploaded_at')
     search_fields = ('title', 'profile__user__username', 'description')
-    readonly_fields = ('views', 'uploaded_at')
+    readonly_fields = ('views', 'uploaded_at', 'processing_status', 'web_file', 'hls_playlist')
     fieldsets = (
         ('Basic Info', {
             'fields': ('profile', 'title', 'description')
         }),
         ('Media Files', {
-            'fields': ('video_file', 'thumbnail')
+            'fields': ('video_file', 'thumbnail', 'processing_status', 'web_file', 'hls_playlist')
         }),
         ('Statistics', {
             'fields': ('views', 'likes', 'duration')
@@ -103,10 +104,31 @@ admin.site.register(Photo)
 admin.site.register(PostInteraction)
 admin.site.register(Comment)
 admin.site.register(Message)
+admin.site.register(UnreadCounter)
 admin.site.register(Contact)
 admin.site.register(CallLog)
 admin.site.register(Wallet)
 admin.site.register(SavedSearch)
 admin.site.register(Invitation)
 admin.site.register(UserSetting)
-admin.site.register(VideoComment)
\ No newline at end of file
+admin.site.register(VideoComment)
+@admin.register(Service)
+class ServiceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug')
+    search_fields = ('name', 'slug')
+    prepopulated_fields = {'slug': ('name',)}
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'priority', 'attempts', 'max_attempts', 'run_at', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'idempotency_key')
+    readonly_fields = ('attempts', 'locked_by', 'locked_at', 'created_at', 'finished_at', 'last_error')
+    actions = ['requeue']
+    
+    @admin.action(description='Requeue selected tasks')
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status=Task.RUNNING).update(
+            status=Task.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None
+        )
+        self.message_user(request, f'{updated} task(s) requeued.')
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        # Connect the provisioning, avatar, image, video, media blob, cache invalidation, search
+        # index and geocoding receivers, and register the background tasks
+        # blobs first: its reference counting has to see a new photo or post before the image
+        # pipeline moves the row to a stripped copy of the blob
+        from . import blobs  # noqa: F401
+        from . import (  # noqa: F401
+            avatars, discovery, geo, images, notifications, profile_summary, provisioning, search,
+            transcoding,
+        )
@@ -0,0 +1,138 @@
+# main/assets.py
+"""
+Moving inline CSS and JavaScript out of templates into static bundles.
+
+Almost every template carried its stylesheet, and often its script, inline:
+``base.html`` alone puts ~19 KB of CSS into every page, and the bigger
+pages send another 20-40 KB of their own, again on every request, because
+HTML is never cached. ``manage.py bundle_assets`` moves each inline
+``<style>``/``<script>`` block that contains no template syntax into a file
+under ``static/bundles/`` and puts a ``<link>``/``<script src>`` tag in its
+place (same position, so the cascade and execution order don't change).
+Blocks that use template variables, ``{% url %}`` or ``{% csrf_token %}``
+stay inline.
+
+From there the normal static pipeline applies: ``collectstatic`` with
+WhiteNoise's ``CompressedManifestStaticFilesStorage`` gives every bundle a
+content-hashed name and writes ``.gz`` (and ``.br`` with the ``Brotli``
+package installed) copies next to it, and ``WhiteNoiseMiddleware`` serves
+hashed names with a far-future ``immutable`` Cache-Control, picking the
+precompressed copy the browser accepts. A repeat visit downloads only the
+HTML.
+"""
+import gzip
+import hashlib
+import re
+import textwrap
+from collections import namedtuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUNDLE_DIR = 'bundles'
+SCRIPT_TYPES = {'', 'text/javascript', 'application/javascript', 'module'}
+
+Block = namedtuple('Block', 'kind attrs body start end')
+Payload = namedtuple('Payload', 'raw gzip brotli')
+
+BLOCK_RE = re.compile(r'<(style|script)\b([^>]*)>(.*?)</\1\s*>', re.S | re.I)
+TYPE_RE = re.compile(r'''\btype\s*=\s*["']?([^"'\s>]*)''', re.I)
+TEMPLATE_SYNTAX_RE = re.compile(r'\{[{%#]')
+LOAD_STATIC_RE = re.compile(r'\{%\s*load\s[^%]*\bstatic\b[^%]*%\}')
+COMMENT_RE = re.compile(r'<!--.*?-->|\{%\s*comment\b.*?\{%\s*endcomment\s*%\}|\{#.*?#\}', re.S)
+EXTENDS_RE = re.compile(r'''\{%\s*extends\s+["']([^"']+)["']\s*%\}''')
+
+
+def inline_blocks(source):
+    """Every ``<style>`` and ``<script>`` in ``source`` that has its content inline, outside comments"""
+    comments = [match.span() for match in COMMENT_RE.finditer(source)]
+    for match in BLOCK_RE.finditer(source):
+        if any(start <= match.start() < end for start, end in comments):
+            continue
+        kind, attrs, body = match.group(1).lower(), match.group(2), match.group(3)
+        if kind == 'script' and re.search(r'\bsrc\s*=', attrs, re.I):
+            continue
+        yield Block(kind, attrs, body, match.start(), match.end())
+
+
+def extractable(block):
+    """Plain CSS or JavaScript: no template syntax, not a JSON/template ``<script type>``"""
+    if not block.body.strip() or TEMPLATE_SYNTAX_RE.search(block.body):
+        return False
+    if block.kind == 'script':
+        kind = TYPE_RE.search(block.attrs)
+        return (kind.group(1).lower() if kind else '') in SCRIPT_TYPES
+    return True
+
+
+def bundle_content(block):
+    return textwrap.dedent(block.body.strip('\n')).rstrip() + '\n'
+
+
+def reference_tag(block, path):
+    """The tag that loads ``path`` in place of ``block``, keeping its other attributes (``media``, ``type``)"""
+    attrs = block.attrs.rstrip()
+    if block.kind == 'style':
+        attrs = re.sub(r'''\s*\btype\s*=\s*["']?text/css["']?''', '', attrs, flags=re.I)
+        return f'<link rel="stylesheet" href="{{% static \'{path}\' %}}"{attrs}>'
+    return f'<script src="{{% static \'{path}\' %}}"{attrs}></script>'
+
+
+def ensure_load_static(source):
+    if LOAD_STATIC_RE.search(source):
+        return source
+    extends = EXTENDS_RE.search(source)
+    if extends:
+        # {% extends %} has to stay the first tag
+        return f'{source[:extends.end()]}\n{{% load static %}}{source[extends.end():]}'
+    return '{% load static %}\n' + source
+
+
+def digest(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def extract(template_name, source, bundle_path):
+    """
+    ``source`` with its extractable blocks replaced by references to bundles.
+
+    ``bundle_path(template_name, kind, content)`` returns the static path a
+    block's content is (or will be) stored under. Returns the new source and
+    a list of ``(path, content)``.
+    """
+    parts, bundles, position = [], [], 0
+    for block in inline_blocks(source):
+        if not extractable(block):
+            continue
+        content = bundle_content(block)
+        path = bundle_path(template_name, block.kind, content)
+        parts += [source[position:block.start], reference_tag(block, path)]
+        bundles.append((path, content))
+        position = block.end
+    if not bundles:
+        return source, []
+    parts.append(source[position:])
+    return ensure_load_static(''.join(parts)), bundles
+
+
+def payload(text):
+    """Size of ``text`` as sent: raw, gzipped and brotli-compressed (None without Brotli)"""
+    data = text.encode()
+    return Payload(
+        len(data),
+        len(gzip.compress(data, compresslevel=9)),
+        len(brotli.compress(data)) if brotli else None,
+    )
+
+
+def page_source(template_name, sources):
+    """A template's source with those of the templates it extends, approximating the page's markup"""
+    chain, seen = [], set()
+    while template_name in sources and template_name not in seen:
+        seen.add(template_name)
+        chain.append(sources[template_name])
+        parent = EXTENDS_RE.search(sources[template_name])
+        template_name = parent.group(1) if parent else None
+    return ''.join(chain)
@@ -0,0 +1,80 @@
+# main/avatars.py
+"""
+Avatars.
+
+A profile's avatar is its photo marked ``is_primary``, or its newest photo
+when none is marked. Views and templates used to work that out on the spot
+(``photos.exists()`` then ``photos.first()``, up to three queries per
+avatar, and every ``profile.photos.first`` in a template loop ran twice per
+row). ``Profile.primary_photo`` now stores the answer:
+
+* the upload, edit, set-primary and delete paths call the helpers below to
+  keep it up to date (deletes from anywhere else are caught by the
+  ``post_delete`` receiver);
+* templates use ``profile.avatar_url``, with ``select_related`` on
+  ``primary_photo`` where they loop over profiles;
+* code that has users rather than profiles calls ``avatar_urls`` to resolve
+  a whole batch in one query.
+"""
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .images import THUMB, variant_urls
+from .models import Photo, Profile
+
+_image_storage = Photo._meta.get_field('image').storage
+
+# The avatar rule: the photo marked primary, else the newest
+AVATAR_ORDER = ('-is_primary', '-uploaded_at', '-id')
+
+
+def refresh_primary_photo(profile_id, only_if_missing=False):
+    """Point the profile at its avatar by ``AVATAR_ORDER`` (or none) with one UPDATE"""
+    chosen = Photo.objects.filter(
+        profile_id=OuterRef('pk'),
+    ).order_by(*AVATAR_ORDER).values('id')[:1]
+    profiles = Profile.objects.filter(id=profile_id)
+    if only_if_missing:
+        profiles = profiles.filter(primary_photo__isnull=True)
+    profiles.update(primary_photo=Subquery(chosen))
+
+
+def set_primary_photo(photo):
+    """Mark ``photo`` as its profile's only primary photo and point the profile at it"""
+    with transaction.atomic():
+        Photo.objects.filter(
+            profile_id=photo.profile_id, is_primary=True
+        ).exclude(id=photo.id).update(is_primary=False)
+        if not photo.is_primary:
+            photo.is_primary = True
+            photo.save(update_fields=['is_primary'])
+        Profile.objects.filter(id=photo.profile_id).update(primary_photo=photo)
+
+
+def photo_added(photo):
+    """Update the pointer after ``photo`` has been saved for the first time"""
+    if photo.is_primary:
+        set_primary_photo(photo)
+    else:
+        # The newest photo is the avatar until one is marked primary
+        refresh_primary_photo(photo.profile_id)
+
+
+def avatar_urls(users):
+    """``{user_id: thumbnail url}`` for those of ``users`` (users or ids) that have an avatar, in one query"""
+    user_ids = [getattr(user, 'pk', user) for user in users]
+    if not user_ids:
+        return {}
+    rows = list(Profile.objects.filter(
+        user_id__in=user_ids, primary_photo__isnull=False,
+    ).values_list('user_id', 'primary_photo__image'))
+    urls = variant_urls([name for _, name in rows], THUMB, storage=_image_storage)
+    return {user_id: urls[name] for user_id, name in rows if name}
+
+
+@receiver(post_delete, sender=Photo)
+def photo_deleted(sender, instance, **kwargs):
+    # SET_NULL has already cleared the pointer if this was the avatar
+    refresh_primary_photo(instance.profile_id, only_if_missing=True)
@@ -0,0 +1,78 @@
+# main/benchmarks.py
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks seed large amounts of fake data, so they always run against a
+throwaway test database rather than the configured one.
+"""
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+
+@contextmanager
+def scratch_database(verbosity=0, on_disk=False):
+    """
+    Run the enclosed block against a freshly migrated test database.
+
+    SQLite test databases live in a shared-cache in-memory database whose
+    table locks serialize concurrent connections; ``on_disk`` puts it in a
+    temporary file instead for benchmarks that hit it from several threads.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    original_name = test_settings.get('NAME')
+    tmpdir = None
+    if on_disk and connection.vendor == 'sqlite':
+        tmpdir = tempfile.mkdtemp(prefix='bench-')
+        test_settings['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+    old_config = setup_databases(verbosity, interactive=False, aliases={'default'})
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity)
+        if tmpdir:
+            test_settings['NAME'] = original_name
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class QueryCounter:
+    """``connection.execute_wrapper`` hook that counts queries without logging them"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, *args, repeat=3, **kwargs):
+    """
+    Call ``func`` ``repeat`` times and return ``(queries, best_ms)``: the query
+    count of the last run and the fastest wall-clock time in milliseconds.
+    """
+    best = None
+    queries = 0
+    for _ in range(repeat):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+        queries = counter.count
+        best = elapsed if best is None else min(best, elapsed)
+    return queries, best
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
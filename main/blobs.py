@@ -0,0 +1,223 @@
+# main/blobs.py
+"""
+Reference counting and garbage collection for media blobs.
+
+Deleting a photo, video, post or message used to leave its file (and the
+image derivatives and transcodes made from it) on disk forever. With
+content-addressed storage (``main.storage``) one file can also back several
+rows, so it may only go once the last of them has. ``Blob.ref_count``
+counts the media fields pointing at each blob:
+
+* saving a row adds one for each new file it refers to and, when a field is
+  changed, drops one from the file it referred to before;
+* deleting a row (directly or by cascade) drops one for each of its files;
+* once the transaction commits, a blob at zero references is deleted with
+  its derivatives, unless it was written or re-used within
+  ``BLOB_GRACE_SECONDS`` (an upload of the same content may be about to
+  refer to it again). The references are counted again from the tables
+  before anything is deleted, so a drifted counter can delay a deletion but
+  never cause a wrong one.
+
+Files stored before blobs existed are deleted the same way once nothing
+refers to them. ``collect_garbage`` (hourly in ``run_tasks``, or ``manage.py
+collect_blobs``) recounts every blob, collects what the grace period held
+back and removes blob files that have no row. ``manage.py dedupe_media``
+moves existing uploads into the blob store, and ``repoint`` moves rows from
+one blob to another (an image stored again without its EXIF).
+"""
+import logging
+import posixpath
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from .models import Blob, Message, Photo, Post, Video
+from .storage import BLOB_DIR, blob_digest, blob_lock, is_blob_name
+from .transcoding import delete_transcodes
+
+logger = logging.getLogger(__name__)
+
+# Media fields that may point at blobs
+FILE_FIELDS = {
+    Photo: ('image',),
+    Video: ('video_file', 'thumbnail'),
+    Post: ('image', 'video'),
+    Message: ('media_file',),
+}
+BLOB_GRACE = timedelta(seconds=getattr(settings, 'BLOB_GRACE_SECONDS', 15 * 60))
+
+
+def _names(instance):
+    return {getattr(instance, field).name for field in FILE_FIELDS[type(instance)] if getattr(instance, field)}
+
+
+def references(name):
+    """How many media fields, across every table, point at ``name``"""
+    return sum(
+        model._default_manager.filter(**{field: name}).count()
+        for model, fields in FILE_FIELDS.items() for field in fields
+    )
+
+
+def acquire(names):
+    """Count a new reference to each blob in ``names``"""
+    for name in filter(is_blob_name, names):
+        if not Blob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, last_used_at=timezone.now()):
+            # Written without a row (e.g. before a crash); count it from scratch
+            Blob.objects.update_or_create(sha256=blob_digest(name), defaults={
+                'name': name, 'ref_count': references(name),
+                'size': default_storage.size(name) if default_storage.exists(name) else 0,
+            })
+
+
+def release(names):
+    """Drop a reference to each of ``names`` and delete the files nothing refers to, after commit"""
+    for name in names:
+        if is_blob_name(name):
+            Blob.objects.filter(name=name).update(ref_count=F('ref_count') - 1)
+            transaction.on_commit(lambda name=name: collect(name))
+        else:
+            transaction.on_commit(lambda name=name: delete_unreferenced(name))
+
+
+def repoint(name, target):
+    """Move every media field from the blob ``name`` to ``target``; ``name`` is collected once unreferenced"""
+    with transaction.atomic():
+        for model, fields in FILE_FIELDS.items():
+            for field in fields:
+                # update() skips the save signals, so the counts are set below
+                model._default_manager.filter(**{field: name}).update(**{field: target})
+        for blob in (name, target):
+            Blob.objects.filter(name=blob).update(ref_count=references(blob), last_used_at=timezone.now())
+        transaction.on_commit(lambda: collect(name))
+
+
+def delete_files(name):
+    """Delete ``name`` with its image derivatives and video transcodes"""
+    # Imported here so importing this module connects its receivers before the image pipeline's
+    from .images import delete_derivatives
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    delete_derivatives(name)
+    delete_transcodes(name)
+
+
+def collect(name, now=None):
+    """Delete the blob ``name`` if it is unreferenced and past its grace period. True if it went"""
+    cutoff = (now or timezone.now()) - BLOB_GRACE
+    with blob_lock(blob_digest(name)):
+        idle = Blob.objects.filter(name=name, ref_count__lte=0, last_used_at__lt=cutoff)
+        if not idle.exists():
+            return False
+        count = references(name)
+        if count:
+            logger.warning('Blob %s was counted as unreferenced but has %s references', name, count)
+            idle.update(ref_count=count)
+            return False
+        # Conditional, so an upload re-using it since the check above keeps it
+        if not idle.delete()[0]:
+            return False
+        delete_files(name)
+    return True
+
+
+def delete_unreferenced(name):
+    """Delete a pre-blob file once no row refers to it"""
+    if references(name) == 0:
+        delete_files(name)
+
+
+def recount():
+    """Set every ``ref_count`` from the tables; returns how many were wrong"""
+    counts = Counter()
+    for model, fields in FILE_FIELDS.items():
+        for field in fields:
+            rows = model._default_manager.filter(**{f'{field}__startswith': f'{BLOB_DIR}/'}).values_list(field)
+            for name, number in rows.annotate(number=Count('pk')).order_by():
+                # Transcodes live under blobs/ too but aren't blobs
+                if is_blob_name(name):
+                    counts[name] += number
+
+    fixed = 0
+    for blob_id, name, ref_count in Blob.objects.values_list('id', 'name', 'ref_count').iterator():
+        if not is_blob_name(name):
+            # A row wrongly made for a transcode; its files belong to the original
+            fixed += Blob.objects.filter(id=blob_id).delete()[0]
+            continue
+        actual = counts.pop(name, 0)
+        if actual != ref_count:
+            fixed += Blob.objects.filter(id=blob_id).update(ref_count=actual)
+    # Referenced blobs without a row
+    for name in counts:
+        acquire([name])
+        fixed += 1
+    return fixed
+
+
+def _walk(directory):
+    try:
+        directories, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        yield posixpath.join(directory, filename)
+    for subdirectory in directories:
+        if subdirectory != 'derived':
+            yield from _walk(posixpath.join(directory, subdirectory))
+
+
+def collect_garbage():
+    """Recount, collect unreferenced blobs past their grace period and delete stray blob files"""
+    now = timezone.now()
+    fixed = recount()
+    idle = Blob.objects.filter(ref_count__lte=0, last_used_at__lt=now - BLOB_GRACE)
+    collected = sum(collect(name, now) for name in idle.values_list('name', flat=True))
+
+    known = set(Blob.objects.values_list('name', flat=True))
+    strays = 0
+    for name in _walk(BLOB_DIR):
+        if name not in known and default_storage.get_modified_time(name) < now - BLOB_GRACE:
+            with blob_lock(blob_digest(name)):
+                if not Blob.objects.filter(name=name).exists():
+                    delete_files(name)
+                    strays += 1
+    return {'recounted': fixed, 'collected': collected, 'strays': strays}
+
+
+def remember_media(sender, instance, raw=False, update_fields=None, **kwargs):
+    # What the row referred to before this save, to diff against afterwards
+    instance._stored_media = None
+    fields = FILE_FIELDS[sender]
+    if raw or instance._state.adding or (update_fields is not None and not set(fields) & set(update_fields)):
+        return
+    stored = sender._default_manager.filter(pk=instance.pk).values_list(*fields).first()
+    instance._stored_media = {name for name in stored or () if name}
+
+
+def media_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = _names(instance)
+    if created:
+        acquire(current)
+        return
+    stored = getattr(instance, '_stored_media', None)
+    if stored is not None:
+        acquire(current - stored)
+        release(stored - current)
+
+
+def media_deleted(sender, instance, **kwargs):
+    release(_names(instance))
+
+
+for model in FILE_FIELDS:
+    pre_save.connect(remember_media, sender=model, dispatch_uid=f'blobs-remember-{model.__name__}')
+    post_save.connect(media_saved, sender=model, dispatch_uid=f'blobs-saved-{model.__name__}')
+    post_delete.connect(media_deleted, sender=model, dispatch_uid=f'blobs-deleted-{model.__name__}')
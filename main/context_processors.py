@@ -1,11 +1,7 @@
-from .models import Message
-from django.db.models import Q
+from .models import UnreadCounter
 
 def unread_messages(request):
     if request.user.is_authenticated:
-        unread_count = Message.objects.filter(
-            conversation__participants=request.user,
-            is_read=False
-        ).exclude(sender=request.user).count()
+        unread_count = UnreadCounter.total_for(request.user)
         return {'unread_messages_count': unread_count}
     return {'unread_messages_count': 0}
\ No newline at end of file
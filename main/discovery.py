@@ -0,0 +1,294 @@
+# main/discovery.py
+"""
+Profile discovery for ``search_view``: filtering, facet counts and cached
+result pages.
+
+A search used to rebuild the queryset and run a separate COUNT(*) for the
+paginator on every request. ``search_page`` computes the result total and
+the gender, age band and VIP facets in one aggregate pass, plus one
+GROUP BY each for counties and services. It caches that summary, and the
+profile ids of each requested page, under a key built from the normalized
+``SearchForm.cleaned_data``. Repeat searches, including popular anonymous
+filter combinations, then only load the page's rows by primary key. Pages
+are keyset pages (``main.pagination``), keyed by their cursor, so a deep
+page costs the same as the first and the facet total stands in for the
+paginator's COUNT(*). Only the first page and pages a cached page linked to
+are cached, so clients can't fill the cache with made-up cursors.
+
+Proximity searches (``near`` a gazetteer place, or the visitor's ``lat`` /
+``lng``) are answered by ``main.geo.within_radius`` and ordered nearest
+first.
+
+Every cached entry carries a generation number that is bumped whenever a
+Profile is created or deleted, or saved with a change to one of
+``SEARCH_FIELDS``, so changes show up on the next request. Other saves
+(and the online-status ping's UPDATE) leave the cache alone; the order of
+cached pages by ``last_active`` may lag by up to ``SEARCH_CACHE_TIMEOUT``,
+which also bounds how long dead generations linger.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Profile, ProfileService, Service
+from .geo import DEFAULT_RADIUS_KM, geocode, haversine_km, within_radius
+from .pagination import KeysetPage, KeysetPaginator, decode_cursor, encode_cursor
+from .search import match_profiles, tokenize
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_CACHE_TIMEOUT = 60 * 5
+TOP_COUNTIES = 10
+TOP_SERVICES = 10
+GENERATION_KEY = 'search-results:generation'
+# Everything the result cards render per profile
+PAGE_SELECT = ('user', 'primary_photo')
+PAGE_PREFETCH = ('profile_services__service',)
+# Profile fields the filters, facets and query match on
+SEARCH_FIELDS = (
+    'gender', 'age', 'county', 'city_town', 'services_offered', 'is_vip', 'is_available',
+    'latitude', 'longitude', 'geohash',
+)
+
+# (label, min age, max age or None)
+AGE_BANDS = [
+    ('18-24', 18, 24),
+    ('25-34', 25, 34),
+    ('35-44', 35, 44),
+    ('45+', 45, None),
+]
+
+
+def normalize_filters(cleaned_data):
+    """Drop empty filters and canonicalize the rest so equivalent searches share a cache key"""
+    normalized = {}
+    for name, value in cleaned_data.items():
+        if value is None or value is False or value in ('', []):
+            continue
+        if name == 'query':
+            value = ' '.join(tokenize(value))
+        elif name in ('county', 'near'):
+            value = ' '.join(value.lower().split())
+        elif name == 'services':
+            value = sorted(value)
+        elif name in ('lat', 'lng'):
+            # ~100m, so nearby visitors share cache entries
+            value = round(value, 3)
+        if value or value == 0:
+            normalized[name] = value
+    return normalized
+
+
+def search_center(filters):
+    """``(lat, lng)`` to search around: the visitor's position, else the geocoded ``near`` place"""
+    if 'lat' in filters and 'lng' in filters:
+        return filters['lat'], filters['lng']
+    if filters.get('near'):
+        return geocode(filters['near'])
+    return None
+
+
+def filter_profiles(filters, available_only=False, fuzzy=False):
+    """Ordered Profile queryset for normalized ``filters``; ``fuzzy`` widens the text query to close spellings"""
+    profiles = Profile.objects.all()
+
+    query = filters.get('query')
+    if query:
+        # Ranked matches from the full-text index, filtered along with everything else
+        profiles = match_profiles(profiles, query, fuzzy=fuzzy)
+
+    if filters.get('gender'):
+        profiles = profiles.filter(gender=filters['gender'])
+
+    if filters.get('county'):
+        profiles = profiles.filter(county__icontains=filters['county'])
+
+    if filters.get('min_age'):
+        profiles = profiles.filter(age__gte=filters['min_age'])
+
+    if filters.get('max_age'):
+        profiles = profiles.filter(age__lte=filters['max_age'])
+
+    services = filters.get('services')
+    if services:
+        # Exact service matches through the (service, profile) index
+        wanted = list(Service.objects.filter(slug__in=services))
+        if len(wanted) < len(services):
+            # At least one of the services isn't offered by anyone
+            return profiles.none()
+        profiles = profiles.filter(id__in=ProfileService.profiles_offering(wanted))
+
+    if filters.get('is_vip'):
+        profiles = profiles.filter(is_vip=True)
+
+    center = search_center(filters)
+    if center:
+        profiles = within_radius(profiles, *center, filters.get('radius') or DEFAULT_RADIUS_KM)
+    elif filters.get('near'):
+        # A place the gazetteer doesn't know
+        return profiles.none()
+
+    # Only show available profiles to non-authenticated users
+    if available_only:
+        profiles = profiles.filter(is_available=True)
+
+    return profiles.order_by(*search_ordering(filters))
+
+
+def search_ordering(filters):
+    """
+    Nearest first for proximity searches; otherwise VIP status, then
+    relevance for text searches or last activity. Pages add ``id`` as a
+    tiebreaker.
+    """
+    if search_center(filters):
+        return ['distance_sq', '-is_vip']
+    if filters.get('query'):
+        return ['-is_vip', 'search_rank']
+    return ['-is_vip', '-last_active']
+
+
+def compute_facets(profiles):
+    """Total and per-value counts for the filtered ``profiles``"""
+    profiles = profiles.order_by()
+
+    aggregates = {
+        'total': Count('id'),
+        'vip': Count('id', filter=Q(is_vip=True)),
+    }
+    for index, (value, _) in enumerate(Profile.GENDER_CHOICES):
+        aggregates[f'gender_{index}'] = Count('id', filter=Q(gender=value))
+    for index, (_, low, high) in enumerate(AGE_BANDS):
+        band = Q(age__gte=low) if high is None else Q(age__gte=low, age__lte=high)
+        aggregates[f'age_{index}'] = Count('id', filter=band)
+    counts = profiles.aggregate(**aggregates)
+
+    counties = profiles.values('county').annotate(count=Count('id')).order_by('-count', 'county')[:TOP_COUNTIES]
+    services = ProfileService.objects.filter(
+        profile__in=profiles.values('id')
+    ).values('service__name', 'service__slug').annotate(
+        count=Count('id')
+    ).order_by('-count', 'service__name')[:TOP_SERVICES]
+
+    return {
+        'total': counts['total'],
+        'vip': counts['vip'],
+        'genders': [
+            {'value': value, 'label': label, 'count': counts[f'gender_{index}']}
+            for index, (value, label) in enumerate(Profile.GENDER_CHOICES)
+        ],
+        'age_bands': [
+            {'label': label, 'min_age': low, 'max_age': high, 'count': counts[f'age_{index}']}
+            for index, (label, low, high) in enumerate(AGE_BANDS)
+        ],
+        'counties': [{'value': row['county'], 'count': row['count']} for row in counties],
+        'services': [
+            {'name': row['service__name'], 'slug': row['service__slug'], 'count': row['count']}
+            for row in services
+        ],
+    }
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def invalidate_search_results():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, None)
+
+
+def _cache_key(filters, available_only):
+    digest = hashlib.md5(
+        json.dumps([filters, available_only], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f'search-results:{_generation()}:{digest}'
+
+
+def _page_key(key, cursor):
+    return f"{key}:page:{hashlib.md5((cursor or '').encode()).hexdigest()}"
+
+
+def search_page(filters, cursor=None, available_only=False):
+    """
+    Return ``(page, facets)`` for normalized ``filters``. ``page`` is a
+    keyset page (see ``main.pagination``) after ``cursor`` whose
+    ``object_list`` is a list of profiles with users, services and photos
+    loaded, and ``distance_km`` set for proximity searches. A text query
+    that finds nothing is retried with close spellings (``facets['fuzzy']``).
+    On a cache hit the filters aren't even evaluated.
+    """
+    key = _cache_key(filters, available_only)
+    profiles = None
+
+    facets = cache.get(key)
+    if facets is None:
+        profiles = filter_profiles(filters, available_only)
+        facets = compute_facets(profiles)
+        facets['fuzzy'] = False
+        if not facets['total'] and filters.get('query'):
+            # Nothing for the words as typed: try close spellings
+            profiles = filter_profiles(filters, available_only, fuzzy=True)
+            facets = compute_facets(profiles)
+            facets['fuzzy'] = True
+        cache.set(key, facets, SEARCH_CACHE_TIMEOUT)
+
+    # Re-encoded, so only well-formed positions get this far; a garbled cursor is the first page
+    position = decode_cursor(cursor)
+    cursor = encode_cursor(*position) if position else None
+    page_key = _page_key(key, cursor)
+    cached = cache.get(page_key)
+    if cached is None:
+        if profiles is None:
+            profiles = filter_profiles(filters, available_only, fuzzy=facets['fuzzy'])
+        paginator = KeysetPaginator(
+            profiles.select_related(*PAGE_SELECT).prefetch_related(*PAGE_PREFETCH),
+            search_ordering(filters), SEARCH_PAGE_SIZE, count=facets['total'],
+        )
+        page = paginator.page(cursor)
+        if cursor is None or cache.get(f'{page_key}:linked'):
+            cache.set(page_key, (
+                [profile.id for profile in page.object_list], page.next_cursor, page.previous_cursor
+            ), SEARCH_CACHE_TIMEOUT)
+            # Its neighbours may be cached in turn
+            cache.set_many({
+                f'{_page_key(key, linked)}:linked': True
+                for linked in (page.next_cursor, page.previous_cursor) if linked
+            }, SEARCH_CACHE_TIMEOUT)
+    else:
+        # Load just the cached page's rows by primary key
+        ids, next_cursor, previous_cursor = cached
+        by_id = Profile.objects.select_related(*PAGE_SELECT).prefetch_related(*PAGE_PREFETCH).in_bulk(ids)
+        paginator = KeysetPaginator(Profile.objects.none(), search_ordering(filters), SEARCH_PAGE_SIZE,
+                                    count=facets['total'])
+        page = KeysetPage([by_id[pk] for pk in ids if pk in by_id], paginator, next_cursor, previous_cursor)
+
+    center = search_center(filters)
+    for profile in page.object_list:
+        profile.distance_km = None
+        if center and profile.latitude is not None:
+            profile.distance_km = round(haversine_km(*center, profile.latitude, profile.longitude), 1)
+    return page, facets
+
+
+# ==================== INVALIDATION ====================
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or instance.has_changed(SEARCH_FIELDS, update_fields):
+        invalidate_search_results()
+
+
+@receiver(post_delete, sender=Profile)
+@receiver([post_save, post_delete], sender=Service)
+def profile_changed(sender, instance, **kwargs):
+    invalidate_search_results()
@@ -4,7 +4,7 @@ from django.contrib.auth.models import User
 from .models import (
     Profile, Photo, Video, Post, Comment, Contact, 
     Message, Conversation, CallLog, Wallet, Transaction,
-    ServiceBooking, SavedSearch, Invitation, UserSetting
+    ServiceBooking, SavedSearch, Invitation, UserSetting, Service
 )
 
 # ==================== AUTHENTICATION FORMS ====================
@@ -244,7 +244,15 @@ class SearchForm(forms.Form):
     min_age = forms.IntegerField(min_value=18, max_value=100, required=False)
     max_age = forms.IntegerField(min_value=18, max_value=100, required=False)
     services = forms.CharField(max_length=255, required=False)
+    near = forms.CharField(max_length=100, required=False)
+    lat = forms.FloatField(min_value=-90, max_value=90, required=False)
+    lng = forms.FloatField(min_value=-180, max_value=180, required=False)
+    radius = forms.IntegerField(min_value=1, max_value=500, required=False)
     is_vip = forms.BooleanField(required=False)
+    
+    def clean_services(self):
+        """Comma-separated service names as slugs; profiles must offer all of them"""
+        return [slug for slug, _ in Service.parse(self.cleaned_data.get('services'))]
 
 class InvitationForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,184 @@
+# main/geo.py
+"""
+Proximity search over profiles.
+
+Profiles carry ``latitude``/``longitude`` and a geohash of them. When the
+coordinates aren't supplied they are geocoded offline from ``city_town`` /
+``county`` against the bundled gazetteer (``data/kenya_places.csv``: the 47
+county headquarters plus the larger towns and Nairobi neighbourhoods), so
+no request ever waits on an external geocoding service.
+
+``within_radius`` turns a radius into the handful of geohash cells that
+cover its bounding box. The database answers those with prefix range scans
+on the indexed ``geohash`` column instead of scanning every profile, then
+checks the exact distance on that small candidate set. The distance uses
+an equirectangular approximation, which is plain arithmetic in SQL (SQLite
+has no trig functions) and accurate to well under 1% at city scale.
+``nearest`` widens the radius until it has k candidates.
+"""
+import csv
+import math
+import os
+from functools import lru_cache
+
+from django.db.models import ExpressionWrapper, F, FloatField, Q
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from .models import Profile
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), 'data', 'kenya_places.csv')
+GEOHASH_PRECISION = 9
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+KM_PER_DEGREE = 111.32
+EARTH_RADIUS_KM = 6371.0
+DEFAULT_RADIUS_KM = 25
+MAX_RADIUS_KM = 1000
+MAX_COVER_CELLS = 16
+
+
+# ==================== GEOCODING ====================
+
+def _normalize_place(name):
+    name = (name or '').lower().replace('-', ' ').replace("'", '')
+    words = [word for word in name.split() if word not in ('county', 'town', 'city', 'cbd')]
+    return ' '.join(words)
+
+
+@lru_cache(maxsize=1)
+def gazetteer():
+    """``{'towns': {name: (lat, lng)}, 'counties': {name: (lat, lng)}}`` from the bundled CSV"""
+    places = {'towns': {}, 'counties': {}}
+    with open(GAZETTEER_PATH, newline='', encoding='utf-8') as handle:
+        for row in csv.DictReader(handle):
+            point = (float(row['latitude']), float(row['longitude']))
+            kind = 'counties' if row['kind'] == 'county' else 'towns'
+            places[kind].setdefault(_normalize_place(row['name']), point)
+    return places
+
+
+def geocode(*names):
+    """Coordinates of the first of ``names`` found as a town, then as a county"""
+    places = gazetteer()
+    for kind in ('towns', 'counties'):
+        for name in names:
+            point = places[kind].get(_normalize_place(name))
+            if point:
+                return point
+    return None
+
+
+# ==================== GEOHASH ====================
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value, bounds = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """``(height, width)`` in degrees of a geohash cell"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """``(south, north, west, east)`` around a point"""
+    dlat = radius_km / KM_PER_DEGREE
+    dlng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return (max(latitude - dlat, -90.0), min(latitude + dlat, 90.0),
+            max(longitude - dlng, -180.0), min(longitude + dlng, 180.0))
+
+
+def covering_cells(latitude, longitude, radius_km, max_cells=MAX_COVER_CELLS):
+    """The finest set of at most ``max_cells`` geohash prefixes covering the radius"""
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((north + 90) / height) - math.floor((south + 90) / height) + 1
+        cols = math.floor((east + 180) / width) - math.floor((west + 180) / width) + 1
+        if rows * cols <= max_cells:
+            break
+    cells = set()
+    for row in range(rows):
+        cell_lat = min((math.floor((south + 90) / height) + row + 0.5) * height - 90, 90.0)
+        for col in range(cols):
+            cell_lng = min((math.floor((west + 180) / width) + col + 0.5) * width - 180, 180.0)
+            cells.add(geohash_encode(cell_lat, cell_lng, precision))
+    return sorted(cells)
+
+
+# ==================== QUERIES ====================
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """
+    Profiles of ``queryset`` within ``radius_km`` of the point, annotated
+    with ``distance_sq`` (squared km) for ordering.
+    """
+    # Prefix match as a range so it is an index range scan on every backend
+    # (SQLite can't use an index for Django's LIKE ... ESCAPE)
+    cells = Q()
+    for cell in covering_cells(latitude, longitude, radius_km):
+        cells |= Q(geohash__gte=cell, geohash__lt=cell + '~')
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+
+    lng_scale = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    dy = (F('latitude') - latitude) * KM_PER_DEGREE
+    dx = (F('longitude') - longitude) * lng_scale
+    return queryset.filter(
+        cells,
+        latitude__range=(south, north),
+        longitude__range=(west, east),
+    ).annotate(
+        distance_sq=ExpressionWrapper(dy * dy + dx * dx, output_field=FloatField())
+    ).filter(distance_sq__lte=radius_km * radius_km)
+
+
+def nearest(queryset, latitude, longitude, k, radius_km=5, max_radius_km=MAX_RADIUS_KM):
+    """The ``k`` profiles closest to the point, widening the search radius as needed"""
+    while True:
+        candidates = within_radius(queryset, latitude, longitude, radius_km)
+        if radius_km >= max_radius_km or candidates.count() >= k:
+            return candidates.order_by('distance_sq')[:k]
+        radius_km *= 4
+
+
+# ==================== SYNC ====================
+
+@receiver(pre_save, sender=Profile)
+def locate_profile(sender, instance, **kwargs):
+    """Geocode from the place names when they change, and keep the geohash in step"""
+    place = (instance.city_town, instance.county)
+    if instance.latitude is None or place != getattr(instance, '_loaded_place', place):
+        point = geocode(instance.city_town, instance.county)
+        if point:
+            instance.latitude, instance.longitude = point
+        instance._loaded_place = place
+    if instance.latitude is not None and instance.longitude is not None:
+        instance.geohash = geohash_encode(instance.latitude, instance.longitude)
+    else:
+        instance.geohash = ''
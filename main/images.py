@@ -0,0 +1,424 @@
+# main/images.py
+"""
+Resized, re-encoded copies ("derivatives") of uploaded photos and post images.
+
+``Photo.image`` and ``Post.image`` used to be served only as the original
+upload (up to 5 MB), so a page of 80px search avatars could pull tens of
+megabytes. Each original now gets, in a ``derived/`` directory next to it:
+
+* a square ``thumb`` for avatars, and ``small``/``medium``/``large`` copies
+  bounded by width for ``srcset``;
+* each in AVIF (when Pillow was built with it), WebP and JPEG, the JPEG
+  being the fallback for browsers without either.
+
+Derivatives never carry EXIF (camera details, GPS position), and the
+original is rewritten keeping only its Orientation tag; JPEGs keep their
+quantization tables, so the pixels are untouched. A content-addressed
+original (``main.storage``) can't change under its hash, so its stripped
+copy becomes a new blob and the rows are moved to it (``strip_metadata``).
+
+They are generated by a background task queued when a photo or post image
+is saved, and otherwise on first request: until they exist ``variant_url`` hands out the URL of the
+``image_derivative`` view, which generates them and redirects to the file.
+The view only generates them for images a Photo or Post refers to
+(``is_public_image``); message attachments share the blob store but are
+private.
+Whether an original's derivatives exist is cached, so rendering a URL costs
+a cache lookup, not a storage round trip. ``manage.py
+generate_image_derivatives`` regenerates a whole tree with a process pool.
+"""
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.urls import reverse
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from .models import Photo, Post
+from .storage import BLOB_DIR, is_blob_name
+from .tasks import Retry, enqueue, task
+
+logger = logging.getLogger(__name__)
+
+THUMB = 'thumb'
+THUMB_SIZE = 160
+# Responsive sizes, bounded by width
+WIDTHS = {'small': 320, 'medium': 640, 'large': 1280}
+SIZES = [THUMB, *WIDTHS]
+
+FALLBACK_FORMAT = 'jpeg'
+FORMATS = (['avif'] if features.check('avif') else []) + ['webp', FALLBACK_FORMAT]
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+QUALITY = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', {'avif': 55, 'webp': 78, 'jpeg': 82})
+# libavif's default speed takes seconds per image; 8 is ~15x faster for a
+# few percent in size
+AVIF_SPEED = 8
+
+DERIVED_DIR = 'derived'
+# Storage directories holding originals; the lazy view refuses anything else.
+# blobs/ (main.storage) also holds videos, audio and message attachments, so
+# only image extensions count there, and only Photo and Post images get derivatives
+IMAGE_DIRS = ('photos/', 'posts/images/', f'{BLOB_DIR}/')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff', '.avif', '.heic', '.heif')
+# Originals whose EXIF is stripped in place
+STRIPPED_FORMATS = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP'}
+ORIENTATION = 0x0112
+GPS_IFD = 0x8825
+
+READY_TIMEOUT = 60 * 60 * 24
+# Short, so a failed or in-flight generation is retried soon
+MISSING_TIMEOUT = 60
+LOCK_TIMEOUT = 60
+
+
+class ImageProcessingError(Exception):
+    """The original is missing or is not an image Pillow can read"""
+
+
+def derivative_name(name, size, fmt=FALLBACK_FORMAT):
+    """``photos/2024/01/02/a.jpg`` -> ``photos/2024/01/02/derived/a.jpg.medium.webp``"""
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, DERIVED_DIR, f'{filename}.{size}.{EXTENSIONS[fmt]}')
+
+
+def parse_derivative_name(name):
+    """Inverse of ``derivative_name``: ``(original, size, fmt)``, or None if ``name`` isn't one"""
+    directory, filename = posixpath.split(name)
+    parent, derived_dir = posixpath.split(directory)
+    parts = filename.rsplit('.', 2)
+    if derived_dir != DERIVED_DIR or len(parts) != 3:
+        return None
+    original, size, extension = parts
+    fmt = next((fmt for fmt in FORMATS if EXTENSIONS[fmt] == extension), None)
+    if size not in SIZES or fmt is None:
+        return None
+    return posixpath.join(parent, original), size, fmt
+
+
+def is_original_name(name):
+    """Whether ``name`` is an original the pipeline handles"""
+    name = posixpath.normpath(name)
+    return (
+        name.startswith(IMAGE_DIRS) and '..' not in name.split('/')
+        and f'/{DERIVED_DIR}/' not in f'/{name}'
+        and (not is_blob_name(name) or posixpath.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    )
+
+
+def _ready_key(name):
+    return f"image-derivatives:{hashlib.md5(name.encode()).hexdigest()}"
+
+
+def _marker(name):
+    # Written last, so its presence means the whole set is there
+    return derivative_name(name, THUMB, FALLBACK_FORMAT)
+
+
+def derivatives_ready(names, storage=None):
+    """``{name: bool}``: whether each original's derivatives exist (cached)"""
+    storage = storage or default_storage
+    keys = {name: _ready_key(name) for name in names}
+    cached = cache.get_many(keys.values())
+    ready = {}
+    for name, key in keys.items():
+        if key not in cached:
+            cached[key] = storage.exists(_marker(name))
+            cache.set(key, cached[key], READY_TIMEOUT if cached[key] else MISSING_TIMEOUT)
+        ready[name] = cached[key]
+    return ready
+
+
+def _url(name, size, fmt, ready, storage):
+    derived = derivative_name(name, size, fmt)
+    if ready:
+        return storage.url(derived)
+    return reverse('image_derivative', args=[derived])
+
+
+def variant_urls(names, size=THUMB, fmt=FALLBACK_FORMAT, storage=None):
+    """``{name: url}`` of one variant of each original, with one cache round trip"""
+    storage = storage or default_storage
+    names = [name for name in names if name]
+    ready = derivatives_ready(names, storage)
+    return {name: _url(name, size, fmt, ready[name], storage) for name in names}
+
+
+def variant_url(image, size=THUMB, fmt=FALLBACK_FORMAT):
+    """URL of one variant of ``image`` (a FieldFile or storage name), or None when empty"""
+    name = getattr(image, 'name', image)
+    if not name:
+        return None
+    storage = getattr(image, 'storage', None) or default_storage
+    return variant_urls([name], size, fmt, storage)[name]
+
+
+def srcset(image, fmt=FALLBACK_FORMAT):
+    """``srcset`` value listing the responsive widths of ``image`` in ``fmt``"""
+    name = getattr(image, 'name', image)
+    if not name:
+        return ''
+    storage = getattr(image, 'storage', None) or default_storage
+    ready = derivatives_ready([name], storage)[name]
+    return ', '.join(f'{_url(name, size, fmt, ready, storage)} {width}w' for size, width in WIDTHS.items())
+
+
+def picture_sources(image, size):
+    """
+    What a ``<picture>`` element for ``image`` needs, with one cache lookup:
+    ``(sources, src, fallback_srcset)`` where ``sources`` is ``[(mime type,
+    srcset)]`` for the modern formats. Thumbs are fixed-size, so their
+    ``srcset`` is a single URL; other sizes list every responsive width.
+    """
+    name = getattr(image, 'name', image)
+    storage = getattr(image, 'storage', None) or default_storage
+    ready = derivatives_ready([name], storage)[name]
+
+    def candidates(fmt):
+        if size == THUMB:
+            return _url(name, THUMB, fmt, ready, storage)
+        return ', '.join(f'{_url(name, width_size, fmt, ready, storage)} {width}w' for width_size, width in WIDTHS.items())
+
+    sources = [(MIME_TYPES[fmt], candidates(fmt)) for fmt in FORMATS if fmt != FALLBACK_FORMAT]
+    return sources, _url(name, size, FALLBACK_FORMAT, ready, storage), candidates(FALLBACK_FORMAT)
+
+
+def _encode(image, fmt, icc_profile):
+    if fmt == 'jpeg' and image.mode == 'RGBA':
+        # JPEG has no alpha: flatten onto white
+        flattened = Image.new('RGB', image.size, (255, 255, 255))
+        flattened.paste(image, mask=image.getchannel('A'))
+        image = flattened
+    options = {'quality': QUALITY[fmt]}
+    if fmt == 'jpeg':
+        options.update(optimize=True, progressive=True)
+    elif fmt == 'webp':
+        options['method'] = 4
+    elif fmt == 'avif':
+        options['speed'] = AVIF_SPEED
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    buffer = BytesIO()
+    # No exif= argument, so none is written
+    image.save(buffer, fmt.upper(), **options)
+    return buffer.getvalue()
+
+
+def _replace(storage, name, data):
+    if storage.exists(name):
+        storage.delete(name)
+    saved = storage.save(name, ContentFile(data))
+    if saved != name:
+        # Another process wrote it in between; theirs is as good as ours
+        storage.delete(saved)
+
+
+def _load(storage, name):
+    """Open, orient and decode ``name``, at reduced scale where JPEG allows it"""
+    try:
+        with storage.open(name, 'rb') as source:
+            image = Image.open(source)
+            icc_profile = image.info.get('icc_profile')
+            if image.format == 'JPEG':
+                largest = max(WIDTHS.values())
+                image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except FileNotFoundError as error:
+        raise ImageProcessingError(f'{name} does not exist') from error
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as error:
+        raise ImageProcessingError(f'{name} is not a readable image: {error}') from error
+    if image.mode not in ('RGB', 'RGBA'):
+        # The ICC profile describes the old mode (e.g. CMYK), so drop it
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        icc_profile = None
+    return image, icc_profile
+
+
+def _resized(image):
+    """``{size: image}``, each responsive size resized from the next larger one"""
+    resized = {}
+    source = image
+    for size, width in sorted(WIDTHS.items(), key=lambda item: -item[1]):
+        if source.width > width:
+            height = max(1, round(source.height * width / source.width))
+            source = source.resize((width, height), Image.Resampling.LANCZOS)
+        resized[size] = source
+    resized[THUMB] = ImageOps.fit(source, (THUMB_SIZE, THUMB_SIZE), Image.Resampling.LANCZOS)
+    return resized
+
+
+def _stripped(name, storage):
+    """``name``'s bytes with no EXIF but its orientation, or None when there is nothing to strip"""
+    try:
+        with storage.open(name, 'rb') as source:
+            image = Image.open(source)
+            exif = image.getexif()
+            save_format = STRIPPED_FORMATS.get(image.format)
+            if save_format is None or not (set(exif) - {ORIENTATION} or exif.get_ifd(GPS_IFD)):
+                return None
+            kept = Image.Exif()
+            if exif.get(ORIENTATION, 1) != 1:
+                kept[ORIENTATION] = exif[ORIENTATION]
+            options = {'exif': kept.tobytes()}
+            if image.info.get('icc_profile'):
+                options['icc_profile'] = image.info['icc_profile']
+            if save_format == 'JPEG':
+                # Re-use the original quantization tables: no visible loss
+                options['quality'] = 'keep'
+            elif save_format == 'WEBP':
+                options['lossless'] = image.info.get('lossless', False)
+                options['quality'] = 90
+            image.load()
+            buffer = BytesIO()
+            image.save(buffer, save_format, **options)
+    except FileNotFoundError as error:
+        raise ImageProcessingError(f'{name} does not exist') from error
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as error:
+        raise ImageProcessingError(f'{name} is not a readable image: {error}') from error
+    return buffer.getvalue()
+
+
+def _replaced_key(name):
+    return f"image-replaced:{hashlib.md5(name.encode()).hexdigest()}"
+
+
+def current_original(name):
+    """The name ``name``'s image lives under now; a blob that ``strip_metadata`` replaced maps to its copy"""
+    return cache.get(_replaced_key(name)) or name
+
+
+def strip_metadata(name, storage=None):
+    """
+    Remove the original's EXIF but its orientation and return the name now
+    holding the image. A blob is stored again under the stripped bytes' hash
+    and every row pointing at it moved there; other files are rewritten in place.
+    """
+    storage = storage or default_storage
+    data = _stripped(name, storage)
+    if data is None:
+        return name
+    if not is_blob_name(name):
+        _replace(storage, name, data)
+        return name
+    from .blobs import repoint
+    from .storage import blob_storage
+    stripped = blob_storage.save(name, ContentFile(data))
+    repoint(name, stripped)
+    # Pages rendered before the move still link the old name's derivatives
+    cache.set(_replaced_key(name), stripped, READY_TIMEOUT)
+    return stripped
+
+
+def generate_derivatives(name, storage=None, strip=True):
+    """
+    Write every derivative of the original ``name`` (after stripping its EXIF
+    when ``strip``, which may move a blob to a new name). Returns the
+    derivative names; raises ``ImageProcessingError`` if ``name`` is missing
+    or not an image.
+    """
+    storage = storage or default_storage
+    if strip:
+        # First, so the derivatives are named after the stripped original
+        name = strip_metadata(name, storage)
+    image, icc_profile = _load(storage, name)
+    resized = _resized(image)
+    marker = _marker(name)
+    variants = [(size, fmt) for size in SIZES for fmt in FORMATS if derivative_name(name, size, fmt) != marker]
+    written = []
+    for size, fmt in variants + [(THUMB, FALLBACK_FORMAT)]:
+        derived = derivative_name(name, size, fmt)
+        _replace(storage, derived, _encode(resized[size], fmt, icc_profile))
+        written.append(derived)
+    mark_ready(name)
+    return written
+
+
+def delete_derivatives(name, storage=None):
+    """Delete every derivative of ``name`` (in any format) and forget they existed"""
+    storage = storage or default_storage
+    for size in SIZES:
+        for fmt in EXTENSIONS:
+            derived = derivative_name(name, size, fmt)
+            if storage.exists(derived):
+                storage.delete(derived)
+    cache.delete(_ready_key(name))
+
+
+def mark_ready(name):
+    """Record that ``name``'s derivatives exist (e.g. after another process wrote them)"""
+    cache.set(_ready_key(name), True, READY_TIMEOUT)
+
+
+def ensure_derivatives(name, storage=None, derived=None):
+    """
+    Generate ``name``'s derivatives unless they (and ``derived``, if given)
+    exist or another request is already generating them. Returns True once
+    they exist.
+    """
+    storage = storage or default_storage
+    name = current_original(name)
+    if derivatives_ready([name], storage)[name] and (derived is None or storage.exists(derived)):
+        return True
+    lock = f'{_ready_key(name)}:lock'
+    if not cache.add(lock, True, LOCK_TIMEOUT):
+        return False
+    try:
+        generate_derivatives(name, storage)
+        return True
+    finally:
+        cache.delete(lock)
+
+
+@task(priority=5)
+def generate_image_derivatives(name):
+    """Background half of ``process_upload``"""
+    try:
+        if not ensure_derivatives(name):
+            raise Retry('Being generated by the image_derivative view', delay=LOCK_TIMEOUT)
+    except ImageProcessingError as error:
+        # Retrying won't make it an image
+        logger.warning('Skipping image derivatives: %s', error)
+
+
+def is_public_image(name):
+    """Whether a Photo or a Post shows ``name``; only those get derivatives on request"""
+    return Photo.objects.filter(image=name).exists() or Post.objects.filter(image=name).exists()
+
+
+def public_image_names():
+    """Every original a Photo or Post shows, for walking the blob store"""
+    photos = Photo.objects.exclude(image='').values_list('image', flat=True)
+    posts = Post.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True)
+    return set(photos) | set(posts)
+
+
+def process_upload(image):
+    """Queue derivative generation for a just-saved FieldFile"""
+    if image and is_original_name(image.name):
+        enqueue(generate_image_derivatives, {'name': image.name}, idempotency_key=f'image-derivatives:{image.name}')
+        # Run eagerly, stripping may have moved the rows to a new blob; don't
+        # let this instance save the old name back
+        image.name = current_original(image.name)
+
+
+@receiver(post_save, sender=Photo)
+def photo_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        process_upload(instance.image)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image:
+        return
+    storage = instance.image.storage
+    if not derivatives_ready([instance.image.name], storage)[instance.image.name]:
+        process_upload(instance.image)
@@ -0,0 +1,77 @@
+# main/inbox.py
+"""
+Set-based inbox assembly.
+
+The inbox used to resolve unread counts, the other participant and their
+profile one conversation at a time. ``build_inbox`` does the same work for a
+whole page of conversations in a fixed number of queries:
+
+1. conversations (with the stored unread counter as a subquery)
+2. the other participants, joined to their profiles and primary photos
+"""
+from django.db.models import IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Conversation, UnreadCounter
+from .pagination import KeysetPaginator
+
+INBOX_PAGE_SIZE = 30
+
+
+def unread_count_subquery(user):
+    """``user``'s stored unread counter for the outer conversation"""
+    unread = UnreadCounter.objects.filter(
+        conversation=OuterRef('pk'),
+        user=user,
+    ).values('count')[:1]
+    return Coalesce(Subquery(unread, output_field=IntegerField()), 0)
+
+
+def attach_participants(conversations, user):
+    """
+    Set ``other_participant``, ``other_profile`` and ``other_photo`` on each
+    conversation using one query regardless of how many there are.
+    """
+    by_id = {conversation.id: conversation for conversation in conversations}
+    for conversation in conversations:
+        conversation.other_participant = None
+        conversation.other_profile = None
+        conversation.other_photo = None
+    if not by_id:
+        return conversations
+
+    memberships = Conversation.participants.through.objects.filter(
+        conversation_id__in=by_id,
+    ).exclude(user_id=user.id).select_related(
+        'user__profile__primary_photo'
+    ).order_by('conversation_id', 'user_id')
+
+    for membership in memberships:
+        conversation = by_id[membership.conversation_id]
+        # Group chats are not a thing yet; keep the first "other" like before
+        if conversation.other_participant is not None:
+            continue
+        other = membership.user
+        conversation.other_participant = other
+        conversation.other_profile = getattr(other, 'profile', None)
+        if conversation.other_profile is not None:
+            conversation.other_photo = conversation.other_profile.primary_photo
+    return conversations
+
+
+def build_inbox(user, cursor=None, limit=INBOX_PAGE_SIZE):
+    """
+    Return ``(conversations, next_cursor)`` for one page of ``user``'s inbox.
+
+    Conversations are ordered newest first by ``last_message_at`` (empty
+    conversations last) and carry ``unread_count``, ``other_participant``,
+    ``other_profile`` and ``other_photo``. ``next_cursor`` is ``None`` on the
+    last page.
+    """
+    conversations = Conversation.objects.filter(participants=user).annotate(
+        unread_count=unread_count_subquery(user)
+    )
+    page = KeysetPaginator(conversations, ['-last_message_at', '-id'], limit).page(cursor)
+
+    attach_participants(page.object_list, user)
+    return page.object_list, page.next_cursor
@@ -0,0 +1,84 @@
+# main/interactions.py
+"""
+Like toggles for posts and videos.
+
+The interaction row and the denormalized ``likes`` counter change in one
+transaction, and the counter moves by a ``F()`` delta in a single UPDATE
+instead of being recomputed in Python and saved with the rest of the row.
+Concurrent likes on a busy post only contend on that one column, and a
+double-submitted toggle can't push the counter out of step with the rows.
+
+``reconcile_like_counts`` recomputes the counters from the interaction
+tables if they ever drift (bulk imports, manual deletes).
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Post, PostInteraction, Video, VideoLike
+
+
+def _toggle(model, counter_model, counter_pk, counter_field, **lookup):
+    """
+    Delete the row matching ``lookup`` or create it, and move
+    ``counter_model.counter_field`` by the same amount when ``counter_field``
+    is set. Returns ``(is_active, counter value)``.
+    """
+    with transaction.atomic():
+        deleted, _ = model.objects.filter(**lookup).delete()
+        if deleted:
+            is_active, delta = False, -1
+        else:
+            try:
+                with transaction.atomic():
+                    model.objects.create(**lookup)
+                is_active, delta = True, 1
+            except IntegrityError:
+                # A concurrent request created it first; that one counted it
+                is_active, delta = True, 0
+
+        counters = counter_model.objects.filter(pk=counter_pk)
+        if counter_field and delta:
+            counters.update(**{counter_field: Greatest(F(counter_field) + delta, Value(0))})
+        count = counters.values_list(counter_field or 'likes', flat=True).first()
+    return is_active, count
+
+
+def toggle_post_interaction(user, post, interaction_type):
+    """Toggle a like/save/share/report; only likes are counted on the post"""
+    counter_field = 'likes' if interaction_type == 'like' else None
+    return _toggle(
+        PostInteraction, Post, post.pk, counter_field,
+        user=user, post=post, interaction_type=interaction_type,
+    )
+
+
+def toggle_video_like(user, video):
+    return _toggle(VideoLike, Video, video.pk, 'likes', user=user, video=video)
+
+
+def _count_subquery(model, fk, **filters):
+    counts = model.objects.filter(**{fk: OuterRef('pk')}, **filters).order_by().values(fk).annotate(
+        total=Count('id')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def reconcile_like_counts(dry_run=False):
+    """
+    Recompute ``Post.likes`` and ``Video.likes`` from the interaction tables
+    with one UPDATE per model. Returns ``{'posts': n, 'videos': n}``, the
+    number of rows whose counter had drifted.
+    """
+    targets = {
+        'posts': (Post, _count_subquery(PostInteraction, 'post', interaction_type='like')),
+        'videos': (Video, _count_subquery(VideoLike, 'video')),
+    }
+    drifted = {}
+    with transaction.atomic():
+        for name, (model, actual) in targets.items():
+            stale = model.objects.annotate(actual_likes=actual).exclude(likes=F('actual_likes'))
+            drifted[name] = stale.count()
+            if drifted[name] and not dry_run:
+                model.objects.filter(pk__in=stale.values('pk')).update(likes=actual)
+    return drifted
@@ -0,0 +1,51 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from main.benchmarks import scratch_database
+from main.models import Profile, UserSetting, Wallet
+from main.provisioning import BACKFILL_BATCH_SIZE, PHONE_PLACEHOLDER, PROFILE_DEFAULTS, backfill_users
+
+
+def legacy_backfill():
+    """The old create_user_profiles loop, kept for comparison"""
+    for user in User.objects.all():
+        if not hasattr(user, 'profile'):
+            Profile.objects.create(user=user, phone_number=PHONE_PLACEHOLDER.format(user.id), **PROFILE_DEFAULTS)
+        if not hasattr(user, 'wallet'):
+            Wallet.objects.create(user=user)
+        if not hasattr(user, 'settings'):
+            UserSetting.objects.create(user=user)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark create_user_profiles (per-user loop vs chunked bulk backfill) against a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--legacy-users', type=int, default=2000, help='Users for the (slow) per-user loop')
+        parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+        parser.add_argument('--on-disk', action='store_true', help='Use an on-disk scratch database')
+
+    def seed(self, count):
+        # bulk_create skips the provisioning receiver, like users imported before it existed
+        User.objects.bulk_create([User(username=f'user_{i}') for i in range(count)], batch_size=10000)
+
+    def run(self, label, count, func):
+        with scratch_database(on_disk=self.on_disk):
+            self.seed(count)
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            complete = Profile.objects.count() == Wallet.objects.count() == UserSetting.objects.count() == count
+        rate = count / elapsed
+        self.stdout.write(
+            f'{label:>8} {count:>9} {elapsed:>9.1f} {rate:>10.0f} {count and 1_000_000 / rate / 60:>12.1f} {str(complete):>9}'
+        )
+
+    def handle(self, *args, **options):
+        self.on_disk = options['on_disk']
+        self.stdout.write(f"{'mode':>8} {'users':>9} {'seconds':>9} {'users/s':>10} {'min per 1M':>12} {'complete':>9}")
+        self.run('legacy', options['legacy_users'], legacy_backfill)
+        self.run('bulk', options['users'], lambda: backfill_users(batch_size=options['batch_size']))
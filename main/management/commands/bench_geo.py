@@ -0,0 +1,83 @@
+import math
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import ExpressionWrapper, F, FloatField
+
+from main.benchmarks import scratch_database, measure
+from main.geo import KM_PER_DEGREE, gazetteer, geohash_encode, nearest, within_radius
+from main.models import Profile
+
+CENTERS = {
+    'Nairobi': (-1.2864, 36.8172),
+    'Lodwar': (3.1191, 35.5973),
+}
+
+
+def scan_radius(latitude, longitude, radius_km):
+    """Distance check on every profile, without the geohash/bounding box prefilter"""
+    lng_scale = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    dy = (F('latitude') - latitude) * KM_PER_DEGREE
+    dx = (F('longitude') - longitude) * lng_scale
+    return list(Profile.objects.annotate(
+        distance_sq=ExpressionWrapper(dy * dy + dx * dx, output_field=FloatField())
+    ).filter(distance_sq__lte=radius_km * radius_km).order_by().values_list('id', flat=True))
+
+
+def indexed_radius(latitude, longitude, radius_km):
+    return list(within_radius(Profile.objects.all(), latitude, longitude, radius_km).order_by().values_list('id', flat=True))
+
+
+def indexed_nearest(latitude, longitude, k):
+    return list(nearest(Profile.objects.all(), latitude, longitude, k).values_list('id', flat=True))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark radius and nearest-neighbour profile queries against a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=100000)
+        parser.add_argument('--radii', default='1,5,25,100', help='Comma separated radii in km')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def seed(self, count):
+        """Scatter profiles around the gazetteer's places, ~5km either side"""
+        rng = random.Random(0)
+        places = list(gazetteer()['towns'].values()) + list(gazetteer()['counties'].values())
+        users = User.objects.bulk_create([User(username=f'geo_{i}') for i in range(count)], batch_size=5000)
+        profiles = []
+        for i, user in enumerate(users):
+            base_lat, base_lng = rng.choice(places)
+            latitude = base_lat + rng.gauss(0, 0.05)
+            longitude = base_lng + rng.gauss(0, 0.05)
+            profiles.append(Profile(
+                user=user, phone_number=f'07{i:08d}',
+                latitude=latitude, longitude=longitude,
+                geohash=geohash_encode(latitude, longitude),
+            ))
+        # bulk_create skips the geocoding receiver, so the geohash is set above
+        Profile.objects.bulk_create(profiles, batch_size=5000)
+
+    def handle(self, *args, **options):
+        radii = [float(radius) for radius in options['radii'].split(',')]
+        repeat = options['repeat']
+
+        with scratch_database():
+            self.seed(options['profiles'])
+            self.stdout.write(f"{options['profiles']} profiles")
+            self.stdout.write(f"{'center':>8} {'radius km':>10} {'hits':>6} {'scan ms':>8} {'indexed ms':>11}")
+            for name, (latitude, longitude) in CENTERS.items():
+                for radius in radii:
+                    _, scan_ms = measure(scan_radius, latitude, longitude, radius, repeat=repeat)
+                    _, indexed_ms = measure(indexed_radius, latitude, longitude, radius, repeat=repeat)
+                    hits = indexed_radius(latitude, longitude, radius)
+                    if sorted(hits) != sorted(scan_radius(latitude, longitude, radius)):
+                        self.stderr.write(f'{name} {radius}km: indexed results differ from the full scan')
+                    self.stdout.write(f'{name:>8} {radius:>10g} {len(hits):>6} {scan_ms:>8.1f} {indexed_ms:>11.1f}')
+
+            self.stdout.write(f"\n{'center':>8} {'k':>6} {'nearest ms':>11}")
+            for name, (latitude, longitude) in CENTERS.items():
+                for k in (10, 100):
+                    queries, nearest_ms = measure(indexed_nearest, latitude, longitude, k, repeat=repeat)
+                    self.stdout.write(f'{name:>8} {k:>6} {nearest_ms:>11.1f}')
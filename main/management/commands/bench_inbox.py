@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import timedelta
+
+from main.benchmarks import scratch_database, measure
+from main.inbox import build_inbox
+from main.models import Profile, Photo, Conversation, Message, UnreadCounter
+
+
+def legacy_inbox(user):
+    """The old per-conversation loop from inbox_view, kept for comparison"""
+    conversations = list(Conversation.objects.filter(participants=user).order_by('-last_message_at'))
+    for conversation in conversations:
+        conversation.unread_count = Message.objects.filter(
+            conversation=conversation,
+            is_read=False
+        ).exclude(sender=user).count()
+        other_participant = conversation.participants.exclude(id=user.id).first()
+        conversation.other_participant = other_participant
+        conversation.other_profile = other_participant.profile if other_participant else None
+    return conversations
+
+
+class Command(BaseCommand):
+    help = 'Benchmark inbox assembly (query count and latency) against a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10,100,1000,5000',
+            help='Comma separated conversation counts to benchmark'
+        )
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def seed(self, owner, start, count):
+        """Create ``count`` one-to-one conversations for ``owner``, each with a photo and two messages"""
+        now = timezone.now()
+        others = User.objects.bulk_create([
+            User(username=f'bench_{start + i}') for i in range(count)
+        ])
+        profiles = Profile.objects.bulk_create([
+            Profile(user=other, phone_number=f'07{start + i:08d}') for i, other in enumerate(others)
+        ])
+        Photo.objects.bulk_create([
+            Photo(profile=profile, image=f'photos/bench/{profile.user_id}.jpg', is_primary=True)
+            for profile in profiles
+        ])
+        conversations = Conversation.objects.bulk_create([
+            Conversation(last_message='hello', last_message_at=now - timedelta(minutes=start + i))
+            for i in range(count)
+        ])
+        Through = Conversation.participants.through
+        Through.objects.bulk_create(
+            [Through(conversation=c, user=owner) for c in conversations] +
+            [Through(conversation=c, user=o) for c, o in zip(conversations, others)]
+        )
+        Message.objects.bulk_create(
+            [Message(conversation=c, sender=o, content='hi', is_read=bool(i % 3))
+             for i, (c, o) in enumerate(zip(conversations, others))] +
+            [Message(conversation=c, sender=owner, content='hey') for c in conversations]
+        )
+        # bulk_create skips Message.save, so seed the matching counters directly
+        UnreadCounter.objects.bulk_create([
+            UnreadCounter(user=owner, conversation=c, count=1)
+            for i, c in enumerate(conversations) if not i % 3
+        ])
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        repeat = options['repeat']
+
+        with scratch_database():
+            owner = User.objects.create(username='bench_owner')
+            seeded = 0
+
+            self.stdout.write(f"{'conversations':>14} {'legacy q':>9} {'legacy ms':>10} {'page q':>7} {'page ms':>8} {'all pages q':>12} {'all pages ms':>13}")
+            for size in sizes:
+                self.seed(owner, seeded, size - seeded)
+                seeded = size
+
+                legacy_q, legacy_ms = measure(legacy_inbox, owner, repeat=repeat)
+                page_q, page_ms = measure(build_inbox, owner, repeat=repeat)
+
+                def walk_all_pages():
+                    cursor = None
+                    while True:
+                        _, cursor = build_inbox(owner, cursor=cursor)
+                        if not cursor:
+                            break
+
+                all_q, all_ms = measure(walk_all_pages, repeat=1)
+
+                self.stdout.write(f"{size:>14} {legacy_q:>9} {legacy_ms:>10.1f} {page_q:>7} {page_ms:>8.1f} {all_q:>12} {all_ms:>13.1f}")
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils import timezone
+
+from main.benchmarks import scratch_database, measure
+from main.models import Profile, ServiceBooking
+from main.pagination import KeysetPaginator, encode_cursor
+
+PER_PAGE = 10
+PAGES = [1, 10, 100, 500, 2000]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark OFFSET pagination against keyset pagination at increasing depths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=25000, help="Bookings in the benchmarked user's list")
+        parser.add_argument('--profiles', type=int, default=25000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--on-disk', action='store_true', help='Use an on-disk scratch database')
+
+    def seed(self, bookings, profiles):
+        users = User.objects.bulk_create([
+            User(username=f'user_{i}') for i in range(max(profiles, 20))
+        ], batch_size=5000)
+        now = timezone.now()
+        Profile.objects.bulk_create([
+            Profile(user=user, phone_number=f'07{i:08d}', is_vip=i % 10 == 0, is_available=True)
+            for i, user in enumerate(users[:profiles])
+        ], batch_size=5000)
+
+        owner = users[0]
+        ServiceBooking.objects.bulk_create([
+            ServiceBooking(
+                client=owner if i % 2 else users[1 + i % 19],
+                service_provider=users[1 + i % 19] if i % 2 else owner,
+                service_type='Dinner Date', total_amount=Decimal('1000'),
+                location_type='incall', booking_date=now,
+            ) for i in range(bookings)
+        ], batch_size=5000)
+        # Other users' bookings the owner's list has to skip past
+        ServiceBooking.objects.bulk_create([
+            ServiceBooking(
+                client=users[1 + i % 19], service_provider=users[1 + (i + 1) % 19],
+                service_type='Massage', total_amount=Decimal('1000'),
+                location_type='outcall', booking_date=now,
+            ) for i in range(bookings)
+        ], batch_size=5000)
+        for step in range(0, bookings * 2, 500):
+            ServiceBooking.objects.filter(id__gt=step, id__lte=step + 500).update(
+                created_at=now - timedelta(minutes=step)
+            )
+        return owner
+
+    def compare(self, label, queryset, ordering, partitions=None):
+        total = queryset.count()
+        offset_paginator = Paginator(queryset.order_by(*ordering, '-id'), PER_PAGE)
+        keyset_paginator = KeysetPaginator(queryset, ordering, PER_PAGE, partitions=partitions)
+
+        for number in PAGES:
+            if (number - 1) * PER_PAGE >= total:
+                break
+            cursor = None
+            if number > 1:
+                edge = queryset.order_by(*ordering, '-id')[(number - 1) * PER_PAGE - 1]
+                cursor = encode_cursor('next', keyset_paginator.key_of(edge))
+
+            offset_q, offset_ms = measure(lambda: list(offset_paginator.page(number)), repeat=self.repeat)
+            keyset_q, keyset_ms = measure(lambda: list(keyset_paginator.page(cursor)), repeat=self.repeat)
+            same = [row.id for row in offset_paginator.page(number)] == [row.id for row in keyset_paginator.page(cursor)]
+            self.stdout.write(
+                f'{label:>10} {number:>6} {offset_q:>5} {offset_ms:>10.1f} {keyset_q:>5} {keyset_ms:>10.1f} {str(same):>6}'
+            )
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        with scratch_database(on_disk=options['on_disk']):
+            owner = self.seed(options['bookings'], options['profiles'])
+            self.stdout.write(f"{'list':>10} {'page':>6} {'q':>5} {'offset ms':>10} {'q':>5} {'keyset ms':>10} {'same':>6}")
+            bookings = ServiceBooking.objects.filter(Q(client=owner) | Q(service_provider=owner))
+            self.compare('bookings', bookings, ['-created_at'],
+                         partitions=[Q(client=owner), Q(service_provider=owner)])
+            self.compare('search', Profile.objects.filter(is_available=True), ['-is_vip', '-last_active'])
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from main.benchmarks import scratch_database, percentile
+from main.models import Conversation, Message
+
+
+async def asgi_get(app, path, cookie, query='', on_body=None):
+    """
+    Issue a GET straight into the ASGI application and return
+    ``(status, body)``. ``on_body`` sees each body chunk as it is sent, which
+    is how streaming responses are observed.
+    """
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', b'localhost'),
+            (b'cookie', cookie.encode()),
+            (b'x-requested-with', b'XMLHttpRequest'),
+        ],
+        'client': ('127.0.0.1', 50000),
+        'server': ('localhost', 80),
+    }
+    request_sent = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = None
+    chunks = []
+
+    async def send(event):
+        nonlocal status
+        if event['type'] == 'http.response.start':
+            status = event['status']
+        elif event['type'] == 'http.response.body':
+            body = event.get('body', b'')
+            if on_body is not None:
+                on_body(body)
+            else:
+                chunks.append(body)
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return status, b''.join(chunks)
+
+
+class Command(BaseCommand):
+    help = 'Load test idle chat tabs: 2-second polling versus an SSE push stream, driven through the ASGI app'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tabs', type=int, default=1000)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mode')
+        parser.add_argument('--interval', type=float, default=2.0, help='Polling interval in seconds')
+        parser.add_argument('--messages', type=int, default=5, help='Messages sent during each run')
+
+    def handle(self, *args, **options):
+        with scratch_database(on_disk=True):
+            reader = User.objects.create_user('bench_reader', password='bench')
+            writer = User.objects.create_user('bench_writer', password='bench')
+            conversation = Conversation.objects.create()
+            conversation.participants.add(reader, writer)
+
+            client = Client()
+            client.force_login(reader)
+            cookie = f"sessionid={client.cookies['sessionid'].value}"
+
+            self.app = get_asgi_application()
+            self.conversation = conversation
+            self.writer = writer
+            self.cookie = cookie
+            self.options = options
+
+            results = [
+                ('polling', asyncio.run(self.run_polling())),
+                ('push', asyncio.run(self.run_push())),
+            ]
+
+        self.stdout.write(
+            f"{'mode':<8} {'tabs':>5} {'requests':>9} {'req/s':>8} "
+            f"{'req p50 ms':>11} {'req p99 ms':>11} {'delivery p99 ms':>16}"
+        )
+        for mode, r in results:
+            self.stdout.write(
+                f"{mode:<8} {options['tabs']:>5} {r['requests']:>9} {r['rps']:>8.1f} "
+                f"{r['p50']:>11.1f} {r['p99']:>11.1f} {r['delivery_p99']:>16.1f}"
+            )
+
+    async def send_messages(self, sent_at, duration):
+        """Send ``--messages`` messages spread across the run, remembering when each left"""
+        count = self.options['messages']
+        for i in range(count):
+            await asyncio.sleep(duration / (count + 1))
+            started = time.perf_counter()
+            message = await sync_to_async(Message.objects.create)(
+                conversation=self.conversation, sender=self.writer, content=f'bench {i}'
+            )
+            sent_at[message.id] = started
+
+    async def run_polling(self):
+        tabs, duration, interval = self.options['tabs'], self.options['duration'], self.options['interval']
+        path = f'/api/conversation/{self.conversation.id}/messages/'
+        latencies, deliveries = [], []
+        sent_at = {}
+        loop = asyncio.get_running_loop()
+        end = loop.time() + duration
+
+        async def tab():
+            last_id = 0
+            await asyncio.sleep(random.uniform(0, interval))
+            while loop.time() < end:
+                started = time.perf_counter()
+                status, body = await asgi_get(self.app, path, self.cookie, f'last_message_id={last_id}')
+                finished = time.perf_counter()
+                latencies.append((finished - started) * 1000)
+                for message in json.loads(body).get('messages', []):
+                    last_id = max(last_id, message['id'])
+                    if message['id'] in sent_at:
+                        deliveries.append((finished - sent_at[message['id']]) * 1000)
+                await asyncio.sleep(max(0.0, interval - (finished - started)))
+
+        started = time.perf_counter()
+        await asyncio.gather(self.send_messages(sent_at, duration), *(tab() for _ in range(tabs)))
+        elapsed = time.perf_counter() - started
+        return self.summarize(latencies, deliveries, elapsed)
+
+    async def run_push(self):
+        tabs, duration = self.options['tabs'], self.options['duration']
+        path = f'/api/conversation/{self.conversation.id}/stream/'
+        latencies, deliveries = [], []
+        sent_at = {}
+
+        def tab():
+            started = time.perf_counter()
+            first_byte = True
+
+            def on_body(chunk):
+                nonlocal first_byte
+                now = time.perf_counter()
+                if first_byte:
+                    latencies.append((now - started) * 1000)
+                    first_byte = False
+                for frame in chunk.decode().split('\n\n'):
+                    if frame.startswith('event: message'):
+                        data = json.loads(frame.split('data: ', 1)[1])
+                        if data['id'] in sent_at:
+                            deliveries.append((now - sent_at[data['id']]) * 1000)
+
+            return asyncio.ensure_future(asgi_get(self.app, path, self.cookie, on_body=on_body))
+
+        streams = [tab() for _ in range(tabs)]
+        # Idle tabs hold their stream open: once every tab is connected the
+        # measured window issues no requests at all (streams are recycled
+        # only every REALTIME_STREAM_LIFETIME seconds)
+        while len(latencies) < tabs and not all(stream.done() for stream in streams):
+            await asyncio.sleep(0.05)
+        connects = list(latencies)
+
+        started = time.perf_counter()
+        await self.send_messages(sent_at, duration)
+        # Let the last message fan out before hanging up
+        await asyncio.sleep(0.5)
+        elapsed = time.perf_counter() - started
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+
+        summary = self.summarize(latencies[len(connects):], deliveries, elapsed)
+        # Report stream set-up time as the request latency
+        summary['p50'] = percentile(connects, 50)
+        summary['p99'] = percentile(connects, 99)
+        return summary
+
+    @staticmethod
+    def summarize(latencies, deliveries, elapsed):
+        return {
+            'requests': len(latencies),
+            'rps': len(latencies) / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'delivery_p99': percentile(deliveries, 99),
+        }
@@ -0,0 +1,68 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from main.benchmarks import scratch_database, measure
+from main.models import Profile
+from main.search import rebuild_search_index, search_profile_ids
+
+CITIES = ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Malindi', 'Naivasha', 'Nyeri', 'Kericho']
+SERVICES = ['Dinner Date', 'Travel Companion', 'Massage', 'Events', 'Overnight', 'Movie Night', 'City Tour']
+QUERIES = ['nairobi', 'mass', 'travel mombasa', 'kisumo', 'user_4242']
+
+
+def legacy_search(query):
+    """The old icontains filter from search_view, kept for comparison"""
+    return list(Profile.objects.filter(
+        Q(user__username__icontains=query) |
+        Q(city_town__icontains=query) |
+        Q(services_offered__icontains=query)
+    ).order_by('-is_vip', '-last_active').values_list('id', flat=True)[:200])
+
+
+class Command(BaseCommand):
+    help = 'Benchmark profile search (icontains vs full-text index) against a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000,100000',
+            help='Comma separated profile counts to benchmark'
+        )
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def seed(self, start, count):
+        rng = random.Random(start)
+        users = User.objects.bulk_create([
+            User(username=f'user_{start + i}', email=f'user_{start + i}@example.com')
+            for i in range(count)
+        ], batch_size=5000)
+        Profile.objects.bulk_create([
+            Profile(
+                user=user,
+                phone_number=f'07{start + i:08d}',
+                city_town=rng.choice(CITIES),
+                county=rng.choice(CITIES),
+                services_offered=', '.join(rng.sample(SERVICES, 2)),
+            ) for i, user in enumerate(users)
+        ], batch_size=5000)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        repeat = options['repeat']
+
+        with scratch_database():
+            seeded = 0
+            self.stdout.write(f"{'profiles':>9} {'query':>16} {'icontains ms':>13} {'index ms':>9} {'hits':>5}")
+            for size in sizes:
+                self.seed(seeded, size - seeded)
+                seeded = size
+                # bulk_create skips the index receivers
+                rebuild_search_index()
+
+                for query in QUERIES:
+                    _, legacy_ms = measure(legacy_search, query, repeat=repeat)
+                    _, index_ms = measure(search_profile_ids, query, repeat=repeat)
+                    hits = len(search_profile_ids(query))
+                    self.stdout.write(f'{size:>9} {query:>16} {legacy_ms:>13.1f} {index_ms:>9.1f} {hits:>5}')
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.benchmarks import scratch_database
+from main.models import Post
+from main.view_counters import record_view, view_counter
+
+
+def run_concurrently(viewers, target):
+    """Start one thread per viewer, release them together and return ``(errors, seconds)``"""
+    barrier = threading.Barrier(len(viewers))
+    errors = []
+
+    def worker(viewer):
+        try:
+            barrier.wait()
+            target(viewer)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(viewer,)) for viewer in viewers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Stress test view counting with concurrent viewers (legacy save() vs buffered counters)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--viewers', type=int, default=200)
+        parser.add_argument('--repeats', type=int, default=3, help='Views per viewer (repeats must be deduplicated)')
+        parser.add_argument('--flush-interval', type=float, default=0.01)
+
+    def handle(self, *args, **options):
+        viewers = options['viewers']
+        repeats = options['repeats']
+
+        with scratch_database(on_disk=True):
+            owner = User.objects.create(username='bench_owner')
+            users = User.objects.bulk_create([User(username=f'bench_viewer_{i}') for i in range(viewers)])
+            post = Post.objects.create(user=owner, content='bench')
+
+            # Legacy: read-modify-write save() of the whole row on every view
+            def legacy_view(user):
+                for _ in range(repeats):
+                    legacy_post = Post.objects.get(pk=post.pk)
+                    legacy_post.views += 1
+                    legacy_post.save()
+
+            errors, seconds = run_concurrently(users, legacy_view)
+            post.refresh_from_db()
+            expected = viewers * repeats
+            self.stdout.write(
+                f'legacy:   {post.views}/{expected} views stored, {expected - post.views} lost, '
+                f'{len(errors)} errors, {seconds:.2f}s'
+            )
+
+            # Buffered: deduplicated per viewer, flushed as F() updates
+            Post.objects.filter(pk=post.pk).update(views=0)
+            cache.clear()
+            view_counter.flush()
+            view_counter.flush_interval = options['flush_interval']
+
+            def buffered_view(user):
+                for _ in range(repeats):
+                    record_view(post, f'user:{user.id}')
+
+            errors, seconds = run_concurrently(users, buffered_view)
+            view_counter.flush()
+            post.refresh_from_db()
+            self.stdout.write(
+                f'buffered: {post.views}/{viewers} unique views stored, {viewers - post.views} lost, '
+                f'{len(errors)} errors, {seconds:.2f}s'
+            )
+            if post.views != viewers:
+                raise CommandError(f'Buffered counter lost increments: {post.views} != {viewers}')
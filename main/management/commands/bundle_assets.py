@@ -0,0 +1,97 @@
+import posixpath
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.assets import BUNDLE_DIR, EXTENDS_RE, digest, extract, extractable, inline_blocks, page_source, payload
+
+
+def _kb(size):
+    return '-' if size is None else f'{size / 1024:.1f}'
+
+
+class Command(BaseCommand):
+    help = 'Move inline <style>/<script> blocks out of the templates into static bundles, reporting page sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+        parser.add_argument('--templates', default=str(settings.TEMPLATES[0]['DIRS'][0]))
+        parser.add_argument('--static', default=str(settings.STATICFILES_DIRS[0]),
+                            help='Bundles go in its %s/ directory' % BUNDLE_DIR)
+
+    def handle(self, *args, **options):
+        templates_dir, static_dir = Path(options['templates']), Path(options['static'])
+        sources = {
+            path.relative_to(templates_dir).as_posix(): path.read_text()
+            for path in sorted(templates_dir.rglob('*.html'))
+        }
+
+        # Same content, same bundle: shared blocks are downloaded once for all pages
+        known = {
+            digest(path.read_text()): path.relative_to(static_dir).as_posix()
+            for path in sorted((static_dir / BUNDLE_DIR).rglob('*')) if path.is_file()
+        }
+        planned = {}
+
+        def bundle_path(template_name, kind, content):
+            key = digest(content)
+            if key not in known:
+                stem = posixpath.join(BUNDLE_DIR, posixpath.splitext(template_name)[0])
+                extension = '.css' if kind == 'style' else '.js'
+                path, number = stem + extension, 1
+                while path in planned or (static_dir / path).exists():
+                    number += 1
+                    path = f'{stem}-{number}{extension}'
+                known[key], planned[path] = path, content
+            return known[key]
+
+        updated = {}
+        for name, source in sources.items():
+            new_source, bundles = extract(name, source, bundle_path)
+            if bundles:
+                updated[name] = new_source
+        after = {**sources, **updated}
+        kept = sum(
+            not extractable(block) and bool(block.body.strip())
+            for source in after.values() for block in inline_blocks(source)
+        )
+
+        self.report(sources, after)
+        sizes = [payload(content) for content in planned.values()]
+        self.stdout.write(
+            f"{len(planned)} new bundles, {_kb(sum(size.raw for size in sizes))} KB "
+            f"(gzip {_kb(sum(size.gzip for size in sizes))} KB), cached after the first page that uses them; "
+            f"{kept} blocks use template syntax and stay inline"
+        )
+
+        if options['dry_run']:
+            return
+        for path, content in planned.items():
+            (static_dir / path).parent.mkdir(parents=True, exist_ok=True)
+            (static_dir / path).write_text(content)
+        for name, source in updated.items():
+            (templates_dir / name).write_text(source)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(planned)} bundles to {static_dir / BUNDLE_DIR} and updated {len(updated)} templates'
+        ))
+
+    def report(self, before, after):
+        """HTML per page (with the templates it extends) before and after, raw/gzip/brotli KB"""
+        parents = {match.group(1) for source in before.values() for match in EXTENDS_RE.finditer(source)}
+        pages = [name for name in before if name not in parents]
+        width = max(map(len, pages), default=4)
+        self.stdout.write(f"{'page':<{width}}  {'before (raw/gz/br KB)':>22}  {'after (raw/gz/br KB)':>22}  saved")
+        totals = [0, 0]
+        for name in pages:
+            old, new = payload(page_source(name, before)), payload(page_source(name, after))
+            totals[0] += old.gzip
+            totals[1] += new.gzip
+            self.stdout.write(
+                f"{name:<{width}}  {'/'.join(map(_kb, old)):>22}  {'/'.join(map(_kb, new)):>22}  "
+                f"{1 - new.gzip / old.gzip:.0%}"
+            )
+        if totals[0]:
+            self.stdout.write(
+                f'{len(pages)} pages, gzipped HTML: {_kb(totals[0])} KB -> {_kb(totals[1])} KB in total'
+            )
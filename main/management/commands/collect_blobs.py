@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main.blobs import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Recount media blob references and delete blobs nothing refers to'
+
+    def handle(self, *args, **options):
+        stats = collect_garbage()
+        self.stdout.write(self.style.SUCCESS(
+            f"Fixed {stats['recounted']} reference counts, collected {stats['collected']} blobs, "
+            f"deleted {stats['strays']} stray files"
+        ))
@@ -1,46 +1,39 @@
-import os
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'your_project.settings')
-
-import django
-django.setup()
+import time
 
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from main.models import Profile, Wallet, UserSetting
+
+from main.provisioning import BACKFILL_BATCH_SIZE, backfill_users
+
+PROGRESS_INTERVAL = 2  # seconds between progress lines
+
 
 class Command(BaseCommand):
-    help = 'Create missing profiles for existing users'
-    
-    def handle(self, *args, **kwargs):
-        users = User.objects.all()
-        created_count = 0
-        
-        for user in users:
-            # Create profile if it doesn't exist
-            if not hasattr(user, 'profile'):
-                Profile.objects.create(
-                    user=user,
-                    phone_number=f"0700000000{user.id}",  # Default phone
-                    gender='Other',
-                    sexual_orientation='Other',
-                    age=25,
-                    nationality='Kenyan',
-                    county='Nairobi',
-                    city_town='Nairobi',
-                    location='Nairobi CBD',
-                    services_offered='Dinner Date'
-                )
-                self.stdout.write(self.style.SUCCESS(f'Created profile for {user.username}'))
-                created_count += 1
-            
-            # Create wallet if it doesn't exist
-            if not hasattr(user, 'wallet'):
-                Wallet.objects.create(user=user)
-                self.stdout.write(self.style.SUCCESS(f'Created wallet for {user.username}'))
-            
-            # Create settings if it doesn't exist
-            if not hasattr(user, 'settings'):
-                UserSetting.objects.create(user=user)
-                self.stdout.write(self.style.SUCCESS(f'Created settings for {user.username}'))
-        
-        self.stdout.write(self.style.SUCCESS(f'\nSuccessfully created profiles for {created_count} users'))
\ No newline at end of file
+    help = 'Create missing profiles, wallets and settings for existing users'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=BACKFILL_BATCH_SIZE,
+            help='User ids per chunk; each chunk is one transaction'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only count the missing rows')
+
+    def handle(self, *args, **options):
+        started = last_report = time.monotonic()
+
+        def progress(done, total, counts):
+            nonlocal last_report
+            now = time.monotonic()
+            if now - last_report < PROGRESS_INTERVAL and done < total:
+                return
+            last_report = now
+            self.stdout.write(
+                f"{done / total:6.1%} of user ids, {now - started:.0f}s: "
+                f"{counts['profiles']} profiles, {counts['wallets']} wallets, {counts['settings']} settings"
+            )
+
+        counts = backfill_users(batch_size=options['batch_size'], dry_run=options['dry_run'], progress=progress)
+        verb = 'Missing' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {counts['profiles']} profiles, {counts['wallets']} wallets "
+            f"and {counts['settings']} settings in {time.monotonic() - started:.1f}s"
+        ))
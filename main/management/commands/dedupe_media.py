@@ -0,0 +1,109 @@
+import os
+import posixpath
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Value
+from django.db.models.functions import Replace
+from django.utils import timezone
+
+from main.blobs import FILE_FIELDS, recount
+from main.images import DERIVED_DIR, EXTENSIONS, SIZES, derivative_name
+from main.models import Blob, Video
+from main.storage import BLOB_DIR, blob_lock, blob_name, content_digest
+from main.transcoding import delete_transcodes, derived_dir
+
+
+def _move(name, target):
+    # A rename on the same filesystem; MEDIA_ROOT storage only
+    os.makedirs(os.path.dirname(default_storage.path(target)), exist_ok=True)
+    os.replace(default_storage.path(name), default_storage.path(target))
+
+
+class Command(BaseCommand):
+    help = 'Move existing uploads into the content-addressed blob store, merging duplicate files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be merged')
+
+    def handle(self, *args, **options):
+        names = set()
+        for model, fields in FILE_FIELDS.items():
+            for field in fields:
+                names.update(
+                    model._default_manager.exclude(**{f'{field}__startswith': f'{BLOB_DIR}/'})
+                    .exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                    .values_list(field, flat=True).distinct()
+                )
+        # Posters made by the transcoder live (and move) with their video's transcodes
+        names = sorted(name for name in names if f'/{DERIVED_DIR}/' not in f'/{name}')
+
+        seen = {}
+        moved = merged = missing = freed = 0
+        for name in names:
+            if not default_storage.exists(name):
+                missing += 1
+                self.stderr.write(f'Missing: {name}')
+                continue
+            with default_storage.open(name, 'rb') as content:
+                digest = content_digest(content)
+            size = default_storage.size(name)
+            duplicate = digest in seen or Blob.objects.filter(sha256=digest).exists()
+            seen.setdefault(digest, name)
+            if duplicate:
+                merged += 1
+                freed += size
+            else:
+                moved += 1
+            if not options['dry_run']:
+                self.migrate(name, digest, size)
+
+        if not options['dry_run']:
+            recount()
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would move' if options['dry_run'] else 'Moved'} {moved} files into {BLOB_DIR}/ and merge "
+            f"{merged} duplicates ({freed / 1024 / 1024:.1f} MB); {missing} missing"
+        ))
+
+    def migrate(self, name, digest, size):
+        extension = posixpath.splitext(name)[1].lower()[:10]
+        with blob_lock(digest):
+            target = Blob.objects.filter(sha256=digest).values_list('name', flat=True).first()
+            if not target or not default_storage.exists(target):
+                target = blob_name(digest, extension)
+                if not default_storage.exists(target):
+                    _move(name, target)
+                Blob.objects.update_or_create(sha256=digest, defaults={
+                    'name': target, 'size': size, 'last_used_at': timezone.now(),
+                })
+            self.move_variants(name, target)
+
+            for model, fields in FILE_FIELDS.items():
+                for field in fields:
+                    model._default_manager.filter(**{field: name}).update(**{field: target})
+            old_prefix, new_prefix = f'{derived_dir(name)}/', f'{derived_dir(target)}/'
+            Video.objects.filter(video_file=target).update(**{
+                field: Replace(field, Value(old_prefix), Value(new_prefix))
+                for field in ('web_file', 'hls_playlist', 'thumbnail')
+            })
+            if default_storage.exists(name):
+                default_storage.delete(name)
+
+    def move_variants(self, name, target):
+        """Carry image derivatives and video transcodes over, or drop them if the blob has its own"""
+        for size in SIZES:
+            for fmt in EXTENSIONS:
+                old, new = derivative_name(name, size, fmt), derivative_name(target, size, fmt)
+                if not default_storage.exists(old):
+                    continue
+                if default_storage.exists(new):
+                    default_storage.delete(old)
+                else:
+                    _move(old, new)
+
+        old_dir, new_dir = derived_dir(name), derived_dir(target)
+        if os.path.isdir(default_storage.path(old_dir)):
+            if os.path.exists(default_storage.path(new_dir)):
+                delete_transcodes(name)
+            else:
+                _move(old_dir, new_dir)
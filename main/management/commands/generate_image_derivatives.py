@@ -0,0 +1,92 @@
+import os
+import posixpath
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.images import (
+    IMAGE_DIRS, ImageProcessingError, derivatives_ready, generate_derivatives, is_original_name, mark_ready,
+    parse_derivative_name, public_image_names,
+)
+from main.storage import is_blob_name
+
+PROGRESS_INTERVAL = 2  # seconds between progress lines
+
+
+def walk(directory):
+    """Every original under the storage ``directory``, skipping derivatives"""
+    try:
+        directories, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in sorted(files):
+        name = posixpath.join(directory, filename)
+        if is_original_name(name):
+            yield name
+    for subdirectory in sorted(directories):
+        yield from walk(posixpath.join(directory, subdirectory))
+
+
+def _setup_worker():
+    # Forked workers inherit the app registry; spawned ones have to load it
+    django.setup()
+
+
+def _process(name, strip):
+    try:
+        written = generate_derivatives(name, strip=strip)
+    except ImageProcessingError as error:
+        return name, str(error)
+    # A stripped blob is stored again under a new name
+    return parse_derivative_name(written[0])[0], None
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails and WebP/AVIF/JPEG derivatives for existing photos and post images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directories', nargs='*', default=[directory.rstrip('/') for directory in IMAGE_DIRS],
+            help='Storage directories to walk (default: %(default)s)'
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist')
+        parser.add_argument('--keep-exif', action='store_true', help="Leave the originals' EXIF in place")
+
+    def handle(self, *args, **options):
+        started = last_report = time.monotonic()
+        names = [name for directory in options['directories'] for name in walk(directory)]
+        # The blob store also holds message attachments, which get no derivatives
+        public = public_image_names()
+        names = [name for name in names if not is_blob_name(name) or name in public]
+        if not options['force']:
+            ready = derivatives_ready(names)
+            names = [name for name in names if not ready[name]]
+        self.stdout.write(f"{len(names)} images to process with {options['workers']} workers")
+
+        # Workers open their own connections (stripping a blob moves its rows); don't hand them ours
+        connections.close_all()
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_setup_worker) as pool:
+            futures = [pool.submit(_process, name, not options['keep_exif']) for name in names]
+            for future in as_completed(futures):
+                name, error = future.result()
+                done += 1
+                if error:
+                    failed += 1
+                    self.stderr.write(f'Skipped {error}')
+                else:
+                    mark_ready(name)
+                now = time.monotonic()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    rate = done / (now - started)
+                    self.stdout.write(f'{done}/{len(names)} images, {rate:.1f}/s')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {done - failed} images ({failed} skipped) in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.search import get_search_backend, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the profile full-text search index from the profile table'
+
+    def handle(self, *args, **options):
+        if get_search_backend() is None:
+            self.stdout.write(self.style.WARNING('No search index for this database; searches use icontains'))
+            return
+        with transaction.atomic():
+            total = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} profiles'))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, IntegerField
+
+from main.models import Conversation, Message, UnreadCounter
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user, per-conversation unread counters from the message table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # One row per (participant, conversation) with the participant's unread count
+        unread = Message.objects.filter(
+            conversation=OuterRef('conversation_id'),
+            is_read=False,
+        ).exclude(sender=OuterRef('user_id')).order_by().values('conversation').annotate(
+            total=Count('id')
+        ).values('total')
+
+        memberships = Conversation.participants.through.objects.annotate(
+            unread=Subquery(unread, output_field=IntegerField())
+        ).filter(unread__gt=0).values_list('user_id', 'conversation_id', 'unread')
+
+        created = 0
+        with transaction.atomic():
+            UnreadCounter.objects.all().delete()
+
+            batch = []
+            for user_id, conversation_id, count in memberships.iterator(chunk_size=batch_size):
+                batch.append(UnreadCounter(user_id=user_id, conversation_id=conversation_id, count=count))
+                if len(batch) >= batch_size:
+                    UnreadCounter.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            if batch:
+                UnreadCounter.objects.bulk_create(batch)
+                created += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} unread counters'))
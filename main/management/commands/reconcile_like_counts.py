@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from main.interactions import reconcile_like_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute Post.likes and Video.likes from the interaction tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many counters drifted')
+
+    def handle(self, *args, **options):
+        drifted = reconcile_like_counts(dry_run=options['dry_run'])
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {drifted['posts']} post and {drifted['videos']} video like counters out of step"
+        ))
@@ -0,0 +1,102 @@
+import logging
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from main.blobs import collect_garbage
+from main.tasks import TASK_LEASE_SECONDS, claim_next, prune, registry, renew_leases, requeue_expired, run, worker_id
+from main.uploads import expire_uploads
+
+MAINTENANCE_INTERVAL = 60 * 60  # seconds between prunes of old tasks, abandoned uploads and unused blobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (images, email, ...) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=getattr(settings, 'TASK_CONCURRENCY', 2),
+            help='Tasks run at once, one thread each'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=getattr(settings, 'TASK_POLL_INTERVAL', 1.0),
+            help='Seconds an idle thread waits before looking for work again'
+        )
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.idle = {}
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+
+        self.worker = worker_id()
+        self.stdout.write(
+            f"Worker {self.worker} running {options['concurrency']} at a time: {', '.join(sorted(registry))}"
+        )
+        threads = [
+            threading.Thread(target=self.work, args=(number, options), name=f'task-worker-{number}')
+            for number in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+
+        last_renewal = last_maintenance = 0
+        while any(thread.is_alive() for thread in threads):
+            now = time.monotonic()
+            if now - last_renewal >= TASK_LEASE_SECONDS / 3:
+                last_renewal = now
+                self.supervise(renew_leases, self.worker)
+                self.supervise(requeue_expired)
+            if now - last_maintenance >= MAINTENANCE_INTERVAL:
+                last_maintenance = now
+                self.supervise(prune)
+                self.supervise(expire_uploads)
+                self.supervise(collect_garbage)
+            if options['burst'] and len(self.idle) == len(threads) and all(self.idle.values()):
+                self.stopping.set()
+            self.stopping.wait(options['poll_interval'])
+            close_old_connections()
+
+        for thread in threads:
+            thread.join()
+        connection.close()
+        self.stdout.write('Worker stopped')
+
+    def supervise(self, job, *args):
+        """Run a lease or maintenance job; a failure (say the database is briefly away) is logged and retried next time"""
+        try:
+            job(*args)
+        except Exception:
+            logger.exception('%s failed in worker %s', job.__name__, self.worker)
+
+    def stop(self, signum, frame):
+        if self.stopping.is_set():
+            return
+        self.stdout.write('Finishing running tasks, then stopping')
+        self.stopping.set()
+
+    def work(self, number, options):
+        name = worker_id(number)
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                claimed = claim_next(name)
+                self.idle[number] = claimed is None
+                if claimed is None:
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+                started = time.monotonic()
+                status = run(claimed)
+                self.stdout.write(
+                    f'{claimed.name} #{claimed.id} {status} in {time.monotonic() - started:.2f}s '
+                    f'(attempt {claimed.attempts} of {claimed.max_attempts})'
+                )
+        finally:
+            connection.close()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Video
+from main.transcoding import available, queue_transcode
+
+
+class Command(BaseCommand):
+    help = 'Queue videos that have not been transcoded (pending, skipped or failed) for run_tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Queue every video, including ready ones')
+
+    def handle(self, *args, **options):
+        if not available():
+            self.stderr.write('ffmpeg/ffprobe not found; set FFMPEG_BINARY and FFPROBE_BINARY or install them')
+            return
+        videos = Video.objects.exclude(video_file='').only('id', 'video_file')
+        if not options['force']:
+            videos = videos.exclude(processing_status__in=[Video.READY, Video.PROCESSING])
+        queued = 0
+        for video in videos.iterator():
+            queue_transcode(video, force=options['force'])
+            queued += 1
+        self.stdout.write(self.style.SUCCESS(f'Queued {queued} videos'))
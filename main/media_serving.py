@@ -0,0 +1,186 @@
+# main/media_serving.py
+"""
+Serving media files with byte ranges, validators and sendfile.
+
+Videos used to be linked straight to ``MEDIA_URL``: in development that is
+``django.views.static.serve``, which ignores ``Range`` (so browsers could
+not seek and re-downloaded the whole file to scrub), and in production it
+bypassed ``video_detail_view``'s block check entirely - anyone with the URL
+could fetch a video its owner had hidden from them. ``serve`` answers for a
+stored file after the caller has done its permission check:
+
+* ``ETag`` (the SHA-256 for content-addressed blobs, size and mtime for
+  other files) and ``Last-Modified``, with ``If-None-Match`` /
+  ``If-Modified-Since`` answered by 304 and ``If-Match`` /
+  ``If-Unmodified-Since`` by 412;
+* a single ``bytes=`` range (honouring ``If-Range``) as 206 with
+  ``Content-Range``, an unsatisfiable one as 416; several ranges get the
+  whole file, which the spec allows;
+* the body is the open file limited to the range, so a WSGI server with
+  ``wsgi.file_wrapper`` (gunicorn, uWSGI) sends it with ``sendfile()``
+  without Python reading it;
+* video and audio files and transcodes (``is_protected``) are only served
+  by the checked views, never from ``MEDIA_URL``; a transcode's directory
+  is named after its original, so even a poster would give the video away;
+* with ``MEDIA_ACCEL_REDIRECT`` set (e.g. ``'/protected-media/'``, an nginx
+  ``internal`` location aliased to ``MEDIA_ROOT``) only an
+  ``X-Accel-Redirect`` header is returned and nginx does all of the above.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from .models import Contact
+from .storage import blob_digest, is_blob_name
+from .transcoding import DERIVED_DIR
+
+ACCEL_REDIRECT = getattr(settings, 'MEDIA_ACCEL_REDIRECT', None)
+BLOCK_SIZE = 64 * 1024
+ACCESS_CACHE_SECONDS = 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/mp2t', '.ts')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class RangeFile:
+    """``length`` bytes of an open file from its current position, keeping ``fileno()`` for sendfile"""
+
+    def __init__(self, handle, length):
+        self.handle = handle
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.handle.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.handle.fileno()
+
+    def close(self):
+        self.handle.close()
+
+
+def is_protected(name):
+    """Video or audio, or anything the transcoder wrote (``<dir>/derived/<original>/...``)"""
+    parts = name.split('/')
+    if DERIVED_DIR in parts[:-2]:
+        return True
+    content_type = mimetypes.guess_type(name)[0] or ''
+    return content_type.startswith(('video/', 'audio/')) or content_type == 'application/vnd.apple.mpegurl'
+
+
+def is_blocked(owner, user):
+    """Whether ``owner`` has blocked ``user``; cached briefly, as players fetch many segments"""
+    if not user.is_authenticated or owner.pk == user.pk:
+        return False
+    key = f'media-access:{owner.pk}:{user.pk}'
+    blocked = cache.get(key)
+    if blocked is None:
+        blocked = Contact.objects.filter(user=owner, contact_user=user, is_blocked=True).exists()
+        cache.set(key, blocked, ACCESS_CACHE_SECONDS)
+    return blocked
+
+
+def parse_range(header, size):
+    """``(start, end)``, inclusive, of a single-range header; None to send the whole file"""
+    match = RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _if_range_matches(request, etag, last_modified):
+    condition = request.META.get('HTTP_IF_RANGE')
+    if not condition:
+        return True
+    if condition.startswith(('"', 'W/')):
+        return condition == etag
+    return parse_http_date_safe(condition) == last_modified
+
+
+def serve(request, name, storage=None, content_type=None, cache_control='private, max-age=3600'):
+    """Response for the stored file ``name``; permission checks are the caller's"""
+    storage = storage or default_storage
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # Remote storage serves ranges itself
+        return redirect(storage.url(name))
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Media not found')
+
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = f'"{blob_digest(name)}"' if is_blob_name(name) else f'"{stat.st_mtime_ns:x}-{size:x}"'
+    content_type = content_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        for header, value in headers.items():
+            conditional[header] = value
+        return conditional
+
+    if ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Accel-Redirect'] = ACCEL_REDIRECT.rstrip('/') + '/' + quote(name)
+        return response
+
+    byte_range = None
+    if request.method == 'GET' and 'HTTP_RANGE' in request.META and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416, headers=headers)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    handle = open(path, 'rb')
+    if byte_range:
+        start, end = byte_range
+        handle.seek(start)
+        response = FileResponse(RangeFile(handle, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response = FileResponse(RangeFile(handle, size), content_type=content_type)
+        response['Content-Length'] = size
+    for header, value in headers.items():
+        response[header] = value
+    response.block_size = BLOCK_SIZE
+    return response
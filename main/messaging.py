@@ -0,0 +1,66 @@
+# main/messaging.py
+"""
+Keyset-paginated message history.
+
+Conversations are read newest-first in fixed-size windows over the
+``(conversation, sent_at)`` index instead of loading every message, and
+senders are joined in so serializing a window never queries per row.
+"""
+from django.db.models import Q
+
+from .models import Message
+
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+
+def message_window(conversation, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Return ``(messages, has_more)``: up to ``limit`` messages of
+    ``conversation`` sent before message id ``before`` (or the newest ones when
+    ``before`` is empty), oldest first so they can be rendered as-is.
+    """
+    messages = Message.objects.filter(conversation=conversation).select_related('sender')
+
+    if before:
+        anchor = Message.objects.filter(
+            conversation=conversation, id=before
+        ).values_list('sent_at', flat=True).first()
+        if anchor is None:
+            return [], False
+        messages = messages.filter(
+            Q(sent_at__lt=anchor) | Q(sent_at=anchor, id__lt=before)
+        )
+
+    window = list(messages.order_by('-sent_at', '-id')[:limit + 1])
+    has_more = len(window) > limit
+    window = window[:limit]
+    window.reverse()
+    return window, has_more
+
+
+def serialize_message(message):
+    """JSON-ready dict for a message; ``sender`` must already be loaded"""
+    return {
+        'id': message.id,
+        'content': message.content,
+        'message_type': message.message_type,
+        'media_url': message.media_url,
+        'sent_at': message.sent_at.isoformat(),
+        'sender': message.sender.username,
+        'sender_id': message.sender_id,
+        'is_read': message.is_read,
+    }
+
+
+def parse_history_params(params):
+    """Read ``before`` and ``limit`` from a query dict, clamping bad values"""
+    try:
+        before = int(params.get('before') or 0) or None
+    except (TypeError, ValueError):
+        before = None
+    try:
+        limit = int(params.get('limit') or HISTORY_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = HISTORY_PAGE_SIZE
+    return before, max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
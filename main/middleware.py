@@ -1,40 +1,162 @@
-from django.shortcuts import redirect
-from django.contrib import messages
-from .models import Profile, Wallet, UserSetting
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+
+from .provisioning import current_profile
+from .service_worker import PARTITION_HEADER, cache_partition
+
+query_logger = logging.getLogger('main.queries')
+
 
 class ProfileCreationMiddleware:
+    """
+    Expose ``request.profile``, provisioning the account on first use if it
+    has no profile yet. Nothing is queried unless a view or template reads
+    it; ``base.html``'s header does, and gets the avatar in the same query.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
-    
+
+    def __call__(self, request):
+        request.profile = SimpleLazyObject(
+            lambda: current_profile(request.user) if request.user.is_authenticated else None
+        )
+        return self.get_response(request)
+
+
+class CachePartitionMiddleware:
+    """
+    Tag signed-in responses with the user's ``cache_partition`` so the
+    service worker keeps each user's cached pages apart (``main.service_worker``).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
     def __call__(self, request):
-        # Process request
         response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            response[PARTITION_HEADER] = cache_partition(user)
         return response
-    
+
+
+# ==================== QUERY INSTRUMENTATION ====================
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more queries than its ``query_budget`` (raised when QUERY_BUDGET_STRICT)"""
+
+
+def query_budget(max_queries):
+    """
+    Declare the most queries a view may run per request, counting the
+    session and user lookups of the middleware in front of it. Put it above
+    the other decorators; not all of them copy attributes onto their wrapper.
+    """
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+
+
+def fingerprint(sql):
+    """``sql`` with IN lists and inline numbers collapsed, so one statement per loop iteration looks the same"""
+    return _NUMBER.sub('N', _IN_LIST.sub('(%s, ...)', sql))
+
+
+class QueryRecorder:
+    """``execute_wrapper`` that keeps the fingerprint and duration of every query"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((fingerprint(sql), (time.perf_counter() - start) * 1000))
+
+    @property
+    def sql_ms(self):
+        return sum(duration for _, duration in self.queries)
+
+    def repeated(self, threshold):
+        """``[(fingerprint, count)]`` of statements run at least ``threshold`` times"""
+        counts = Counter(sql for sql, _ in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count >= threshold]
+
+
+class QueryBudgetMiddleware:
+    """
+    Count the queries and SQL time of every request. Each request gets a
+    ``Server-Timing`` header (``db`` and ``app`` durations) and one JSON log
+    line on the ``main.queries`` logger, which is a warning when the view
+    went over its ``@query_budget`` or ran the same statement
+    ``QUERY_REPEAT_THRESHOLD`` times (the usual sign of an N+1 loop). With
+    ``QUERY_BUDGET_STRICT`` (on under ``manage.py test``) going over budget
+    raises ``QueryBudgetExceeded`` instead, so the test fails.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', True):
+            return self.get_response(request)
+
+        request.query_budget = getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+        request.query_view = None
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        queries = len(recorder.queries)
+        sql_ms = recorder.sql_ms
+        budget = request.query_budget
+        over_budget = budget is not None and queries > budget
+        repeated = recorder.repeated(getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5))
+
+        timing = f'db;dur={sql_ms:.1f};desc="{queries} queries", app;dur={total_ms:.1f}'
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+
+        line = json.dumps({
+            'view': request.query_view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': queries,
+            'budget': budget,
+            'sql_ms': round(sql_ms, 1),
+            'total_ms': round(total_ms, 1),
+            'repeated': [{'sql': sql[:300], 'count': count} for sql, count in repeated],
+        })
+        if over_budget and getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(f'{request.query_view} ran {queries} queries (budget {budget}): {line}')
+        query_logger.log(logging.WARNING if over_budget or repeated else logging.INFO, line)
+        return response
+
     def process_view(self, request, view_func, view_args, view_kwargs):
-        if request.user.is_authenticated:
-            try:
-                # Just try to access profile to trigger creation if needed
-                profile = request.user.profile
-            except Profile.DoesNotExist:
-                # Create missing profile
-                Profile.objects.create(
-                    user=request.user,
-                    phone_number=f"0700000000{request.user.id}",
-                    gender='Other',
-                    sexual_orientation='Other',
-                    age=25,
-                    nationality='Kenyan',
-                    county='Nairobi',
-                    city_town='Nairobi',
-                    location='Nairobi CBD',
-                    services_offered='Dinner Date'
-                )
-                
-                # Create wallet if missing
-                Wallet.objects.get_or_create(user=request.user)
-                
-                # Create settings if missing
-                UserSetting.objects.get_or_create(user=request.user)
-                
-                messages.info(request, "Your profile has been created with default settings. Please update your information.")
\ No newline at end of file
+        match = request.resolver_match
+        request.query_view = match.view_name if match else f'{view_func.__module__}.{view_func.__name__}'
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is not None:
+            request.query_budget = budget
@@ -0,0 +1,96 @@
+import logging
+
+from django.db import DatabaseError, migrations, transaction
+
+logger = logging.getLogger('main.search')
+
+# The index as it was when this migration was written; later changes to
+# main.search must come with their own migration.
+COLUMNS = 'username, email, phone_number, city_town, county, services_offered'
+SOURCE_SQL = 'FROM main_profile p JOIN auth_user u ON u.id = p.user_id'
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS main_profile_search USING fts5("
+    f"{COLUMNS}, prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS main_profile_search_vocab USING fts5vocab(main_profile_search, 'row')",
+    f"INSERT INTO main_profile_search (rowid, {COLUMNS}) SELECT p.id, "
+    "COALESCE(u.username, ''), COALESCE(u.email, ''), COALESCE(p.phone_number, ''), "
+    "COALESCE(p.city_town, ''), COALESCE(p.county, ''), COALESCE(p.services_offered, '') "
+    f"{SOURCE_SQL}",
+]
+SQLITE_DROP = [
+    'DROP TABLE IF EXISTS main_profile_search_vocab',
+    'DROP TABLE IF EXISTS main_profile_search',
+]
+
+POSTGRES_CREATE = [
+    'CREATE TABLE IF NOT EXISTS main_profile_search ('
+    'profile_id integer PRIMARY KEY REFERENCES main_profile (id) ON DELETE CASCADE, '
+    'document tsvector NOT NULL, '
+    'username text NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS main_profile_search_document ON main_profile_search USING GIN (document)',
+    'INSERT INTO main_profile_search (profile_id, document, username) SELECT p.id, '
+    "setweight(to_tsvector('simple', COALESCE(u.username, '')), 'A') || "
+    "setweight(to_tsvector('simple', COALESCE(p.city_town, '') || ' ' || COALESCE(p.county, '')), 'B') || "
+    "setweight(to_tsvector('simple', COALESCE(p.services_offered, '')), 'C') || "
+    "setweight(to_tsvector('simple', COALESCE(u.email, '') || ' ' || COALESCE(p.phone_number, '')), 'D'), "
+    f"u.username {SOURCE_SQL} ON CONFLICT (profile_id) DO NOTHING",
+]
+POSTGRES_TRIGRAMS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS main_profile_search_username_trgm '
+    'ON main_profile_search USING GIN (username gin_trgm_ops)',
+]
+POSTGRES_DROP = ['DROP TABLE IF EXISTS main_profile_search']
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        statements = SQLITE_CREATE
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRES_CREATE
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    if connection.vendor == 'postgresql':
+        create_trigram_index(connection)
+
+
+def create_trigram_index(connection):
+    """
+    pg_trgm is trusted from PostgreSQL 13, so the database owner can create
+    it; otherwise it needs a superuser. Without it fuzzy username matching
+    is skipped (main.search) rather than failing the migration.
+    """
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            for statement in POSTGRES_TRIGRAMS:
+                cursor.execute(statement)
+    except DatabaseError as error:
+        logger.warning(
+            'Skipped the trigram index on main_profile_search (%s). As a superuser, run: %s',
+            error, '; '.join(POSTGRES_TRIGRAMS),
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main', '0005_unreadcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
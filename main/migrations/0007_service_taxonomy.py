@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_profile_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Service',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(allow_unicode=True, max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProfileService',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='profile_services', to='main.profile')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='profile_services', to='main.service')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='services',
+            field=models.ManyToManyField(blank=True, related_name='profiles', through='main.ProfileService', to='main.service'),
+        ),
+        migrations.AddIndex(
+            model_name='profileservice',
+            index=models.Index(fields=['service', 'profile'], name='main_profil_service_76da1b_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='profileservice',
+            unique_together={('profile', 'service')},
+        ),
+    ]
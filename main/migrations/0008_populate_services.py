@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.utils.text import slugify
+
+
+def parse(text):
+    parsed = {}
+    for name in (text or '').split(','):
+        name = ' '.join(name.split())[:100]
+        slug = slugify(name, allow_unicode=True)[:100] or name.lower()
+        if name and slug not in parsed:
+            parsed[slug] = name
+    return list(parsed.items())
+
+
+def populate_services(apps, schema_editor):
+    Profile = apps.get_model('main', 'Profile')
+    Service = apps.get_model('main', 'Service')
+    ProfileService = apps.get_model('main', 'ProfileService')
+
+    services = {}
+    links = []
+    for profile_id, text in Profile.objects.values_list('id', 'services_offered').iterator(chunk_size=2000):
+        for position, (slug, name) in enumerate(parse(text)):
+            services.setdefault(slug, name)
+            links.append((profile_id, slug, position))
+
+    Service.objects.bulk_create(
+        [Service(slug=slug, name=name) for slug, name in services.items()],
+        batch_size=1000, ignore_conflicts=True
+    )
+    service_ids = dict(Service.objects.values_list('slug', 'id'))
+    ProfileService.objects.bulk_create(
+        [ProfileService(profile_id=profile_id, service_id=service_ids[slug], position=position)
+         for profile_id, slug, position in links],
+        batch_size=2000, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_service_taxonomy'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_services, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def geocode_profiles(apps, schema_editor):
+    from main.geo import geocode, geohash_encode
+    Profile = apps.get_model('main', 'Profile')
+
+    batch = []
+    for profile in Profile.objects.filter(latitude__isnull=True).only('id', 'city_town', 'county').iterator(chunk_size=2000):
+        point = geocode(profile.city_town, profile.county)
+        if point:
+            profile.latitude, profile.longitude = point
+            profile.geohash = geohash_encode(*point)
+            batch.append(profile)
+        if len(batch) >= 2000:
+            Profile.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+            batch = []
+    if batch:
+        Profile.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_profile_coordinates'),
+    ]
+
+    operations = [
+        migrations.RunPython(geocode_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_geocode_profiles'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='calllog',
+            index=models.Index(fields=['caller', '-started_at', '-id'], name='main_calllo_caller__e80766_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='calllog',
+            index=models.Index(fields=['receiver', '-started_at', '-id'], name='main_calllo_receive_757e82_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', 'is_archived', '-created_at', '-id'], name='main_post_user_id_e8210a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['-is_vip', '-last_active', '-id'], name='main_profil_is_vip_dbbbd7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicebooking',
+            index=models.Index(fields=['client', '-created_at', '-id'], name='main_servic_client__fd5658_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicebooking',
+            index=models.Index(fields=['service_provider', '-created_at', '-id'], name='main_servic_service_82f78d_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def populate_primary_photo(apps, schema_editor):
+    Photo = apps.get_model('main', 'Photo')
+    Profile = apps.get_model('main', 'Profile')
+    newest_primary = Photo.objects.filter(
+        profile=OuterRef('pk'),
+    ).order_by('-is_primary', '-uploaded_at', '-id').values('id')[:1]
+    Profile.objects.update(primary_photo=Subquery(newest_primary))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_profile_primary_photo'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_primary_photo, migrations.RunPython.noop),
+    ]
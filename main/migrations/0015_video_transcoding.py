@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_task_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='hls_playlist',
+            field=models.FileField(blank=True, help_text='HLS master playlist', max_length=255, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed'), ('skipped', 'Skipped (no ffmpeg)')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='web_file',
+            field=models.FileField(blank=True, help_text='H.264/AAC MP4 with faststart', max_length=255, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:38
+
+from django.db import migrations, models
+import django.utils.timezone
+import main.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='media_file',
+            field=models.FileField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to='messages/media/'),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='image',
+            field=models.ImageField(storage=main.storage.ContentAddressedStorage(), upload_to='photos/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to='posts/images/'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='video',
+            field=models.FileField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to='posts/videos/'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to='video_thumbnails/'),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='video_file',
+            field=models.FileField(storage=main.storage.ContentAddressedStorage(), upload_to='videos/%Y/%m/%d/'),
+        ),
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(help_text='Storage name under blobs/', max_length=255)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ref_count', 'last_used_at'], name='main_blob_ref_cou_a5c521_idx')],
+            },
+        ),
+    ]
@@ -1,11 +1,18 @@
 # main/models.py
 from django.db import models
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.text import slugify
+import hashlib
 import uuid
 
+from .realtime import publish_new_message
+from .storage import blob_storage
+
 # ================================
 # 1. PROFILE & USER MANAGEMENT
 # ================================
@@ -43,12 +50,18 @@ class Profile(models.Model):
     county = models.CharField(max_length=100, default='Nairobi')
     city_town = models.CharField(max_length=100, default='Nairobi')
     location = models.TextField(help_text="Detailed location/CBD information", default='Nairobi CBD')
+    # Geocoded from city_town/county unless set explicitly (see main.geo)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, default='')
     
     # Service Information
     services_offered = models.TextField(
         help_text="Services separated by commas: Dinner Date, Travel Companion, etc.",
         default='Dinner Date'
     )
+    # Normalized from services_offered on save; use this for filtering
+    services = models.ManyToManyField('Service', through='ProfileService', related_name='profiles', blank=True)
     hourly_rate_incall = models.DecimalField(
         max_digits=10, decimal_places=2, null=True, blank=True,
         help_text="Incall rate per hour"
@@ -64,6 +77,12 @@ class Profile(models.Model):
     is_online = models.BooleanField(default=False)
     is_available = models.BooleanField(default=True)
     
+    # The photo shown as the avatar: the one marked primary, else the newest.
+    # Kept up to date by main.avatars
+    primary_photo = models.ForeignKey(
+        'Photo', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    
     # Statistics
     total_views = models.IntegerField(default=0)
     total_calls = models.IntegerField(default=0)
@@ -78,61 +97,140 @@ class Profile(models.Model):
         ordering = ['-is_vip', '-last_active']
         verbose_name = "User Profile"
         verbose_name_plural = "User Profiles"
+        indexes = [
+            # Covers radius queries: geohash prefix ranges plus the distance check
+            models.Index(fields=['geohash', 'latitude', 'longitude']),
+            # Keyset pages of the default search ordering
+            models.Index(fields=['-is_vip', '-last_active', '-id']),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.city_town} ({'VIP' if self.is_vip else 'Standard'})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so saves only resync services/coordinates when they change
+        instance._loaded_services_offered = instance.__dict__.get('services_offered')
+        instance._loaded_place = (instance.__dict__.get('city_town'), instance.__dict__.get('county'))
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # What is now stored, for the next save's has_changed (deferred fields stay unknown)
+        update_fields = kwargs.get('update_fields')
+        saved = self._meta.concrete_fields if update_fields is None else [
+            self._meta.get_field(name) for name in update_fields
+        ]
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{field.attname: self.__dict__[field.attname] for field in saved if field.attname in self.__dict__},
+        }
+    
+    def has_changed(self, fields, update_fields=None):
+        """Whether a save may have changed any of ``fields``; always True for rows not loaded from the db"""
+        if update_fields is not None:
+            fields = set(fields) & set(update_fields)
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return bool(fields)
+        attnames = [self._meta.get_field(name).attname for name in fields]
+        return any(name not in loaded or loaded[name] != getattr(self, name) for name in attnames)
+    
+    @property
+    def avatar_url(self):
+        """URL of the primary photo's thumbnail, or None (``select_related('primary_photo')`` in lists)"""
+        if self.primary_photo_id is None:
+            return None
+        from .images import variant_url
+        return variant_url(self.primary_photo.image)
+    
     def get_services_list(self):
-        """Convert services string to list"""
-        return [s.strip() for s in self.services_offered.split(',') if s.strip()]
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    """
-    Create user profile, wallet, and settings when a new user is created
-    """
-    if created:
-        # Create Profile with default values
-        Profile.objects.create(
-            user=instance,
-            phone_number=f"0700000000{instance.id}",
-            gender='Other',
-            sexual_orientation='Other',
-            age=25,
-            nationality='Kenyan',
-            county='Nairobi',
-            city_town='Nairobi',
-            location='Nairobi CBD',
-            services_offered='Dinner Date'
-        )
-        
-        # Create Wallet
-        Wallet.objects.create(user=instance)
-        
-        # Create User Settings
-        UserSetting.objects.create(user=instance)
-
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """
-    Save related models when user is saved
-    """
-    try:
-        instance.profile.save()
-    except Profile.DoesNotExist:
-        # If profile doesn't exist, create it
-        Profile.objects.create(
-            user=instance,
-            phone_number=f"0700000000{instance.id}",
-            gender='Other',
-            sexual_orientation='Other',
-            age=25,
-            nationality='Kenyan',
-            county='Nairobi',
-            city_town='Nairobi',
-            location='Nairobi CBD',
-            services_offered='Dinner Date'
-        )
+        """Service names in the order the user listed them (prefetch ``profile_services__service``)"""
+        return [entry.service.name for entry in self.profile_services.all()]
+    
+    def set_services(self, text):
+        """Replace this profile's services with the comma-separated names in ``text``"""
+        services = Service.resolve(text)
+        with transaction.atomic():
+            ProfileService.objects.filter(profile=self).delete()
+            ProfileService.objects.bulk_create([
+                ProfileService(profile=self, service=service, position=position)
+                for position, service in enumerate(services)
+            ])
+        self._loaded_services_offered = text
+
+
+class Service(models.Model):
+    """A service profiles can offer, matched case-insensitively by slug"""
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=100, unique=True, allow_unicode=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+    
+    @staticmethod
+    def parse(text):
+        """``[(slug, name)]`` for each distinct service in a comma-separated string"""
+        parsed = {}
+        for name in (text or '').split(','):
+            name = ' '.join(name.split())[:100]
+            slug = slugify(name, allow_unicode=True)[:100] or name.lower()
+            if name and slug not in parsed:
+                parsed[slug] = name
+        return list(parsed.items())
+    
+    @classmethod
+    def resolve(cls, text):
+        """Services named in ``text``, in order, creating any that don't exist yet"""
+        parsed = cls.parse(text)
+        slugs = [slug for slug, _ in parsed]
+        existing = cls.objects.in_bulk(slugs, field_name='slug')
+        missing = [cls(slug=slug, name=name) for slug, name in parsed if slug not in existing]
+        if missing:
+            cls.objects.bulk_create(missing, ignore_conflicts=True)
+            existing = cls.objects.in_bulk(slugs, field_name='slug')
+        return [existing[slug] for slug in slugs]
+
+
+class ProfileService(models.Model):
+    """Through table between Profile and Service"""
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='profile_services')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='profile_services')
+    position = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['position']
+        unique_together = ['profile', 'service']
+        indexes = [
+            # Filtering and facet counts go from service to profiles
+            models.Index(fields=['service', 'profile']),
+        ]
+    
+    def __str__(self):
+        return f"{self.profile.user.username}: {self.service.name}"
+    
+    @staticmethod
+    def profiles_offering(services):
+        """Profile ids (as a subquery) offering every one of ``services``"""
+        matches = ProfileService.objects.filter(service__in=services).values('profile')
+        if len(services) > 1:
+            matches = matches.annotate(
+                matched=models.Count('service', distinct=True)
+            ).filter(matched=len(services))
+        return matches.values('profile')
+
+
+@receiver(post_save, sender=Profile)
+def sync_profile_services(sender, instance, created, **kwargs):
+    """Keep the Service links in step with the services_offered text"""
+    if created or instance.services_offered != getattr(instance, '_loaded_services_offered', None):
+        instance.set_services(instance.services_offered)
+
 # ================================
 # 2. MEDIA MANAGEMENT
 # ================================
@@ -140,7 +238,7 @@ def save_user_profile(sender, instance, **kwargs):
 class Photo(models.Model):
     """User uploaded photos"""
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='photos')
-    image = models.ImageField(upload_to='photos/%Y/%m/%d/')
+    image = models.ImageField(upload_to='photos/%Y/%m/%d/', storage=blob_storage)
     caption = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
@@ -153,11 +251,24 @@ class Photo(models.Model):
 
 class Video(models.Model):
     """User uploaded videos with view tracking"""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    PROCESSING_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+        (SKIPPED, 'Skipped (no ffmpeg)'),
+    ]
+    
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='videos')
-    video_file = models.FileField(upload_to='videos/%Y/%m/%d/')
+    video_file = models.FileField(upload_to='videos/%Y/%m/%d/', storage=blob_storage)
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
-    thumbnail = models.ImageField(upload_to='video_thumbnails/', blank=True, null=True)
+    thumbnail = models.ImageField(upload_to='video_thumbnails/', storage=blob_storage, blank=True, null=True)
     
     # Statistics
     views = models.IntegerField(default=0)
@@ -165,11 +276,25 @@ class Video(models.Model):
 
     @property
     def likes_count(self):
-        return self.video_likes.count()
+        # Kept in step with VideoLike by main.interactions
+        return self.likes
+
+    @property
+    def poster_url(self):
+        """The thumbnail through the block-checked view, versioned so a replaced one isn't served from cache"""
+        if not self.thumbnail:
+            return ''
+        version = hashlib.md5(self.thumbnail.name.encode()).hexdigest()[:8]
+        return f"{reverse('video_poster', args=[self.id])}?v={version}"
     
     # Metadata
     duration = models.IntegerField(help_text="Duration in seconds", default=0)
     
+    # Transcoded copies, filled in by main.transcoding
+    processing_status = models.CharField(max_length=20, choices=PROCESSING_CHOICES, default=PENDING)
+    web_file = models.FileField(max_length=255, blank=True, help_text="H.264/AAC MP4 with faststart")
+    hls_playlist = models.FileField(max_length=255, blank=True, help_text="HLS master playlist")
+    
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -203,8 +328,8 @@ class Post(models.Model):
     post_type = models.CharField(max_length=10, choices=POST_TYPES, default='text')
     
     # Media fields (optional based on post_type)
-    image = models.ImageField(upload_to='posts/images/', null=True, blank=True)
-    video = models.FileField(upload_to='posts/videos/', null=True, blank=True)
+    image = models.ImageField(upload_to='posts/images/', storage=blob_storage, null=True, blank=True)
+    video = models.FileField(upload_to='posts/videos/', storage=blob_storage, null=True, blank=True)
     
     # Visibility & Status
     is_archived = models.BooleanField(default=False)
@@ -229,6 +354,8 @@ class Post(models.Model):
         indexes = [
             models.Index(fields=['-created_at', 'user']),
             models.Index(fields=['is_archived']),
+            # Keyset pages of a user's archived posts
+            models.Index(fields=['user', 'is_archived', '-created_at', '-id']),
         ]
     
     def __str__(self):
@@ -298,6 +425,11 @@ class Conversation(models.Model):
     last_message = models.TextField(blank=True)
     last_message_at = models.DateTimeField(null=True, blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['-last_message_at', '-id']),
+        ]
+    
     def __str__(self):
         participant_names = [p.username for p in self.participants.all()[:3]]
         return f"Conversation: {', '.join(participant_names)}"
@@ -323,7 +455,7 @@ class Message(models.Model):
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES, default='text')
     
     # Media fields
-    media_file = models.FileField(upload_to='messages/media/', null=True, blank=True)
+    media_file = models.FileField(upload_to='messages/media/', storage=blob_storage, null=True, blank=True)
     
     # Status
     is_read = models.BooleanField(default=False)
@@ -343,11 +475,70 @@ class Message(models.Model):
     
     def __str__(self):
         return f"Message from {self.sender.username}: {self.content[:50]}..."
+
+    @property
+    def media_url(self):
+        """Video and audio go through the participant-checked view (main.media_serving)"""
+        if not self.media_file:
+            return None
+        if self.message_type in ('video', 'audio'):
+            return reverse('message_media', args=[self.id])
+        return self.media_file.url
     
     def save(self, *args, **kwargs):
+        is_new = self._state.adding
         # Update conversation's last message
         super().save(*args, **kwargs)
         self.conversation.update_last_message(self.content)
+        if is_new:
+            UnreadCounter.record_message(self)
+            transaction.on_commit(lambda: publish_new_message(self))
+
+class UnreadCounter(models.Model):
+    """Denormalized count of unread messages per user and conversation"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='unread_counters')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='unread_counters')
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'conversation']
+    
+    def __str__(self):
+        return f"{self.user.username}: {self.count} unread in conversation #{self.conversation_id}"
+    
+    @classmethod
+    def record_message(cls, message):
+        """Bump the counter of every participant except the sender"""
+        recipient_ids = list(
+            Conversation.participants.through.objects.filter(
+                conversation_id=message.conversation_id
+            ).exclude(user_id=message.sender_id).values_list('user_id', flat=True)
+        )
+        if not recipient_ids:
+            return
+        cls.objects.bulk_create(
+            [cls(user_id=user_id, conversation_id=message.conversation_id) for user_id in recipient_ids],
+            ignore_conflicts=True,
+        )
+        cls.objects.filter(
+            conversation_id=message.conversation_id,
+            user_id__in=recipient_ids,
+        ).update(count=models.F('count') + 1, updated_at=timezone.now())
+    
+    @classmethod
+    def mark_read(cls, user, conversation):
+        """Reset ``user``'s counter for ``conversation``"""
+        cls.objects.filter(user=user, conversation=conversation).exclude(count=0).update(
+            count=0, updated_at=timezone.now()
+        )
+    
+    @classmethod
+    def total_for(cls, user):
+        """Unread messages across all of ``user``'s conversations"""
+        return cls.objects.filter(user=user, count__gt=0).aggregate(
+            total=models.Sum('count')
+        )['total'] or 0
 
 class Contact(models.Model):
     """User's contact list"""
@@ -389,6 +580,11 @@ class CallLog(models.Model):
     
     class Meta:
         ordering = ['-started_at']
+        indexes = [
+            # Keyset pages of call history, one per side of the call
+            models.Index(fields=['caller', '-started_at', '-id']),
+            models.Index(fields=['receiver', '-started_at', '-id']),
+        ]
     
     def __str__(self):
         return f"{self.caller.username} → {self.receiver.username} ({self.call_type}, {self.duration}s)"
@@ -506,6 +702,11 @@ class ServiceBooking(models.Model):
     
     class Meta:
         ordering = ['-booking_date']
+        indexes = [
+            # Keyset pages of the booking list, one per side of the booking
+            models.Index(fields=['client', '-created_at', '-id']),
+            models.Index(fields=['service_provider', '-created_at', '-id']),
+        ]
     
     def __str__(self):
         return f"Booking #{self.id}: {self.client.username} → {self.service_provider.username}"
@@ -583,4 +784,104 @@ class VideoLike(models.Model):
         unique_together = ['user', 'video']
     
     def __str__(self):
-        return f"{self.user.username} liked {self.video.title}"
\ No newline at end of file
+        return f"{self.user.username} liked {self.video.title}"
+
+# ================================
+# 7. BACKGROUND TASKS
+# ================================
+
+class Task(models.Model):
+    """A unit of background work, run by ``manage.py run_tasks`` (see main.tasks)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100, help_text="Registered task name")
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    priority = models.SmallIntegerField(default=0, help_text="Higher runs first")
+    # Enqueuing again with the same key returns the existing task
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Not claimed before this (retry backoff)")
+    last_error = models.TextField(blank=True)
+    
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Claiming: the next due task by priority
+            models.Index(fields=['status', '-priority', 'run_at', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
+# ================================
+# 8. RESUMABLE UPLOADS
+# ================================
+
+class ChunkedUpload(models.Model):
+    """A file being sent in pieces (see main.uploads); deleted once claimed by a form"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+    kind = models.CharField(max_length=30, help_text="Key into UPLOAD_LIMITS")
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField(help_text="Declared total size in bytes")
+    offset = models.BigIntegerField(default=0, help_text="Bytes received so far")
+    sha256 = models.CharField(max_length=64, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+    
+    @property
+    def completed(self):
+        return self.offset >= self.size
+    
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+# ================================
+# 9. MEDIA BLOBS
+# ================================
+
+class Blob(models.Model):
+    """A stored media file, named by the SHA-256 of its content (see main.storage and main.blobs)"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, help_text="Storage name under blobs/")
+    size = models.BigIntegerField(default=0)
+    # Media fields pointing at it, across Photo, Video, Post and Message
+    ref_count = models.IntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last written or re-used; unreferenced blobs are kept for a grace period after this
+    last_used_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            # Garbage collection: unreferenced and idle
+            models.Index(fields=['ref_count', 'last_used_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
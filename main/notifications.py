@@ -0,0 +1,29 @@
+# main/notifications.py
+"""
+Outgoing notifications, sent from background tasks (main.tasks) so the
+request that triggers them doesn't wait on the mail server.
+"""
+from django.contrib.sites.models import Site
+from django.core.mail import send_mail
+from django.urls import reverse
+
+from .models import Invitation
+from .tasks import task
+
+
+@task(max_attempts=8)
+def send_invitation(invitation_id):
+    """Email a pending invitation to the invitee"""
+    invitation = Invitation.objects.select_related('inviter').filter(id=invitation_id, status='pending').first()
+    if invitation is None:
+        return
+    signup_url = f"https://{Site.objects.get_current().domain}{reverse('account_signup')}"
+    send_mail(
+        subject=f'{invitation.inviter.username} invited you to join',
+        message=(
+            f'{invitation.inviter.username} has invited you to join them.\n\n'
+            f'Create your account here: {signup_url}\n'
+        ),
+        from_email=None,
+        recipient_list=[invitation.invitee_email],
+    )
@@ -0,0 +1,303 @@
+# main/pagination.py
+"""
+Keyset ("seek") pagination.
+
+Django's ``Paginator`` runs a COUNT(*) and fetches pages with OFFSET, so the
+database reads and throws away every row before the requested page: page
+500 of a booking list costs 500 times page 1. ``KeysetPaginator`` instead
+remembers the sort key of the row at the edge of the page and asks for the
+rows that sort after it, which is an index seek at any depth.
+
+The ordering is a list of field or annotation names (``'-created_at'``,
+``'search_rank'``); ``id`` is appended as a tiebreaker so every row has a
+unique position. NULLs of nullable fields sort last. Cursors are opaque
+url-safe strings carrying the edge row's key and the direction, so pages
+link to their neighbours (Older/Newer) instead of to page numbers.
+
+When every key sorts the same way and can't be NULL, the "after" test is
+a row value comparison, ``(created_at, id) < (%s, %s)``, which the
+database answers by seeking straight into a matching index; otherwise it
+is spelled out as ``a < x OR (a = x AND b < y) ...``. Lists that are an
+OR of indexed conditions ("bookings I made or received") pass them as
+``partitions``: each side is paged on its own index and the sides are
+merged, rather than collecting and sorting every matching row.
+
+A total is optional: pass ``count`` when one is already known (the search
+facets have it), or ``cached_count(queryset)`` for a COUNT(*) that is
+reused for ``KEYSET_COUNT_TIMEOUT`` seconds and is only run if a template
+actually shows it.
+"""
+import base64
+import binascii
+import hashlib
+import json
+from datetime import date, datetime
+from functools import cmp_to_key, reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import BooleanField, Expression, F, Q, Value
+
+KEYSET_COUNT_TIMEOUT = 60
+CURSOR_PARAM = 'cursor'
+ROW_VALUE_VENDORS = ('sqlite', 'postgresql', 'mysql')
+
+
+def encode_cursor(direction, values):
+    raw = json.dumps([direction, [
+        value.isoformat() if isinstance(value, (date, datetime)) else value
+        for value in values
+    ]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(direction, values)`` or ``None`` for a missing/garbled cursor"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+    if direction not in ('next', 'previous') or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+class RowValueCompare(Expression):
+    """``(a, b, ...) < (x, y, ...)`` (or any other ``operator``)"""
+    conditional = True
+    output_field = BooleanField()
+
+    def __init__(self, lhs, rhs, operator):
+        super().__init__()
+        self.lhs, self.rhs, self.operator = list(lhs), list(rhs), operator
+
+    def get_source_expressions(self):
+        return self.lhs + self.rhs
+
+    def set_source_expressions(self, expressions):
+        self.lhs, self.rhs = expressions[:len(self.lhs)], expressions[len(self.lhs):]
+
+    def as_sql(self, compiler, connection):
+        sides, params = [], []
+        for side in (self.lhs, self.rhs):
+            parts = []
+            for expression in side:
+                sql, expression_params = compiler.compile(expression)
+                parts.append(sql)
+                params.extend(expression_params)
+            sides.append('(%s)' % ', '.join(parts))
+        return f'{sides[0]} {self.operator} {sides[1]}', params
+
+
+def cached_count(queryset, timeout=KEYSET_COUNT_TIMEOUT):
+    """
+    A callable returning ``queryset.count()``, cached per query for
+    ``timeout`` seconds, so totals may lag recent writes slightly.
+    """
+    def count():
+        try:
+            sql, params = queryset.order_by().query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'keyset-count:' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        total = cache.get(key)
+        if total is None:
+            total = queryset.count()
+            cache.set(key, total, timeout)
+        return total
+    return count
+
+
+def page_querystring(request):
+    """``request.GET`` without the cursor/page, for building page links"""
+    query = request.GET.copy()
+    query.pop(CURSOR_PARAM, None)
+    query.pop('page', None)
+    return query.urlencode()
+
+
+class KeysetPage:
+    """One page of rows plus the cursors of its neighbours (``None`` at either end)"""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self.object_list)} rows>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Pages through ``queryset`` ordered by ``ordering`` plus an ``id``
+    tiebreaker. ``count`` is an optional total, as a number or a callable
+    evaluated on first use. ``partitions`` are Q objects whose OR is the
+    list (they may overlap).
+    """
+
+    def __init__(self, queryset, ordering, per_page, count=None, partitions=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self._count = count
+        self.partitions = partitions or []
+
+        # (name, descending, nullable)
+        self.keys = []
+        for term in ordering:
+            name = term.lstrip('-')
+            self.keys.append((name, term.startswith('-'), self._nullable(name)))
+        if not any(name in ('id', 'pk') for name, _, _ in self.keys):
+            descending = self.keys[-1][1] if self.keys else True
+            self.keys.append(('id', descending, False))
+
+    def _field(self, name):
+        try:
+            return self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def _nullable(self, name):
+        field = self._field(name)
+        # Annotations may be NULL as far as we know
+        return field.null if field is not None else True
+
+    @property
+    def count(self):
+        if callable(self._count):
+            self._count = self._count()
+        return self._count
+
+    def key_of(self, row):
+        return [getattr(row, name) for name, _, _ in self.keys]
+
+    def _parse_key(self, values):
+        if len(values) != len(self.keys):
+            raise ValueError('cursor does not match the ordering')
+        parsed = []
+        for (name, _, _), value in zip(self.keys, values):
+            field = self._field(name)
+            parsed.append(field.to_python(value) if field is not None and value is not None else value)
+        return parsed
+
+    def _order_by(self, reverse):
+        terms = []
+        for name, descending, nullable in self.keys:
+            nulls = {}
+            if nullable:
+                # NULLs stay at the end of the page order
+                nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+            expression = F(name).desc(**nulls) if descending != reverse else F(name).asc(**nulls)
+            terms.append(expression)
+        return terms
+
+    def _beyond(self, name, descending, nullable, value, reverse):
+        """Rows past ``value`` on this key alone, in the direction of travel"""
+        if value is None:
+            # NULLs are last: nothing follows them, everything else precedes them
+            return Q(**{f'{name}__isnull': False}) if reverse else None
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition = Q(**{f'{name}__{lookup}': value})
+        if nullable and not reverse:
+            condition |= Q(**{f'{name}__isnull': True})
+        return condition
+
+    def _seek(self, values, reverse):
+        """Rows after ``values`` in page order (before them when ``reverse``)"""
+        directions = {descending for _, descending, _ in self.keys}
+        if (
+            len(directions) == 1 and
+            connections[self.queryset.db].vendor in ROW_VALUE_VENDORS and
+            not any(nullable for _, _, nullable in self.keys) and
+            None not in values
+        ):
+            operator = '<' if directions.pop() != reverse else '>'
+            return RowValueCompare(
+                [F(name) for name, _, _ in self.keys],
+                [Value(value, output_field=self._field(name)) for (name, _, _), value in zip(self.keys, values)],
+                operator,
+            )
+
+        terms = []
+        equal = Q()
+        for (name, descending, nullable), value in zip(self.keys, values):
+            beyond = self._beyond(name, descending, nullable, value, reverse)
+            if beyond is not None:
+                terms.append(equal & beyond)
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        return reduce(or_, terms) if terms else Q(pk__in=[])
+
+    def _merge(self, rows, reverse):
+        """Partition rows deduplicated and sorted in the direction of travel"""
+        def compare(a, b):
+            for name, descending, _ in self.keys:
+                x, y = getattr(a, name), getattr(b, name)
+                if x == y:
+                    continue
+                if x is None or y is None:
+                    result = 1 if x is None else -1
+                else:
+                    result = -1 if (x < y) != descending else 1
+                return -result if reverse else result
+            return 0
+        unique = {row.pk: row for row in rows}
+        return sorted(unique.values(), key=cmp_to_key(compare))
+
+    def page(self, cursor=None):
+        """The page after (or before) ``cursor``; the first page for a missing or stale cursor"""
+        position = decode_cursor(cursor)
+        values = None
+        if position:
+            try:
+                values = self._parse_key(position[1])
+            except (ValueError, TypeError, ValidationError):
+                position = None
+        reverse = bool(position) and position[0] == 'previous'
+
+        branches = [self.queryset.filter(partition) for partition in self.partitions] or [self.queryset]
+        rows = []
+        for branch in branches:
+            branch = branch.order_by(*self._order_by(reverse))
+            if values is not None:
+                branch = branch.filter(self._seek(values, reverse))
+            rows.extend(branch[:self.per_page + 1])
+        if len(branches) > 1:
+            rows = self._merge(rows, reverse)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+        has_next = has_more if not reverse else True
+        has_previous = has_more if reverse else values is not None
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor('next', self.key_of(rows[-1]))
+        if rows and has_previous:
+            previous_cursor = encode_cursor('previous', self.key_of(rows[0]))
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
@@ -0,0 +1,141 @@
+# main/profile_summary.py
+"""
+Cached, precomputed profile page data.
+
+``profile_view`` used to recompute booking and call aggregates, pick (and
+re-save) a primary photo and load photos, videos and posts on every hit.
+``get_profile_summary`` computes all of that once per profile and keeps it in
+the cache until one of the underlying rows changes; the receivers below drop
+the cached copy on any save or delete of a Photo, Video, Post,
+ServiceBooking or CallLog belonging to the profile, and of a Comment or
+like on one of its posts.
+
+Booking and call counters on ``Profile`` are refreshed by the same receivers
+with a single UPDATE instead of being re-saved from the view.
+"""
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CallLog, Comment, Photo, Post, PostInteraction, Profile, ServiceBooking, Video
+
+PROFILE_SUMMARY_TIMEOUT = 60 * 10
+RECENT_POSTS = 10
+# Profile fields the summary is computed from
+SUMMARY_FIELDS = ('services_offered', 'primary_photo')
+
+
+def _cache_key(profile_id):
+    return f'profile-summary:{profile_id}'
+
+
+def _booking_stats(user_id):
+    stats = ServiceBooking.objects.filter(
+        service_provider_id=user_id,
+        status__in=['completed', 'confirmed']
+    ).aggregate(
+        total_bookings=Count('id'),
+        total_earnings=Sum('total_amount')
+    )
+    stats['total_bookings'] = stats['total_bookings'] or 0
+    return stats
+
+
+def _call_stats(user_id):
+    stats = CallLog.objects.filter(
+        receiver_id=user_id,
+        status='completed'
+    ).aggregate(
+        total_calls=Count('id'),
+        total_duration=Sum('duration')
+    )
+    stats['total_calls'] = stats['total_calls'] or 0
+    return stats
+
+
+def build_profile_summary(profile):
+    """Compute everything on the profile page that doesn't depend on the viewer"""
+    photos = list(Photo.objects.filter(profile=profile).order_by('-is_primary', '-uploaded_at'))
+    primary_photo = next((photo for photo in photos if photo.id == profile.primary_photo_id), None)
+
+    posts = list(
+        Post.objects.filter(user_id=profile.user_id).select_related('user').annotate(
+            likes_count=Count('interactions', filter=Q(interactions__interaction_type='like'))
+        ).prefetch_related('comments__user__profile__primary_photo').order_by('-created_at')[:RECENT_POSTS]
+    )
+
+    return {
+        'primary_photo': primary_photo,
+        'photos': photos,
+        'videos': list(Video.objects.filter(profile=profile).order_by('-uploaded_at')),
+        'posts': posts,
+        'services_list': [entry.service.name for entry in profile.profile_services.select_related('service')],
+        'booking_stats': _booking_stats(profile.user_id),
+        'call_stats': _call_stats(profile.user_id),
+    }
+
+
+def get_profile_summary(profile):
+    """Cached ``build_profile_summary``"""
+    key = _cache_key(profile.id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_profile_summary(profile)
+        cache.set(key, summary, PROFILE_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_profile_summary(profile_id):
+    cache.delete(_cache_key(profile_id))
+
+
+def _invalidate_for_user(user_id):
+    profile_id = Profile.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+    if profile_id:
+        invalidate_profile_summary(profile_id)
+
+
+# ==================== INVALIDATION ====================
+
+@receiver([post_save, post_delete], sender=Photo)
+@receiver([post_save, post_delete], sender=Video)
+def media_changed(sender, instance, **kwargs):
+    invalidate_profile_summary(instance.profile_id)
+
+
+@receiver([post_save, post_delete], sender=Post)
+def post_changed(sender, instance, **kwargs):
+    _invalidate_for_user(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=PostInteraction)
+def post_activity_changed(sender, instance, **kwargs):
+    # Recent posts are cached with their comments and like counts; saves, shares and reports aren't shown
+    if sender is PostInteraction and instance.interaction_type != 'like':
+        return
+    profile_id = Profile.objects.filter(user__posts=instance.post_id).values_list('id', flat=True).first()
+    if profile_id:
+        invalidate_profile_summary(profile_id)
+
+
+@receiver(post_save, sender=Profile)
+def profile_changed(sender, instance, update_fields=None, **kwargs):
+    # services_offered feeds services_list
+    if instance.has_changed(SUMMARY_FIELDS, update_fields):
+        invalidate_profile_summary(instance.id)
+
+
+@receiver([post_save, post_delete], sender=ServiceBooking)
+def booking_changed(sender, instance, **kwargs):
+    user_id = instance.service_provider_id
+    Profile.objects.filter(user_id=user_id).update(total_bookings=_booking_stats(user_id)['total_bookings'])
+    _invalidate_for_user(user_id)
+
+
+@receiver([post_save, post_delete], sender=CallLog)
+def call_changed(sender, instance, **kwargs):
+    user_id = instance.receiver_id
+    Profile.objects.filter(user_id=user_id).update(total_calls=_call_stats(user_id)['total_calls'])
+    _invalidate_for_user(user_id)
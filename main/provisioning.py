@@ -0,0 +1,206 @@
+# main/provisioning.py
+"""
+Account provisioning: every User has exactly one Profile, Wallet and
+UserSetting.
+
+Profiles used to be created by two ``post_save`` receivers on User (the
+second of which also re-saved the profile on every User save, so every
+login's ``last_login`` update rewrote the profile), three
+``get_user_profile`` helpers in the views and ``ProfileCreationMiddleware``,
+each with its own defaults. All of them now go through this module:
+
+* ``provision_user`` creates the three rows in one transaction. It runs
+  once, from the ``post_save`` receiver below, when a User is created.
+* ``get_profile`` returns ``user.profile`` (cached on the user object, and
+  so on ``request.user`` for the rest of the request) and only provisions
+  accounts that predate the receiver.
+* ``backfill_users`` provisions every account missing any of the rows for
+  ``manage.py create_user_profiles``. It walks the user table in id ranges
+  and fills the gaps in each with ``INSERT ... SELECT ... WHERE NOT EXISTS``
+  statements, one transaction per range, so no rows pass through Python, a
+  million-user table takes minutes and an interrupted run can simply be
+  restarted.
+"""
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .discovery import invalidate_search_results
+from .geo import locate_profile
+from .models import Profile, ProfileService, Service, UserSetting, Wallet
+from .search import index_profiles
+
+BACKFILL_BATCH_SIZE = 5000
+# The phone number is unique, so placeholders are derived from the user id
+PHONE_PLACEHOLDER = '0700000000{}'
+
+PROFILE_DEFAULTS = {
+    'gender': 'Other',
+    'sexual_orientation': 'Other',
+    'age': 25,
+    'nationality': 'Kenyan',
+    'county': 'Nairobi',
+    'city_town': 'Nairobi',
+    'location': 'Nairobi CBD',
+    'services_offered': 'Dinner Date',
+}
+
+
+def default_profile(user):
+    """An unsaved Profile for ``user`` with the placeholder details new accounts start with"""
+    return Profile(user=user, phone_number=PHONE_PLACEHOLDER.format(user.id), **PROFILE_DEFAULTS)
+
+
+def provision_user(user, created=False):
+    """
+    Create whichever of ``user``'s Profile, Wallet and UserSetting are
+    missing (all three when ``created``) in one transaction, and return the
+    profile.
+    """
+    with transaction.atomic():
+        if created:
+            profile = default_profile(user)
+            profile.save(force_insert=True)
+            Wallet.objects.create(user=user)
+            UserSetting.objects.create(user=user)
+        else:
+            profile = Profile.objects.filter(user=user).first()
+            if profile is None:
+                profile = default_profile(user)
+                profile.save(force_insert=True)
+            Wallet.objects.get_or_create(user=user)
+            UserSetting.objects.get_or_create(user=user)
+    user.profile = profile
+    return profile
+
+
+def get_profile(user):
+    """``user``'s profile, provisioning the account if it has none yet"""
+    try:
+        return user.profile
+    except Profile.DoesNotExist:
+        return provision_user(user)
+
+
+def current_profile(user):
+    """``get_profile`` for ``request.profile``, joining the avatar photo the page header shows"""
+    if not User.profile.related.is_cached(user):
+        profile = Profile.objects.select_related('primary_photo').filter(user=user).first()
+        if profile is not None:
+            user.profile = profile
+    return get_profile(user)
+
+
+def missing_records(users=None):
+    """Ids of ``users`` (default: all) missing each row, as anti-join subqueries"""
+    users = User.objects.all() if users is None else users
+    return {
+        'profiles': users.filter(profile__isnull=True).values_list('id', flat=True),
+        'wallets': users.filter(wallet__isnull=True).values_list('id', flat=True),
+        'settings': users.filter(settings__isnull=True).values_list('id', flat=True),
+    }
+
+
+def _insert_missing(cursor, template, start, stop, expressions):
+    """
+    ``INSERT ... SELECT`` a copy of ``template`` for every user with an id in
+    ``[start, stop)`` that has no ``type(template)`` row. ``expressions`` maps
+    columns to ``(sql, params)`` computed from the user row ``u``.
+    """
+    model = type(template)
+    quote = connection.ops.quote_name
+    columns, values, params = [], [], []
+    for field in model._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        columns.append(quote(field.column))
+        if field.column in expressions:
+            sql, expression_params = expressions[field.column]
+            values.append(sql)
+            params.extend(expression_params)
+        else:
+            values.append('%s')
+            params.append(field.get_db_prep_save(field.pre_save(template, True), connection))
+    table = quote(model._meta.db_table)
+    user_column = quote(model._meta.get_field('user').column)
+    cursor.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(values)} "
+        f"FROM {quote(User._meta.db_table)} u WHERE u.id >= %s AND u.id < %s "
+        f"AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{user_column} = u.id)",
+        params + [start, stop]
+    )
+    return cursor.rowcount
+
+
+def _backfill_range(start, stop, located, services):
+    """Fill the gaps for user ids in ``[start, stop)``; ``located`` is the geocoded default profile"""
+    if connection.vendor == 'mysql':
+        phone = ('CONCAT(%s, u.id)', [PHONE_PLACEHOLDER.format('')])
+    else:
+        phone = ('CAST(%s AS TEXT) || CAST(u.id AS TEXT)', [PHONE_PLACEHOLDER.format('')])
+    user_id = ('u.id', [])
+    new_profile_users = list(missing_records(User.objects.filter(id__gte=start, id__lt=stop))['profiles'])
+
+    with connection.cursor() as cursor:
+        counts = {
+            'profiles': _insert_missing(cursor, located, start, stop, {'user_id': user_id, 'phone_number': phone}),
+            'wallets': _insert_missing(cursor, Wallet(), start, stop, {'user_id': user_id}),
+            'settings': _insert_missing(cursor, UserSetting(), start, stop, {'user_id': user_id}),
+        }
+
+    if new_profile_users:
+        # Nothing above sent post_save: link services and index the new profiles here
+        profile_ids = list(Profile.objects.filter(user_id__in=new_profile_users).values_list('id', flat=True))
+        ProfileService.objects.bulk_create([
+            ProfileService(profile_id=profile_id, service=service, position=position)
+            for profile_id in profile_ids
+            for position, service in enumerate(services)
+        ])
+        index_profiles(profile_ids)
+    return counts
+
+
+def backfill_users(batch_size=BACKFILL_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Provision every user missing a Profile, Wallet or UserSetting, walking
+    the user table in id ranges of ``batch_size`` with one transaction per
+    range. ``progress(done, total, counts)`` is called after each range,
+    with ``done``/``total`` in ids. Returns ``{'profiles': n, 'wallets': n,
+    'settings': n}``, created (or, with ``dry_run``, missing).
+    """
+    counts = {'profiles': 0, 'wallets': 0, 'settings': 0}
+    bounds = User.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return counts
+    low, high = bounds['low'], bounds['high']
+
+    # Every backfilled profile gets the same place and services, so geocode
+    # and resolve them once instead of per row
+    located = default_profile(User(id=0))
+    locate_profile(Profile, located)
+    services = [] if dry_run else Service.resolve(PROFILE_DEFAULTS['services_offered'])
+
+    for start in range(low, high + 1, batch_size):
+        stop = start + batch_size
+        if dry_run:
+            missing = missing_records(User.objects.filter(id__gte=start, id__lt=stop))
+            chunk = {name: ids.count() for name, ids in missing.items()}
+        else:
+            with transaction.atomic():
+                chunk = _backfill_range(start, stop, located, services)
+        for name, count in chunk.items():
+            counts[name] += count
+        if progress:
+            progress(min(stop, high + 1) - low, high + 1 - low, counts)
+
+    if counts['profiles'] and not dry_run:
+        invalidate_search_results()
+    return counts
+
+
+@receiver(post_save, sender=User)
+def provision_new_user(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        provision_user(instance, created=True)
@@ -0,0 +1,268 @@
+# main/realtime.py
+"""
+Server push for conversations.
+
+Views publish events (new messages, read receipts, typing) to a broker and
+the ``api_conversation_stream`` view fans them out to every open chat tab as
+Server-Sent Events. The stream is an async view, so it only scales when the
+project is served through ``backend.asgi`` (uvicorn, daphne, or gunicorn with
+the uvicorn worker); under WSGI it answers 204 and the browser keeps polling.
+
+WSGI deployments can long-poll instead: ``api_get_conversation_messages``
+with ``?wait=N`` parks the request thread in the broker's bounded wait
+registry (``version``/``wait_for_change``) until the conversation publishes
+an event or the timeout passes. Only threaded servers wait (a sync gunicorn
+worker has one thread, which a long-poll would take from everyone else), and
+``gunicorn.conf.py`` caps the registry one below the worker's thread count
+with ``limit_waiters``.
+
+The default ``InProcessBroker`` only reaches subscribers and waiters in the
+same process. Every event also bumps a version key in the cache, which a
+waiter checks every ``LONG_POLL_CHECK_INTERVAL`` seconds, so a message saved
+by another worker arrives within that interval when ``CACHES`` is shared
+(Redis, Memcached). With a per-process cache the waiter re-runs its query at
+that interval instead. Multi-process deployments can also point
+``REALTIME_BROKER`` at a class with the same interface backed by Redis
+pub/sub.
+"""
+import asyncio
+import json
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+STREAM_KEEPALIVE = getattr(settings, 'REALTIME_KEEPALIVE', 15)
+STREAM_LIFETIME = getattr(settings, 'REALTIME_STREAM_LIFETIME', 300)
+SUBSCRIBER_QUEUE_SIZE = 100
+LONG_POLL_MAX_WAITERS = getattr(settings, 'LONG_POLL_MAX_WAITERS', 16)
+LONG_POLL_MAX_WAIT = getattr(settings, 'LONG_POLL_MAX_WAIT', 25)
+LONG_POLL_CHECK_INTERVAL = getattr(settings, 'LONG_POLL_CHECK_INTERVAL', 2)
+
+
+def conversation_channel(conversation_id):
+    return f'conversation:{conversation_id}'
+
+
+class InProcessBroker:
+    """
+    Fan-out broker for a single process.
+
+    ``publish`` may be called from any thread (sync views run in a thread
+    pool under ASGI); events are handed to each subscriber's event loop with
+    ``call_soon_threadsafe``. Slow subscribers drop events rather than
+    growing without bound.
+
+    Every publish also bumps the channel's version and wakes threads blocked
+    in ``wait_for_change``. At most ``max_waiters`` threads may block at
+    once so long-polls can never tie up every worker thread.
+    """
+
+    def __init__(self, max_waiters=None):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._versions = {}
+        self._conditions = {}
+        self._waiting = 0
+        self.max_waiters = LONG_POLL_MAX_WAITERS if max_waiters is None else max_waiters
+
+    def publish(self, channel, event):
+        with self._lock:
+            self._versions[channel] = self._versions.get(channel, 0) + 1
+            condition = self._conditions.get(channel)
+            if condition is not None:
+                condition[0].notify_all()
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                pass
+        return len(subscribers)
+
+    @staticmethod
+    def _offer(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(entry)
+        try:
+            yield entry[1]
+        finally:
+            with self._lock:
+                channel_subscribers = self._subscribers.get(channel)
+                if channel_subscribers is not None:
+                    channel_subscribers.discard(entry)
+                    if not channel_subscribers:
+                        del self._subscribers[channel]
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+    def version(self, channel):
+        """Number of events published on ``channel`` so far"""
+        with self._lock:
+            return self._versions.get(channel, 0)
+
+    def wait_for_change(self, channel, version, timeout):
+        """
+        Block until ``channel`` moves past ``version`` or ``timeout`` seconds
+        pass. Returns True/False for changed/timed out, or None without
+        waiting when the registry is already full.
+        """
+        with self._lock:
+            if self._versions.get(channel, 0) != version:
+                return True
+            if self._waiting >= self.max_waiters:
+                return None
+            # [condition, number of threads waiting on it]
+            entry = self._conditions.setdefault(channel, [threading.Condition(self._lock), 0])
+            entry[1] += 1
+            self._waiting += 1
+            try:
+                return entry[0].wait_for(lambda: self._versions.get(channel, 0) != version, timeout)
+            finally:
+                self._waiting -= 1
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._conditions[channel]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker configured by ``REALTIME_BROKER``"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                path = getattr(settings, 'REALTIME_BROKER', 'main.realtime.InProcessBroker')
+                _broker = import_string(path)()
+    return _broker
+
+
+def limit_waiters(threads):
+    """Cap the wait registry one below the server's ``threads`` per process, so one is always free"""
+    broker = get_broker()
+    if hasattr(broker, 'max_waiters'):
+        broker.max_waiters = max(0, min(broker.max_waiters, threads - 1))
+
+
+def _version_key(channel):
+    return f'realtime-version:{channel}'
+
+
+def shared_version(channel):
+    """The channel's version across processes, from the cache; None with a per-process cache"""
+    if isinstance(caches['default'], (LocMemCache, DummyCache)):
+        return None
+    return caches['default'].get(_version_key(channel), 0)
+
+
+def _bump_shared_version(channel):
+    cache = caches['default']
+    try:
+        cache.incr(_version_key(channel))
+    except ValueError:
+        cache.add(_version_key(channel), 1, None)
+
+
+def publish_conversation_event(conversation_id, event_type, data):
+    """Push ``data`` to everyone streaming ``conversation_id``"""
+    channel = conversation_channel(conversation_id)
+    _bump_shared_version(channel)
+    get_broker().publish(channel, {'type': event_type, 'data': data})
+
+
+def publish_new_message(message):
+    from .messaging import serialize_message
+    publish_conversation_event(message.conversation_id, 'message', serialize_message(message))
+
+
+def publish_read_receipt(conversation_id, reader, read_at):
+    publish_conversation_event(conversation_id, 'read', {
+        'reader': reader.username,
+        'reader_id': reader.id,
+        'read_at': read_at.isoformat(),
+    })
+
+
+def publish_typing(conversation_id, user, is_typing):
+    publish_conversation_event(conversation_id, 'typing', {
+        'user_id': user.id,
+        'username': user.username,
+        'is_typing': bool(is_typing),
+    })
+
+
+def wait_for_messages(conversation_id, queryset, wait):
+    """
+    Evaluate ``queryset``; while it is empty, block in the wait registry for
+    up to ``wait`` seconds and re-evaluate it each time the conversation
+    publishes an event. Every ``LONG_POLL_CHECK_INTERVAL`` seconds the
+    shared version is checked for events from other processes (or, with a
+    per-process cache, the query simply re-run). A full registry degrades
+    to a plain poll.
+    """
+    broker = get_broker()
+    channel = conversation_channel(conversation_id)
+    deadline = time.monotonic() + wait
+    while True:
+        version, shared = broker.version(channel), shared_version(channel)
+        results = list(queryset.all())
+        if results or time.monotonic() >= deadline:
+            return results
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # One last look catches whatever the checks missed
+                return list(queryset.all())
+            changed = broker.wait_for_change(channel, version, min(remaining, LONG_POLL_CHECK_INTERVAL))
+            if changed is None:
+                # Registry full: answer like a plain poll
+                return results
+            if changed or shared is None or shared_version(channel) != shared:
+                break
+
+
+def format_sse(event):
+    """Encode a broker event as one Server-Sent Events frame"""
+    return f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+async def event_stream(channel, keepalive=STREAM_KEEPALIVE, lifetime=STREAM_LIFETIME):
+    """
+    Yield SSE frames for ``channel`` until ``lifetime`` seconds pass.
+
+    Streams are recycled because Django does not tell a streaming response
+    that its client went away; ``EventSource`` reconnects on its own.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + lifetime
+    async with get_broker().subscribe(channel) as queue:
+        yield 'retry: 3000\n\n'
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), min(keepalive, remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_sse(event)
@@ -0,0 +1,373 @@
+# main/search.py
+"""
+Full-text profile search.
+
+``search_view`` and ``api_search_users`` used to OR together ``icontains``
+filters, which scan the whole profile table on every search. Profiles are
+now mirrored into a search index kept next to ``main_profile``:
+
+* SQLite: an FTS5 table (``main_profile_search``) plus an ``fts5vocab``
+  table over its terms, ranked with bm25.
+* PostgreSQL: a ``tsvector`` table with a GIN index, ranked with
+  ``ts_rank``, and a pg_trgm index on usernames for misspellings.
+
+Every query token matches as a prefix ("nai" finds "Nairobi"). When the
+exact query finds nothing, callers can ask again with ``fuzzy=True``, which
+widens each token to close spellings from the index ("nairobbi" finds
+"Nairobi"). Other databases fall back to the old ``icontains`` filters.
+
+``match_profiles`` joins the index to the caller's queryset, matching in
+the join condition, so the full-text query runs once and the rank is a
+column of the joined row that filters, ordering and page cursors can use.
+
+The index tables are created by migration 0006. On PostgreSQL it needs
+the pg_trgm extension, which a database owner can create on PostgreSQL 13
+and later; on older servers, or without the privilege, have a superuser run
+``CREATE EXTENSION pg_trgm`` first, or the migration leaves out the
+trigram index and fuzzy username matching is skipped.
+
+The index is updated from Profile saves that change an indexed column,
+Profile deletes, and User saves that may have changed the username or
+email. ``QuerySet.update()``
+and ``bulk_create`` skip signals, so run ``manage.py rebuild_search_index``
+after bulk changes.
+"""
+import difflib
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import BooleanField, Case, Expression, FloatField, IntegerField, Q, Value, When
+from django.db.models.sql.constants import INNER
+from django.db.models.sql.datastructures import Join
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Profile
+
+SEARCH_MAX_RESULTS = 200
+FUZZY_MIN_LENGTH = 4
+FUZZY_CANDIDATES = 5000
+
+# What the public profile search may match on, and what the "new message"
+# user picker may match on.
+PUBLIC_FIELDS = ('username', 'city_town', 'county', 'services_offered')
+CONTACT_FIELDS = ('username', 'email', 'phone_number')
+
+# (column, source expression, weight) in index column order
+INDEXED_FIELDS = (
+    ('username', 'u.username', 10.0),
+    ('email', 'u.email', 1.0),
+    ('phone_number', 'p.phone_number', 1.0),
+    ('city_town', 'p.city_town', 4.0),
+    ('county', 'p.county', 3.0),
+    ('services_offered', 'p.services_offered', 2.0),
+)
+
+# The indexed columns that come from the profile row
+PROFILE_COLUMNS = tuple(column for column, source, weight in INDEXED_FIELDS if source.startswith('p.'))
+
+SOURCE_SQL = 'FROM main_profile p JOIN auth_user u ON u.id = p.user_id'
+
+
+def tokenize(query):
+    return re.findall(r'\w+', (query or '').lower())
+
+
+class SQLiteSearchBackend:
+    table = 'main_profile_search'
+    vocab_table = 'main_profile_search_vocab'
+    # Index column matching main_profile.id
+    join_column = 'rowid'
+
+    def _insert_sql(self, where=''):
+        columns = ', '.join(name for name, _, _ in INDEXED_FIELDS)
+        sources = ', '.join(f"COALESCE({source}, '')" for _, source, _ in INDEXED_FIELDS)
+        return f'INSERT INTO {self.table} (rowid, {columns}) SELECT p.id, {sources} {SOURCE_SQL} {where}'
+
+    def rebuild(self, cursor):
+        cursor.execute(f'DELETE FROM {self.table}')
+        cursor.execute(self._insert_sql())
+
+    def index(self, cursor, profile_ids):
+        placeholders = ', '.join(['%s'] * len(profile_ids))
+        cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', profile_ids)
+        cursor.execute(self._insert_sql(f'WHERE p.id IN ({placeholders})'), profile_ids)
+
+    def remove(self, cursor, profile_ids):
+        placeholders = ', '.join(['%s'] * len(profile_ids))
+        cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', profile_ids)
+
+    def _close_terms(self, cursor, token):
+        """Indexed terms within a typo or two of ``token`` (sharing its first two letters)"""
+        if len(token) < FUZZY_MIN_LENGTH:
+            return []
+        start = token[:2]
+        end = start[:-1] + chr(ord(start[-1]) + 1)
+        cursor.execute(
+            f'SELECT term FROM {self.vocab_table} WHERE term >= %s AND term < %s LIMIT %s',
+            [start, end, FUZZY_CANDIDATES]
+        )
+        terms = [term for term, in cursor.fetchall() if abs(len(term) - len(token)) <= 2]
+        return difflib.get_close_matches(token, terms, n=3, cutoff=0.75)
+
+    def _match(self, cursor, tokens, fields, fuzzy):
+        clauses = []
+        for token in tokens:
+            options = [f'"{token}"*']
+            if fuzzy:
+                options += [f'"{term}"' for term in self._close_terms(cursor, token)]
+            clauses.append('(' + ' OR '.join(options) + ')')
+        return '{%s} : (%s)' % (' '.join(fields), ' AND '.join(clauses))
+
+    def _rank(self, alias):
+        weights = ', '.join(str(weight) for _, _, weight in INDEXED_FIELDS)
+        return f'bm25({alias}.{self.table}, {weights})'
+
+    def search(self, cursor, tokens, fields, limit, fuzzy=False):
+        cursor.execute(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+            f'ORDER BY {self._rank(self.table)} LIMIT %s',
+            [self._match(cursor, tokens, fields, fuzzy), limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def match_sql(self, cursor, tokens, fields, fuzzy=False):
+        """
+        ``(condition, rank, condition_params, rank_params)`` on the index
+        joined as ``{alias}``: the match, and the matched row's rank (lower
+        is better)
+        """
+        match = self._match(cursor, tokens, fields, fuzzy)
+        return '{alias}.%s MATCH %%s' % self.table, self._rank('{alias}'), [match], []
+
+
+class PostgresSearchBackend:
+    table = 'main_profile_search'
+    join_column = 'profile_id'
+    # tsvector weight per field; queries restrict matches to their fields' weights
+    weights = {
+        'username': 'A',
+        'city_town': 'B', 'county': 'B',
+        'services_offered': 'C',
+        'email': 'D', 'phone_number': 'D',
+    }
+    # Whether pg_trgm is installed, once known
+    trigrams = None
+    document_sql = (
+        "setweight(to_tsvector('simple', COALESCE(u.username, '')), 'A') || "
+        "setweight(to_tsvector('simple', COALESCE(p.city_town, '') || ' ' || COALESCE(p.county, '')), 'B') || "
+        "setweight(to_tsvector('simple', COALESCE(p.services_offered, '')), 'C') || "
+        "setweight(to_tsvector('simple', COALESCE(u.email, '') || ' ' || COALESCE(p.phone_number, '')), 'D')"
+    )
+
+    def _upsert_sql(self, where=''):
+        return (
+            f'INSERT INTO {self.table} (profile_id, document, username) '
+            f'SELECT p.id, {self.document_sql}, u.username {SOURCE_SQL} {where} '
+            'ON CONFLICT (profile_id) DO UPDATE SET document = EXCLUDED.document, username = EXCLUDED.username'
+        )
+
+    def rebuild(self, cursor):
+        cursor.execute(f'TRUNCATE {self.table}')
+        cursor.execute(self._upsert_sql())
+
+    def index(self, cursor, profile_ids):
+        cursor.execute(self._upsert_sql('WHERE p.id = ANY(%s)'), [list(profile_ids)])
+
+    def remove(self, cursor, profile_ids):
+        cursor.execute(f'DELETE FROM {self.table} WHERE profile_id = ANY(%s)', [list(profile_ids)])
+
+    def _has_trigrams(self, cursor):
+        """Whether pg_trgm is installed (see the module docstring); looked up once per process"""
+        if PostgresSearchBackend.trigrams is None:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            PostgresSearchBackend.trigrams = cursor.fetchone() is not None
+        return PostgresSearchBackend.trigrams
+
+    def _condition(self, cursor, tokens, fields, fuzzy, alias):
+        """``(where, rank, params)``: a match condition on the index and a rank expression (lower is better)"""
+        if fuzzy:
+            if 'username' not in fields or not self._has_trigrams(cursor):
+                return 'false', 'NULL', []
+            # Misspelled usernames via trigram similarity
+            username = ' '.join(tokens)
+            return f'{alias}.username %% %s', f'-similarity({alias}.username, %s)', [username]
+        weights = ''.join(sorted({self.weights[field] for field in fields}))
+        tsquery = ' & '.join(f'{token}:*{weights}' for token in tokens)
+        return (
+            f"{alias}.document @@ to_tsquery('simple', %s)",
+            f"-ts_rank({alias}.document, to_tsquery('simple', %s))",
+            [tsquery],
+        )
+
+    def search(self, cursor, tokens, fields, limit, fuzzy=False):
+        where, rank, params = self._condition(cursor, tokens, fields, fuzzy, self.table)
+        cursor.execute(
+            f'SELECT profile_id FROM {self.table} WHERE {where} ORDER BY {rank} LIMIT %s',
+            params + params + [limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def match_sql(self, cursor, tokens, fields, fuzzy=False):
+        where, rank, params = self._condition(cursor, tokens, fields, fuzzy, '{alias}')
+        # float8 so the value round-trips exactly through page cursors
+        return where, f'({rank})::float8', params, params
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using=None):
+    """The index backend for ``using`` (default connection), or None to fall back to icontains"""
+    backend = BACKENDS.get((using or connection).vendor)
+    return backend() if backend else None
+
+
+def _fallback_condition(tokens, fields):
+    lookups = {
+        'username': 'user__username__icontains',
+        'email': 'user__email__icontains',
+    }
+    condition = Q()
+    for token in tokens:
+        token_condition = Q()
+        for field in fields:
+            token_condition |= Q(**{lookups.get(field, f'{field}__icontains'): token})
+        condition &= token_condition
+    return condition
+
+
+def _fallback_search(tokens, fields, limit):
+    return list(Profile.objects.filter(_fallback_condition(tokens, fields)).values_list('id', flat=True)[:limit])
+
+
+def search_profile_ids(query, fields=PUBLIC_FIELDS, limit=SEARCH_MAX_RESULTS):
+    """Profile ids matching ``query`` on ``fields``, best match first"""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    backend = get_search_backend()
+    if backend is None:
+        return _fallback_search(tokens, fields, limit)
+    with connection.cursor() as cursor:
+        ids = backend.search(cursor, tokens, fields, limit)
+        if not ids:
+            ids = backend.search(cursor, tokens, fields, limit, fuzzy=True)
+    return ids
+
+
+class IndexCondition(Expression):
+    """The backend's match condition on the joined index"""
+    conditional = True
+    output_field = BooleanField()
+
+    def __init__(self, alias, sql, params):
+        super().__init__()
+        self.alias, self.sql, self.params = alias, sql, params
+
+    def as_sql(self, compiler, connection):
+        return self.sql.format(alias=compiler.quote_name_unless_alias(self.alias)), self.params
+
+
+class IndexRank(IndexCondition):
+    """The joined index row's rank; follows the join when the query is relabeled as a subquery"""
+    conditional = False
+    output_field = FloatField()
+
+    def relabeled_clone(self, change_map):
+        return IndexRank(change_map.get(self.alias, self.alias), self.sql, self.params)
+
+
+class IndexJoin:
+    """
+    Stands in for a relation field in a ``Join`` to the index: joined on the
+    profile id, with the match as an extra condition of the join
+    """
+
+    def __init__(self, column, condition, params):
+        self.column, self.condition, self.params = column, condition, params
+
+    def get_joining_columns(self):
+        return (('id', self.column),)
+
+    def get_extra_restriction(self, alias, related_alias):
+        return IndexCondition(alias, self.condition, self.params)
+
+
+def match_profiles(queryset, query, fields=PUBLIC_FIELDS, fuzzy=False):
+    """
+    ``queryset`` narrowed to the profiles matching ``query`` and annotated
+    with ``search_rank`` (lower is better). The match is a join to the
+    index, so the caller's other filters see every match, not a capped list
+    of the best ones. ``fuzzy`` widens the query to close spellings.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.none()
+    backend = get_search_backend()
+    if backend is None:
+        return queryset.filter(_fallback_condition(tokens, fields)).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    with connection.cursor() as cursor:
+        condition, rank, condition_params, rank_params = backend.match_sql(cursor, tokens, fields, fuzzy)
+    queryset = queryset.all()
+    join = Join(
+        backend.table, queryset.query.get_initial_alias(), None, INNER,
+        IndexJoin(backend.join_column, condition, condition_params), nullable=False,
+    )
+    alias = queryset.query.join(join)
+    return queryset.annotate(search_rank=IndexRank(alias, rank, rank_params))
+
+
+def order_by_rank(queryset, ids):
+    """Annotate ``search_rank`` (position in ``ids``) so results can keep the index's ranking"""
+    if not ids:
+        return queryset.annotate(search_rank=Value(0, output_field=IntegerField()))
+    return queryset.annotate(search_rank=Case(
+        *[When(id=pk, then=Value(position)) for position, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    ))
+
+
+def index_profiles(profile_ids):
+    backend = get_search_backend()
+    if backend is not None and profile_ids:
+        with connection.cursor() as cursor:
+            backend.index(cursor, list(profile_ids))
+
+
+def rebuild_search_index():
+    backend = get_search_backend()
+    if backend is not None:
+        with connection.cursor() as cursor:
+            backend.rebuild(cursor)
+    return Profile.objects.count()
+
+
+# ==================== SYNC ====================
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or instance.has_changed(PROFILE_COLUMNS, update_fields):
+        index_profiles([instance.id])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Username and email are indexed from the user row; skip logins' ``last_login`` updates"""
+    if created or (update_fields is not None and not {'username', 'email'} & set(update_fields)):
+        return
+    index_profiles(list(Profile.objects.filter(user=instance).values_list('id', flat=True)))
+
+
+@receiver(post_delete, sender=Profile)
+def profile_deleted(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        with connection.cursor() as cursor:
+            backend.remove(cursor, [instance.id])
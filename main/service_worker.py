@@ -0,0 +1,115 @@
+# main/service_worker.py
+"""
+The service worker script, served from ``/sw.js``.
+
+``static/js/sw.js`` existed but nothing registered it, and as a file under
+``/static/js/`` it could only have controlled that directory. It is now
+served from the site root (``service_worker`` view), registered by
+``base.html``, with a ``SW_CONFIG`` object prepended:
+
+* ``version``: a hash of the script and of everything it precaches, so a
+  deploy that changes any of them installs a new worker, which precaches
+  the new files and evicts the old caches on activate;
+* ``precache``: the bundles (``main.assets``) that the pages kept for
+  offline use link, found in their templates, by their hashed URLs;
+* the URL patterns its runtime strategies apply to (``static/js/sw.js``
+  has the strategies themselves).
+
+Those pages and JSON responses are private. ``CachePartitionMiddleware``
+tags signed-in responses with an opaque per-user key
+(``cache_partition``). The worker stores them in caches named after it,
+deletes any other user's caches when a response carries a new key, and
+deletes them all on sign-in, sign-out, a 401/403 or a redirect to the login
+page.
+"""
+import hashlib
+import json
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils.crypto import salted_hmac
+
+from .assets import BUNDLE_DIR
+from .images import DERIVED_DIR, EXTENSIONS, THUMB
+
+SCRIPT = 'js/sw.js'
+# Templates of the pages kept for offline use; the bundles they link are precached
+PAGE_TEMPLATES = (
+    'base.html', 'dashboard/dashboard.html', 'dashboard/inbox.html', 'dashboard/conversation.html',
+    'dashboard/profile.html',
+)
+BUNDLE_RE = re.compile(r'''\{%%\s*static\s+["'](%s/[^"']+)["']\s*%%\}''' % BUNDLE_DIR)
+PARTITION_HEADER = 'X-Cache-Partition'
+# Runtime cache limits (entries)
+MAX_PAGES = 20
+MAX_API_RESPONSES = 50
+MAX_AVATARS = 300
+NETWORK_TIMEOUT_MS = 3000  # pages and API calls fall back to the cache after this
+# Avatar thumbnails from main.images, linked directly or through the lazy view
+AVATAR_PATTERN = '/%s/[^/]+\\.%s\\.(%s)$' % (DERIVED_DIR, THUMB, '|'.join(EXTENSIONS.values()))
+
+
+def static_files():
+    """``{path: absolute path}`` of every static file, from the finders (collected or not)"""
+    found = {}
+    for finder in finders.get_finders():
+        for path, storage in finder.list([]):
+            found.setdefault(path.replace('\\', '/'), storage.path(path))
+    return found
+
+
+def _read(path):
+    with open(path, 'rb') as handle:
+        return handle.read()
+
+
+def page_bundles():
+    """The bundles ``PAGE_TEMPLATES`` link"""
+    paths = set()
+    for name in PAGE_TEMPLATES:
+        paths.update(BUNDLE_RE.findall(get_template(name).template.source))
+    return paths
+
+
+def cache_partition(user):
+    """Opaque, stable key for ``user``'s cached pages"""
+    return salted_hmac('main.service_worker.cache_partition', str(user.pk)).hexdigest()[:16]
+
+
+def build_script():
+    files = static_files()
+    script = _read(files.get(SCRIPT) or staticfiles_storage.path(SCRIPT))
+    # Only files that exist, so one stale reference can't fail the install
+    paths = sorted(path for path in page_bundles() if path in files)
+
+    fingerprint = hashlib.sha256(script)
+    for path in paths:
+        fingerprint.update(_read(files[path]))
+    config = {
+        'version': fingerprint.hexdigest()[:12],
+        'precache': [staticfiles_storage.url(path) for path in paths],
+        'staticUrl': settings.STATIC_URL,
+        'logoutUrl': reverse('account_logout'),
+        'loginUrl': reverse('account_login'),
+        'partitionHeader': PARTITION_HEADER,
+        # Pages and JSON that fall back to their last cached copy
+        'pages': [reverse('dashboard'), reverse('inbox'), '/conversation/', '/profile/'],
+        'api': ['/api/conversation/\\d+/(messages|history)/$', '/api/notifications/$'],
+        'avatars': AVATAR_PATTERN,
+        'networkTimeout': NETWORK_TIMEOUT_MS,
+        'limits': {'pages': MAX_PAGES, 'api': MAX_API_RESPONSES, 'avatars': MAX_AVATARS},
+    }
+    return f'self.SW_CONFIG = {json.dumps(config)};\n\n'.encode() + script
+
+
+cached_script = lru_cache(maxsize=1)(build_script)
+
+
+def service_worker_script():
+    """The script with its config; rebuilt per request in DEBUG so edits show up"""
+    return build_script() if settings.DEBUG else cached_script()
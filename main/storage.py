@@ -0,0 +1,123 @@
+# main/storage.py
+"""
+Content-addressed storage for uploaded media.
+
+Every upload used to become its own file under its field's ``upload_to``
+directory, so the same picture uploaded twice, or sent as a photo, a post
+and a message, was stored (and backed up) once per copy. The media fields
+of ``Photo``, ``Video``, ``Post`` and ``Message`` now use
+``ContentAddressedStorage``, which names each file after the SHA-256 of its
+bytes, ``blobs/<first two hex digits>/<sha256><ext>``, ignoring
+``upload_to``:
+
+* a file whose content is already stored is not written again; the new row
+  points at the existing blob;
+* the hash comes from the upload handler (``main.uploads``) when it already
+  computed it while the file streamed in, so only other saves (admin,
+  scripts) read the content an extra time;
+* every blob has a ``Blob`` row; ``main.blobs`` keeps its reference count
+  and deletes it once nothing refers to it.
+
+The name is always the hash of the bytes it holds, which the media ETags
+rely on. Stripping an image's EXIF (``main.images``) therefore stores the
+stripped bytes as a new blob and moves the rows to it rather than
+rewriting the file.
+"""
+import hashlib
+import logging
+import posixpath
+import re
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = 'blobs'
+READ_SIZE = 64 * 1024
+LOCK_TIMEOUT = 60  # seconds
+BLOB_NAME_RE = re.compile(r'^%s/([0-9a-f]{2})/\1[0-9a-f]{62}(\.[^/.]+)?$' % BLOB_DIR)
+
+
+def blob_name(digest, extension=''):
+    """``blobs/ab/abcdef....jpg``"""
+    return posixpath.join(BLOB_DIR, digest[:2], f'{digest}{extension}')
+
+
+def is_blob_name(name):
+    """A blob itself, not a file derived from one (``blobs/ab/<sha256>.mp4/derived/...``)"""
+    return bool(name) and BLOB_NAME_RE.match(name) is not None
+
+
+def blob_digest(name):
+    """The SHA-256 in a blob's name"""
+    return posixpath.splitext(posixpath.basename(name))[0]
+
+
+def content_digest(content):
+    """SHA-256 of a File, read once, leaving it rewound"""
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(READ_SIZE):
+        sha256.update(chunk)
+    content.seek(0)
+    return sha256.hexdigest()
+
+
+@contextmanager
+def blob_lock(digest):
+    """Serialise writing and collecting one blob (per cache: per process with the default local cache)"""
+    key = f'blob:{digest}:lock'
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not cache.add(key, True, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            logger.warning('Gave up waiting for the lock on blob %s', digest)
+            break
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """MEDIA_ROOT storage that files each upload under the hash of its content"""
+
+    def get_available_name(self, name, max_length=None):
+        if is_blob_name(name):
+            # Two writers raced on a new blob: Django's suffixing keeps both
+            return super().get_available_name(name, max_length)
+        # The upload_to name is only used for its extension
+        return name
+
+    def _save(self, name, content):
+        Blob = apps.get_model('main', 'Blob')
+        digest = content_digest(content)
+        extension = posixpath.splitext(name)[1].lower()[:10]
+
+        if Blob.objects.filter(sha256=digest).update(last_used_at=timezone.now()):
+            existing = Blob.objects.filter(sha256=digest).values_list('name', flat=True).first()
+            if existing and self.exists(existing):
+                return existing
+
+        with blob_lock(digest):
+            stored = Blob.objects.filter(sha256=digest).values_list('name', flat=True).first()
+            if stored and self.exists(stored):
+                return stored
+            name = super()._save(blob_name(digest, extension), content)
+            Blob.objects.update_or_create(sha256=digest, defaults={
+                'name': name, 'size': content.size, 'last_used_at': timezone.now(),
+            })
+            return name
+
+
+blob_storage = ContentAddressedStorage()
@@ -0,0 +1,208 @@
+# main/tasks.py
+"""
+Database-backed background tasks.
+
+Views used to do slow work (image processing, sending mail) inside the
+request. They now ``enqueue`` it instead: one INSERT, committed with the
+rest of the request's transaction, so a task never runs for a row that was
+rolled back. ``manage.py run_tasks`` runs the queue; no broker is needed.
+
+* Functions become tasks with ``@task()`` and are enqueued by function or
+  registered name with keyword arguments that must be JSON-serializable.
+* Workers claim the due task with the highest ``priority`` (then the oldest)
+  with a compare-and-set ``UPDATE``, or ``SELECT ... FOR UPDATE SKIP
+  LOCKED`` where the database has it, so any number of worker processes
+  and threads can share the table.
+* A task that raises is retried with exponential backoff (plus jitter) until
+  ``max_attempts``, then marked failed with its traceback. Raise ``Retry``
+  to retry without logging an error.
+* Workers renew the lease on the tasks they are running; a task whose
+  worker died is requeued once its lease (``TASK_LEASE_SECONDS``) expires,
+  so tasks run at least once and should be safe to repeat.
+* ``idempotency_key`` makes enqueuing the same work twice a no-op while the
+  first task is queued, running or succeeded; a failed one is requeued.
+
+With ``TASKS_EAGER`` (on under ``manage.py test``) ``enqueue`` runs the task
+in-process before returning.
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+TASKS_EAGER = getattr(settings, 'TASKS_EAGER', False)
+TASK_LEASE_SECONDS = getattr(settings, 'TASK_LEASE_SECONDS', 600)
+TASK_BACKOFF_BASE = getattr(settings, 'TASK_BACKOFF_BASE', 10)  # seconds before the first retry
+TASK_BACKOFF_MAX = getattr(settings, 'TASK_BACKOFF_MAX', 60 * 60)
+TASK_RETENTION_DAYS = getattr(settings, 'TASK_RETENTION_DAYS', 7)
+
+# name -> (function, defaults)
+registry = {}
+
+
+class Retry(Exception):
+    """Raise from a task to retry it later (after ``delay`` seconds, or the usual backoff)"""
+
+    def __init__(self, message='', delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+
+def task(name=None, priority=0, max_attempts=5):
+    """Register a function as a task under ``name`` (default: ``module.function``)"""
+    def register(func):
+        task_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        if task_name in registry and registry[task_name][0] is not func:
+            raise ValueError(f'Task {task_name!r} is already registered')
+        registry[task_name] = (func, {'priority': priority, 'max_attempts': max_attempts})
+        func.task_name = task_name
+        return func
+    return register
+
+
+def enqueue(func, kwargs=None, *, priority=None, delay=0, idempotency_key=None, max_attempts=None):
+    """
+    Queue ``func`` (a registered task or its name) to run with ``kwargs``
+    after ``delay`` seconds, and return the Task.
+    """
+    name = getattr(func, 'task_name', func)
+    if name not in registry:
+        raise ValueError(f'Unknown task {name!r}')
+    defaults = registry[name][1]
+    fields = {
+        'name': name,
+        'kwargs': kwargs or {},
+        'priority': defaults['priority'] if priority is None else priority,
+        'max_attempts': max_attempts or defaults['max_attempts'],
+        'run_at': timezone.now() + timedelta(seconds=delay),
+    }
+
+    if idempotency_key is None:
+        queued = Task.objects.create(**fields)
+    else:
+        try:
+            with transaction.atomic():
+                queued, created = Task.objects.get_or_create(idempotency_key=idempotency_key, defaults=fields)
+        except IntegrityError:
+            # Raced with another enqueue of the same key
+            queued, created = Task.objects.get(idempotency_key=idempotency_key), False
+        if not created and queued.status == Task.FAILED:
+            Task.objects.filter(id=queued.id, status=Task.FAILED).update(
+                status=Task.QUEUED, attempts=0, last_error='', finished_at=None, **{
+                    key: value for key, value in fields.items() if key != 'name'
+                }
+            )
+            queued.refresh_from_db()
+
+    if TASKS_EAGER and queued.status == Task.QUEUED:
+        claimed = _claim(queued.id, 'eager')
+        if claimed:
+            run(claimed)
+            queued.refresh_from_db()
+    return queued
+
+
+def worker_id(thread=None):
+    """``host:pid[:thread]``, stored on claimed tasks"""
+    ident = f'{socket.gethostname()}:{os.getpid()}'
+    return f'{ident}:{thread}' if thread is not None else ident
+
+
+def _claim(task_id, worker):
+    """Mark one queued task running if nobody beat us to it; returns it or None"""
+    now = timezone.now()
+    claimed = Task.objects.filter(id=task_id, status=Task.QUEUED).update(
+        status=Task.RUNNING, locked_by=worker[:100], locked_at=now, attempts=F('attempts') + 1,
+    )
+    return Task.objects.get(id=task_id) if claimed else None
+
+
+def claim_next(worker):
+    """Claim the next due task for ``worker``, or return None"""
+    due = Task.objects.filter(status=Task.QUEUED, run_at__lte=timezone.now()).order_by('-priority', 'run_at', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            candidate = due.select_for_update(skip_locked=True).values_list('id', flat=True).first()
+            return _claim(candidate, worker) if candidate else None
+
+    # Compare-and-set: another worker may claim a candidate first, so try a few
+    for candidate in due.values_list('id', flat=True)[:10]:
+        claimed = _claim(candidate, worker)
+        if claimed:
+            return claimed
+    return None
+
+
+def backoff(attempts):
+    """Seconds before retry number ``attempts``: exponential, capped, with jitter"""
+    delay = min(TASK_BACKOFF_BASE * 2 ** (attempts - 1), TASK_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run(claimed):
+    """Run a claimed task and record the outcome. Returns the final status"""
+    entry = registry.get(claimed.name)
+    now = timezone.now
+    try:
+        if entry is None:
+            raise LookupError(f'No task registered as {claimed.name!r}')
+        entry[0](**claimed.kwargs)
+    except Exception as error:
+        retry = isinstance(error, Retry)
+        if not retry:
+            logger.exception('Task %s #%s failed (attempt %s of %s)',
+                             claimed.name, claimed.id, claimed.attempts, claimed.max_attempts)
+        if entry is not None and claimed.attempts < claimed.max_attempts:
+            delay = error.delay if retry and error.delay is not None else backoff(claimed.attempts)
+            status, updates = Task.QUEUED, {'run_at': now() + timedelta(seconds=delay)}
+        else:
+            status, updates = Task.FAILED, {'finished_at': now()}
+        last_error = str(error) if retry else traceback.format_exc()
+    else:
+        status, updates, last_error = Task.SUCCEEDED, {'finished_at': now()}, ''
+
+    # Only if it is still ours: a task whose lease expired may have been requeued
+    Task.objects.filter(id=claimed.id, status=Task.RUNNING, locked_by=claimed.locked_by).update(
+        status=status, last_error=last_error, locked_by='', locked_at=None, **updates
+    )
+    return status
+
+
+def renew_leases(worker):
+    """Extend the lease on every task running under ``worker`` (``host:pid``) or its threads"""
+    # Match whole segments: host:12 must not renew host:123's tasks
+    return Task.objects.filter(
+        Q(locked_by=worker) | Q(locked_by__startswith=f'{worker}:'), status=Task.RUNNING,
+    ).update(locked_at=timezone.now())
+
+
+def requeue_expired():
+    """Requeue (or fail, when out of attempts) running tasks whose lease has not been renewed"""
+    expired = Task.objects.filter(
+        status=Task.RUNNING, locked_at__lt=timezone.now() - timedelta(seconds=TASK_LEASE_SECONDS)
+    )
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.FAILED, last_error='Worker lease expired', locked_by='', locked_at=None,
+        finished_at=timezone.now(),
+    )
+    requeued = expired.update(status=Task.QUEUED, run_at=timezone.now(), locked_by='', locked_at=None)
+    return requeued + failed
+
+
+def prune(days=TASK_RETENTION_DAYS):
+    """Delete tasks that succeeded more than ``days`` ago"""
+    return Task.objects.filter(
+        status=Task.SUCCEEDED, finished_at__lt=timezone.now() - timedelta(days=days)
+    ).delete()[0]
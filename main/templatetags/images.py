@@ -0,0 +1,44 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from ..images import FALLBACK_FORMAT, THUMB, picture_sources, srcset as image_srcset, variant_url
+
+register = template.Library()
+
+
+@register.filter
+def variant(image, size=THUMB):
+    """``{{ photo.image|variant:'small' }}``: URL of a JPEG derivative"""
+    return variant_url(image, size) or ''
+
+
+@register.filter
+def srcset(image, fmt=FALLBACK_FORMAT):
+    """``{{ photo.image|srcset:'webp' }}``: every responsive width of ``image``"""
+    return image_srcset(image, fmt)
+
+
+@register.simple_tag
+def picture(image, size='medium', alt='', sizes='100vw', css_class=''):
+    """
+    ``{% picture photo.image 'small' alt=photo.caption sizes='200px' %}``: a
+    lazily loaded ``<picture>`` offering AVIF/WebP with a JPEG fallback. The
+    ``<picture>`` is ``display: contents`` so CSS written for a bare ``<img>``
+    still applies.
+    """
+    if not image:
+        return ''
+    sources, src, fallback_srcset = picture_sources(image, size)
+    if size == THUMB:
+        sizes = ''
+    return format_html(
+        '<picture style="display: contents">{}<img src="{}" srcset="{}"{} alt="{}"{} loading="lazy" decoding="async"></picture>',
+        format_html_join('', '<source type="{}" srcset="{}"{}>', (
+            (mime_type, candidates, format_html(' sizes="{}"', sizes) if sizes else '')
+            for mime_type, candidates in sources
+        )),
+        src, fallback_srcset,
+        format_html(' sizes="{}"', sizes) if sizes else '',
+        alt,
+        format_html(' class="{}"', css_class) if css_class else '',
+    )
@@ -1,3 +1,1261 @@
-from django.test import TestCase
+import hashlib
+import json
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Q
+from django.http import Http404, JsonResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from .avatars import photo_added, refresh_primary_photo
+from .blobs import BLOB_GRACE, collect, collect_garbage
+from . import discovery
+from .discovery import SEARCH_PAGE_SIZE, search_page
+from .geo import geohash_encode, nearest
+from .images import derivative_name
+from .inbox import INBOX_PAGE_SIZE
+from .interactions import reconcile_like_counts, toggle_post_interaction
+from .media_serving import serve
+from .messaging import message_window, serialize_message
+from .middleware import QueryBudgetExceeded
+from .models import (
+    Blob, Comment, Contact, Conversation, Message, Photo, Post, PostInteraction, Profile, Service, Task,
+    UnreadCounter, UserSetting, Video, Wallet,
+)
+from .realtime import _bump_shared_version, conversation_channel, get_broker, limit_waiters, wait_for_messages
+from . import tasks
+from .pagination import KeysetPaginator, cached_count, encode_cursor
+from . import profile_summary
+from .profile_summary import get_profile_summary
+from .provisioning import PHONE_PLACEHOLDER, backfill_users, get_profile
+from .search import match_profiles, rebuild_search_index
+from .service_worker import PARTITION_HEADER, build_script, cache_partition, page_bundles
+from .storage import blob_digest, blob_storage
+from .uploads import MB, UploadRejected, append_chunk, claim_upload, limit_uploads, start_upload, upload_errors
+from .view_counters import record_view, view_counter
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+# Tests run without collectstatic, so without the manifest of hashed names
+PLAIN_STATIC = {
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(QUERY_INSTRUMENTATION=True, QUERY_BUDGET_STRICT=True, STORAGES=PLAIN_STATIC)
+class QueryBudgetTests(TestCase):
+    """Every ``@query_budget`` view stays within its budget with several rows of everything it lists"""
+    PEOPLE = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.owner = User.objects.create_user('owner', email='owner@example.com', password='pw')
+        cls.others = [
+            User.objects.create_user(f'person{i}', email=f'person{i}@example.com', password='pw')
+            for i in range(cls.PEOPLE)
+        ]
+        people = [cls.owner] + cls.others
+        profiles = list(Profile.objects.filter(user__in=people))
+        for number, profile in enumerate(profiles):
+            profile.county = 'Nairobi'
+            profile.city_town = 'Westlands'
+            profile.services_offered = 'Dinner Date, Massage'
+            profile.gender = 'Female' if number % 2 else 'Male'
+            profile.save()
+
+        # bulk_create: no image processing or transcoding for files that don't exist
+        Photo.objects.bulk_create([
+            Photo(profile=profile, image=f'photos/test/{profile.id}-{i}.jpg', is_primary=not i)
+            for profile in profiles for i in range(3)
+        ])
+        for profile in profiles:
+            profile_photo = Photo.objects.filter(profile=profile, is_primary=True).first()
+            Profile.objects.filter(id=profile.id).update(primary_photo=profile_photo)
+        Video.objects.bulk_create([
+            Video(profile=profile, video_file=f'videos/test/{profile.id}-{i}.mp4', title=f'Video {i}')
+            for profile in profiles for i in range(3)
+        ])
+
+        cls.posts = []
+        for user in people:
+            for i in range(4):
+                cls.posts.append(Post.objects.create(user=user, content=f'Post {i} by {user.username}'))
+            Post.objects.create(user=user, content='Archived', is_archived=True)
+        for post in cls.posts:
+            for user in cls.others[:3]:
+                Comment.objects.create(post=post, user=user, content='Nice')
+                PostInteraction.objects.create(post=post, user=user, interaction_type='like')
+
+        for number, other in enumerate(cls.others):
+            Contact.objects.create(user=cls.owner, contact_user=other, is_favorite=not number % 2)
+            conversation = Conversation.objects.create(
+                last_message='hello', last_message_at=now - timedelta(minutes=number)
+            )
+            conversation.participants.add(cls.owner, other)
+            Message.objects.create(conversation=conversation, sender=other, content='hello')
+            Message.objects.create(conversation=conversation, sender=cls.owner, content='hi')
+
+        rebuild_search_index()
+
+    def setUp(self):
+        cache.clear()
+        # Write the views these requests count inside the test's transaction, not at exit
+        self.addCleanup(view_counter.flush)
+        self.client.force_login(self.owner)
+
+    def assertWithinBudget(self, url, **extra):
+        """GET ``url`` twice (cold and warm caches), checking the middleware's query count against the budget"""
+        budget = resolve(url.split('?')[0]).func.query_budget
+        for attempt in ('cold', 'warm'):
+            response = self.client.get(url, **extra)
+            self.assertEqual(response.status_code, 200, url)
+            queries = int(SERVER_TIMING_QUERIES.search(response['Server-Timing']).group(1))
+            self.assertLessEqual(queries, budget, f'{url} ({attempt} cache) ran {queries} queries, budget {budget}')
+        return response
+
+    def test_own_profile(self):
+        self.assertWithinBudget(reverse('profile'))
+
+    def test_other_profile(self):
+        self.assertWithinBudget(reverse('profile_view', args=[self.others[0].username]))
+
+    def test_post_detail(self):
+        self.assertWithinBudget(reverse('post_detail', args=[self.posts[0].id]))
+
+    def test_inbox(self):
+        self.assertWithinBudget(reverse('inbox'))
+
+    def test_contacts(self):
+        self.assertWithinBudget(reverse('contacts'))
+
+    def test_search(self):
+        self.assertWithinBudget(reverse('search'))
+        self.assertWithinBudget(reverse('search') + '?query=westlands&gender=Female')
+
+    def test_search_anonymous(self):
+        self.client.logout()
+        self.assertWithinBudget(reverse('search') + '?query=nairobi')
+
+    def test_archived_posts(self):
+        self.assertWithinBudget(reverse('archived_posts'))
+
+    def test_api_search_users(self):
+        response = self.assertWithinBudget(
+            reverse('api_search_users') + '?q=person', HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(len(response.json()['users']), self.PEOPLE)
+
+    @override_settings(QUERY_BUDGET_DEFAULT=0)
+    def test_strict_mode_raises(self):
+        # A view without its own budget gets the default
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('dashboard'))
+
+
+# The dedupe markers of 200 viewers would overflow the default 300 entries and be culled
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'view-counter-tests',
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}})
+class ViewCounterConcurrencyTests(TransactionTestCase):
+    """200 concurrent viewers, each viewing twice while another thread flushes: every viewer counted once"""
+    VIEWERS = 200
+
+    def setUp(self):
+        cache.clear()
+        self.profile = Profile.objects.get(user=User.objects.create_user('viewed'))
+        self.post = Post.objects.create(user=self.profile.user, content='Viewed')
+        self.errors = []
+        self.started = threading.Barrier(self.VIEWERS)
+
+    def start(self, target, *args):
+        def run():
+            try:
+                target(*args)
+            except Exception as error:
+                self.errors.append(error)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def view(self, viewer):
+        # All viewers arrive at once; the repeat view must not count
+        self.started.wait()
+        for _ in range(2):
+            record_view(self.profile, f'user:{viewer}')
+            record_view(self.post, f'user:{viewer}')
+
+    def test_no_views_lost(self):
+        done = threading.Event()
+
+        def flush_until_done():
+            while not done.is_set():
+                view_counter.flush()
+
+        # Every add is due a flush too, so recording and writing interleave as much as possible.
+        # Flushes losing SQLite's lock are logged and retried
+        with mock.patch.object(view_counter, 'flush_interval', 0), mock.patch('main.view_counters.logger') as logger:
+            flusher = self.start(flush_until_done)
+            viewers = [self.start(self.view, viewer) for viewer in range(self.VIEWERS)]
+            for thread in viewers:
+                thread.join()
+            done.set()
+            flusher.join()
+        self.assertEqual(self.errors, [])
+        # Only the retried lock failures
+        self.assertTrue(all(name == 'warning' for name, args, kwargs in logger.method_calls))
+
+        # Flushes that lost a lock race put their increments back; write what is left
+        for attempt in range(10):
+            view_counter.flush()
+            if not view_counter.pending(Profile, self.profile.pk) and not view_counter.pending(Post, self.post.pk):
+                break
+
+        self.profile.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual(self.profile.total_views, self.VIEWERS)
+        self.assertEqual(self.post.views, self.VIEWERS)
+
+
+class LongPollTests(TestCase):
+    """``?wait=N`` long-polls: who may wait, and how messages from other processes wake them"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('poller', password='pw')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.messages = Message.objects.filter(conversation=self.conversation)
+        self.client.force_login(self.user)
+
+    def poll(self, **extra):
+        url = reverse('api_conversation_messages', args=[self.conversation.id])
+        return self.client.get(url, {'wait': 25}, HTTP_X_REQUESTED_WITH='XMLHttpRequest', **extra)
+
+    def save_elsewhere(self):
+        """A message written by another process: no event reaches this process' broker"""
+        Message.objects.bulk_create([Message(conversation=self.conversation, sender=self.user, content='hi')])
+
+    def test_single_threaded_server_does_not_wait(self):
+        with mock.patch.object(get_broker(), 'wait_for_change') as wait:
+            self.assertEqual(self.poll(**{'wsgi.multithread': False}).json(), {'messages': []})
+        wait.assert_not_called()
+
+    def test_waiters_capped_below_thread_count(self):
+        broker = get_broker()
+        with mock.patch.object(broker, 'max_waiters', 16):
+            limit_waiters(4)
+            self.assertEqual(broker.max_waiters, 3)
+            limit_waiters(1)
+            self.assertEqual(broker.max_waiters, 0)
+            self.assertIsNone(broker.wait_for_change('test', broker.version('test'), 1))
+
+    def test_per_process_cache_rechecks_the_query(self):
+        def wait_for_change(channel, version, timeout):
+            self.save_elsewhere()
+            return False
+
+        with mock.patch.object(get_broker(), 'wait_for_change', side_effect=wait_for_change) as wait:
+            self.assertEqual(len(wait_for_messages(self.conversation.id, self.messages, 25)), 1)
+        self.assertEqual(wait.call_count, 1)
+        self.assertLessEqual(wait.call_args[0][2], 2)
+
+    def test_shared_cache_version_wakes_waiters(self):
+        checks = []
+
+        def wait_for_change(channel, version, timeout):
+            checks.append(timeout)
+            if len(checks) == 3:
+                self.save_elsewhere()
+                _bump_shared_version(conversation_channel(self.conversation.id))
+            return False
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }):
+            with mock.patch.object(get_broker(), 'wait_for_change', side_effect=wait_for_change):
+                self.assertEqual(len(wait_for_messages(self.conversation.id, self.messages, 25)), 1)
+        # Unchanged versions keep waiting without querying; the bump ends the wait
+        self.assertEqual(len(checks), 3)
+
+
+calls = []
+
+
+@tasks.task(name='tests.record')
+def record_task(value, fail=0, retry_in=None):
+    calls.append(value)
+    if retry_in is not None:
+        raise tasks.Retry('later', delay=retry_in)
+    if len(calls) <= fail:
+        raise RuntimeError('boom')
+
+
+@mock.patch.object(tasks, 'TASKS_EAGER', False)
+class TaskQueueTests(TestCase):
+    """Claiming, retries, idempotency keys and leases of ``main.tasks``"""
+
+    def setUp(self):
+        calls.clear()
+
+    def claim_and_run(self, worker='host:1:0'):
+        claimed = tasks.claim_next(worker)
+        return claimed, claimed and tasks.run(claimed)
+
+    def test_claims_highest_priority_due_task(self):
+        low = tasks.enqueue(record_task, {'value': 'low'})
+        high = tasks.enqueue(record_task, {'value': 'high'}, priority=5)
+        tasks.enqueue(record_task, {'value': 'later'}, priority=9, delay=60)
+        self.assertEqual(tasks.claim_next('host:1:0').id, high.id)
+        self.assertEqual(tasks.claim_next('host:1:1').id, low.id)
+        # The delayed one isn't due, and a claimed task isn't claimed twice
+        self.assertIsNone(tasks.claim_next('host:1:2'))
+
+    def test_failure_is_retried_with_backoff_then_fails(self):
+        queued = tasks.enqueue(record_task, {'value': 1, 'fail': 5}, max_attempts=2)
+        before = timezone.now()
+        with self.assertLogs('main.tasks', 'ERROR'):
+            claimed, status = self.claim_and_run()
+        self.assertEqual(status, Task.QUEUED)
+        queued.refresh_from_db()
+        delay = (queued.run_at - before).total_seconds()
+        self.assertTrue(tasks.TASK_BACKOFF_BASE * 0.5 <= delay <= tasks.TASK_BACKOFF_BASE + 1, delay)
+        self.assertIn('boom', queued.last_error)
+
+        Task.objects.filter(id=queued.id).update(run_at=timezone.now())
+        with self.assertLogs('main.tasks', 'ERROR'):
+            claimed, status = self.claim_and_run()
+        self.assertEqual(status, Task.FAILED)
+        queued.refresh_from_db()
+        self.assertEqual((queued.attempts, queued.locked_by), (2, ''))
+
+    def test_backoff_grows_and_is_capped(self):
+        with mock.patch('random.uniform', return_value=1.0):
+            self.assertEqual([tasks.backoff(n) for n in (1, 2, 3)], [10, 20, 40])
+            self.assertEqual(tasks.backoff(30), tasks.TASK_BACKOFF_MAX)
+
+    def test_retry_uses_its_delay(self):
+        queued = tasks.enqueue(record_task, {'value': 1, 'retry_in': 300})
+        claimed, status = self.claim_and_run()
+        self.assertEqual(status, Task.QUEUED)
+        queued.refresh_from_db()
+        self.assertGreater(queued.run_at, timezone.now() + timedelta(seconds=290))
+        self.assertEqual(queued.last_error, 'later')
+
+    def test_idempotency_key(self):
+        first = tasks.enqueue(record_task, {'value': 1}, idempotency_key='once')
+        self.assertEqual(tasks.enqueue(record_task, {'value': 2}, idempotency_key='once').id, first.id)
+        self.assertEqual(Task.objects.count(), 1)
+
+        Task.objects.filter(id=first.id).update(status=Task.FAILED, attempts=5, last_error='x')
+        again = tasks.enqueue(record_task, {'value': 3}, idempotency_key='once')
+        self.assertEqual((again.id, again.status, again.attempts, again.kwargs), (first.id, Task.QUEUED, 0, {'value': 3}))
+
+    def test_expired_lease_is_requeued_and_the_old_run_ignored(self):
+        queued = tasks.enqueue(record_task, {'value': 1})
+        stale = tasks.claim_next('host:1:0')
+        Task.objects.filter(id=queued.id).update(
+            locked_at=timezone.now() - timedelta(seconds=tasks.TASK_LEASE_SECONDS + 1)
+        )
+        self.assertEqual(tasks.requeue_expired(), 1)
+        rerun = tasks.claim_next('host:2:0')
+        # The first worker finishing late must not overwrite the new run
+        tasks.run(stale)
+        self.assertEqual(Task.objects.get(id=queued.id).locked_by, 'host:2:0')
+        self.assertEqual(tasks.run(rerun), Task.SUCCEEDED)
+
+    def test_expired_lease_out_of_attempts_fails(self):
+        queued = tasks.enqueue(record_task, {'value': 1}, max_attempts=1)
+        tasks.claim_next('host:1:0')
+        Task.objects.filter(id=queued.id).update(locked_at=timezone.now() - timedelta(days=1))
+        tasks.requeue_expired()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.last_error), (Task.FAILED, 'Worker lease expired'))
+
+    def test_renew_leases_only_matches_whole_worker_ids(self):
+        old = timezone.now() - timedelta(minutes=5)
+        for worker in ('host:12:0', 'host:123:0', 'host:12'):
+            Task.objects.create(name='tests.record', status=Task.RUNNING, locked_by=worker, locked_at=old)
+        self.assertEqual(tasks.renew_leases('host:12'), 2)
+        self.assertEqual(Task.objects.get(locked_by='host:123:0').locked_at, old)
+
+
+def jpeg_with_gps():
+    image = Image.new('RGB', (400, 300), 'teal')
+    exif = Image.Exif()
+    exif[0x010F] = 'Camera maker'
+    exif[0x0112] = 6
+    exif.get_ifd(0x8825)[2] = (51.0, 30.0, 0.0)
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+class ImageMetadataTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        # Which originals have derivatives is cached by name, and names repeat across tests
+        cache.clear()
+        self.user = User.objects.create_user('frida', password='pw')
+        self.profile = Profile.objects.get(user=self.user)
+
+    def test_stripped_blob_is_stored_under_its_own_hash(self):
+        photo = Photo.objects.create(profile=self.profile, image=ContentFile(jpeg_with_gps(), name='a.jpg'))
+        original = blob_storage.save('a.jpg', ContentFile(jpeg_with_gps()))
+
+        self.assertNotEqual(photo.image.name, original)
+        photo.refresh_from_db()
+        with blob_storage.open(photo.image.name, 'rb') as stored:
+            data = stored.read()
+        self.assertEqual(hashlib.sha256(data).hexdigest(), blob_digest(photo.image.name))
+        self.assertNotIn(b'Camera maker', data)
+        self.assertEqual(Image.open(BytesIO(data)).getexif().get(0x0112), 6)
+        # The untouched upload is still under its own hash until it's collected
+        with blob_storage.open(original, 'rb') as stored:
+            self.assertEqual(hashlib.sha256(stored.read()).hexdigest(), blob_digest(original))
+        counts = dict(Blob.objects.values_list('name', 'ref_count'))
+        self.assertEqual(counts, {original: 0, photo.image.name: 1})
+        self.assertTrue(blob_storage.exists(derivative_name(photo.image.name, 'thumb')))
+
+    def test_saving_the_instance_again_keeps_the_stripped_blob(self):
+        photo = Photo.objects.create(profile=self.profile, image=ContentFile(jpeg_with_gps(), name='a.jpg'))
+        stripped = Photo.objects.get(pk=photo.pk).image.name
+        photo.caption = 'Sunset'
+        photo.save()
+        photo.refresh_from_db()
+        self.assertEqual(photo.image.name, stripped)
+        self.assertEqual(Blob.objects.get(name=stripped).ref_count, 1)
+
+    def test_message_attachments_get_no_derivatives(self):
+        other = User.objects.create_user('diego', password='pw')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user, other)
+        name = blob_storage.save('secret.jpg', ContentFile(jpeg_with_gps()))
+        Message.objects.create(
+            conversation=conversation, sender=self.user, content='', message_type='image', media_file=name,
+        )
+        path = derivative_name(name, 'thumb')
+
+        response = self.client.get(reverse('image_derivative', args=[path]))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(blob_storage.exists(path))
+
+
+class ProfileSearchTests(TestCase):
+    """Full-text profile search: prefixes, misspellings and ranking"""
+
+    def setUp(self):
+        cache.clear()
+        self.nairobi = self.profile('amina', city_town='Nairobi', county='Nairobi')
+        self.mombasa = self.profile('baraka', city_town='Mombasa', county='Mombasa', services_offered='Plumber')
+        self.plumber = self.profile('plumber', city_town='Kisumu', county='Kisumu')
+
+    def profile(self, username, **fields):
+        profile = Profile.objects.get(user=User.objects.create_user(username))
+        for name, value in fields.items():
+            setattr(profile, name, value)
+        profile.save()
+        return profile
+
+    def search(self, query):
+        return list(match_profiles(Profile.objects.all(), query).order_by('search_rank', 'id'))
+
+    def test_tokens_match_as_prefixes(self):
+        self.assertEqual(self.search('nai'), [self.nairobi])
+        self.assertEqual(self.search('mom plu'), [self.mombasa])
+
+    def test_matching_and_ranking_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.search('nai')
+
+    def test_username_outranks_services(self):
+        self.assertEqual(self.search('plumber'), [self.plumber, self.mombasa])
+
+    def test_misspellings_only_when_nothing_matches(self):
+        self.assertEqual(self.search('nairrobi'), [])
+        self.assertEqual(list(match_profiles(Profile.objects.all(), 'nairrobi', fuzzy=True)), [self.nairobi])
+
+        page, facets = search_page({'query': 'nairrobi'})
+        self.assertTrue(facets['fuzzy'])
+        self.assertEqual(page.object_list, [self.nairobi])
+
+        page, facets = search_page({'query': 'nairobi'})
+        self.assertFalse(facets['fuzzy'])
+
+
+@override_settings(STORAGES=PLAIN_STATIC)
+class InboxTests(TestCase):
+    """The inbox costs the same queries however many conversations it lists, and pages with ``?cursor=``"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('inbox-owner', password='pw')
+        self.client.force_login(self.user)
+        self.people = 0
+
+    def add_conversations(self, count):
+        for _ in range(count):
+            self.people += 1
+            other = User.objects.create_user(f'correspondent{self.people}')
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user, other)
+            Message.objects.create(conversation=conversation, sender=other, content=f'Hello {self.people}')
+
+    def inbox_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('inbox'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_queries_do_not_grow_with_the_inbox(self):
+        self.add_conversations(2)
+        small, response = self.inbox_queries()
+        self.assertEqual(len(response.context['conversations']), 2)
+
+        self.add_conversations(20)
+        large, response = self.inbox_queries()
+        self.assertEqual(len(response.context['conversations']), 22)
+        self.assertEqual(large, small)
+
+    def test_older_conversations_page_with_the_cursor_param(self):
+        self.add_conversations(INBOX_PAGE_SIZE + 1)
+        _, response = self.inbox_queries()
+        next_cursor = response.context['next_cursor']
+        self.assertContains(response, f'?cursor={next_cursor}')
+
+        _, response = self.inbox_queries(cursor=next_cursor)
+        self.assertEqual([conversation.last_message for conversation in response.context['conversations']],
+                         ['Hello 1'])
+
+
+class AvatarTests(TestCase):
+    """The avatar is the photo marked primary, else the newest, on every path that changes photos"""
+
+    def setUp(self):
+        self.profile = Profile.objects.get(user=User.objects.create_user('sitter'))
+
+    def add_photo(self, is_primary=False):
+        photo, = Photo.objects.bulk_create([Photo(profile=self.profile, image='photos/x.jpg', is_primary=is_primary)])
+        photo_added(photo)
+        return photo
+
+    def avatar(self):
+        return Profile.objects.get(pk=self.profile.pk).primary_photo
+
+    def test_newest_photo_until_one_is_marked(self):
+        self.add_photo()
+        newest = self.add_photo()
+        self.assertEqual(self.avatar(), newest)
+
+        marked = self.add_photo(is_primary=True)
+        self.add_photo()
+        self.assertEqual(self.avatar(), marked)
+
+    def test_added_and_refreshed_agree(self):
+        first = self.add_photo()
+        second = self.add_photo()
+        added = self.avatar()
+        refresh_primary_photo(self.profile.pk)
+        self.assertEqual(self.avatar(), added)
+
+        second.delete()
+        self.assertEqual(self.avatar(), first)
+
+
+class SearchPageCacheTests(TestCase):
+    """Result pages are cached for the first page and the cursors cached pages link to, nothing else"""
+
+    def setUp(self):
+        cache.clear()
+        for number in range(SEARCH_PAGE_SIZE + 5):
+            User.objects.create_user(f'listed{number}')
+        self.key = discovery._cache_key({}, False)
+
+    def test_linked_pages_are_cached(self):
+        first, _ = search_page({})
+        self.assertIsNotNone(cache.get(discovery._page_key(self.key, None)))
+        second, _ = search_page({}, first.next_cursor)
+        self.assertIsNotNone(cache.get(discovery._page_key(self.key, first.next_cursor)))
+        self.assertEqual(len(second.object_list), 5)
+
+    def test_made_up_cursors_are_not_cached(self):
+        search_page({})
+        forged = encode_cursor('next', [False, '2020-01-01T00:00:00+00:00', 1])
+        search_page({}, forged)
+        self.assertIsNone(cache.get(discovery._page_key(self.key, forged)))
+
+    def test_garbled_cursor_is_the_cached_first_page(self):
+        first, _ = search_page({})
+        with self.assertNumQueries(3):
+            # The page's rows by primary key, their services and the service names; no search
+            page, _ = search_page({}, 'not-a-cursor')
+        self.assertEqual(page.object_list, first.object_list)
+
+
+@override_settings(STORAGES=PLAIN_STATIC)
+class ServiceWorkerTests(TestCase):
+    """Only the bundles the offline pages link are precached; cached pages are keyed per user"""
+
+    def config(self):
+        script = build_script().decode()
+        return json.loads(script.split('\n', 1)[0][len('self.SW_CONFIG = '):-1])
+
+    def test_precaches_the_page_bundles(self):
+        precache = self.config()['precache']
+        self.assertIn('/static/bundles/base.css', precache)
+        self.assertEqual(precache, sorted(f'/static/{path}' for path in page_bundles()))
+        self.assertNotIn('/static/bundles/dashboard/deposit.css', precache)
+
+    def test_partition_header_per_user(self):
+        self.assertNotIn(PARTITION_HEADER, self.client.get(reverse('account_login')))
+        first = User.objects.create_user('first')
+        second = User.objects.create_user('second')
+        self.client.force_login(first)
+        self.assertEqual(self.client.get(reverse('account_login'))[PARTITION_HEADER], cache_partition(first))
+        self.assertNotEqual(cache_partition(first), cache_partition(second))
+
+
+@override_settings(STORAGES=PLAIN_STATIC)
+class UnreadCounterTests(TestCase):
+    """New messages bump the recipients' stored counters, opening the conversation resets them"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pw')
+        self.other = User.objects.create_user('writer')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+
+    def send(self, sender, count=1):
+        for number in range(count):
+            Message.objects.create(conversation=self.conversation, sender=sender, content=f'Message {number}')
+
+    def test_messages_count_for_recipients_only(self):
+        self.send(self.other, 3)
+        self.send(self.user)
+        self.assertEqual(UnreadCounter.total_for(self.user), 3)
+        self.assertEqual(UnreadCounter.total_for(self.other), 1)
+
+    def test_opening_the_conversation_resets_it(self):
+        self.send(self.other, 2)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('conversation', args=[self.conversation.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UnreadCounter.total_for(self.user), 0)
+        self.send(self.other)
+        self.assertEqual(UnreadCounter.total_for(self.user), 1)
+
+    def test_rebuild_matches_the_messages(self):
+        self.send(self.other, 2)
+        self.send(self.user)
+        UnreadCounter.objects.update(count=40)
+        call_command('rebuild_unread_counters', stdout=StringIO())
+        self.assertEqual(UnreadCounter.total_for(self.user), 2)
+        self.assertEqual(UnreadCounter.total_for(self.other), 1)
+
+
+class MessageHistoryTests(TestCase):
+    """History pages walk back through a conversation by keyset, ties on ``sent_at`` included"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('historian')
+        other = User.objects.create_user('chatter')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, other)
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=other, content=f'Message {number}')
+            for number in range(7)
+        ])
+        # Half of them sent in the same instant
+        Message.objects.filter(id__in=Message.objects.order_by('id').values('id')[:4]).update(
+            sent_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.client.force_login(self.user)
+
+    def history(self, **params):
+        return self.client.get(
+            reverse('api_conversation_history', args=[self.conversation.id]), params,
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        ).json()
+
+    def test_pages_cover_every_message_once(self):
+        seen, before = [], None
+        while True:
+            page = self.history(limit=3, **({'before': before} if before else {}))
+            seen[:0] = [message['content'] for message in page['messages']]
+            if not page['has_more']:
+                break
+            before = page['next_before']
+        expected = list(Message.objects.order_by('sent_at', 'id').values_list('content', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_window_queries_do_not_depend_on_its_size(self):
+        newest = Message.objects.latest('id').id
+        with self.assertNumQueries(2):
+            # The anchor's sent_at and the window with its senders
+            window, has_more = message_window(self.conversation, before=newest, limit=5)
+            [serialize_message(message) for message in window]
+        self.assertEqual(len(window), 5)
+        self.assertTrue(has_more)
+
+    def test_other_users_conversations_are_not_found(self):
+        self.client.force_login(User.objects.create_user('outsider'))
+        response = self.client.get(
+            reverse('api_conversation_history', args=[self.conversation.id]),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ProfileSummaryTests(TestCase):
+    """The cached profile summary is reused until something it shows changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('summarized')
+        self.profile = Profile.objects.get(user=self.owner)
+        self.post = Post.objects.create(user=self.owner, content='Hello')
+        self.visitor = User.objects.create_user('visitor')
+
+    def cached(self):
+        return cache.get(profile_summary._cache_key(self.profile.id))
+
+    def test_second_read_is_cached(self):
+        get_profile_summary(self.profile)
+        with self.assertNumQueries(0):
+            summary = get_profile_summary(self.profile)
+        self.assertEqual([post.id for post in summary['posts']], [self.post.id])
+
+    def test_comments_and_likes_invalidate(self):
+        get_profile_summary(self.profile)
+        Comment.objects.create(post=self.post, user=self.visitor, content='Nice')
+        self.assertIsNone(self.cached())
+
+        get_profile_summary(self.profile)
+        like = PostInteraction.objects.create(post=self.post, user=self.visitor, interaction_type='like')
+        self.assertIsNone(self.cached())
+        self.assertEqual(get_profile_summary(self.profile)['posts'][0].likes_count, 1)
+
+        like.delete()
+        self.assertIsNone(self.cached())
+
+    def test_saves_keep_the_summary(self):
+        get_profile_summary(self.profile)
+        PostInteraction.objects.create(post=self.post, user=self.visitor, interaction_type='save')
+        self.assertIsNotNone(self.cached())
+
+    def test_only_summary_fields_invalidate(self):
+        get_profile_summary(self.profile)
+        self.profile.city_town = 'Kisumu'
+        self.profile.save()
+        self.assertIsNotNone(self.cached())
+
+        self.profile.services_offered = 'Massage'
+        self.profile.save()
+        self.assertIsNone(self.cached())
+
+
+class LikeCounterTests(TestCase):
+    """Like toggles move ``Post.likes`` with the interaction rows; reconciling repairs drift"""
+
+    def setUp(self):
+        self.post = Post.objects.create(user=User.objects.create_user('poster'), content='Hello')
+        self.fan = User.objects.create_user('fan')
+
+    def test_toggle_moves_the_counter(self):
+        self.assertEqual(toggle_post_interaction(self.fan, self.post, 'like'), (True, 1))
+        self.assertEqual(toggle_post_interaction(self.fan, self.post, 'like'), (False, 0))
+        self.assertFalse(PostInteraction.objects.filter(post=self.post).exists())
+
+    def test_other_interactions_are_not_counted(self):
+        toggle_post_interaction(self.fan, self.post, 'save')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 0)
+
+    def test_counter_never_goes_negative(self):
+        PostInteraction.objects.create(user=self.fan, post=self.post, interaction_type='like')
+        self.assertEqual(toggle_post_interaction(self.fan, self.post, 'like'), (False, 0))
+
+    def test_reconcile(self):
+        PostInteraction.objects.create(user=self.fan, post=self.post, interaction_type='like')
+        Post.objects.filter(pk=self.post.pk).update(likes=7)
+        self.assertEqual(reconcile_like_counts(dry_run=True), {'posts': 1, 'videos': 0})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 7)
+
+        self.assertEqual(reconcile_like_counts(), {'posts': 1, 'videos': 0})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 1)
+        self.assertEqual(reconcile_like_counts(), {'posts': 0, 'videos': 0})
+
+
+class ServiceTaxonomyTests(TestCase):
+    """``services_offered`` is mirrored into Service links, and the services filter matches them exactly"""
+
+    def offer(self, username, services):
+        profile = Profile.objects.get(user=User.objects.create_user(username))
+        profile.services_offered = services
+        profile.save()
+        return profile
+
+    def test_parse_dedupes_case_insensitively(self):
+        self.assertEqual(
+            Service.parse(' Dinner  date, dinner Date,Massage,, '),
+            [('dinner-date', 'Dinner date'), ('massage', 'Massage')],
+        )
+
+    def test_saving_the_text_relinks_in_order(self):
+        profile = self.offer('offerer', 'Massage, Dinner Date')
+        self.assertEqual(profile.get_services_list(), ['Massage', 'Dinner Date'])
+
+        profile.services_offered = 'Dinner date'
+        profile.save()
+        self.assertEqual(Profile.objects.get(pk=profile.pk).get_services_list(), ['Dinner Date'])
+
+    def test_unchanged_saves_skip_the_sync(self):
+        profile = Profile.objects.get(pk=self.offer('offerer', 'Massage').pk)
+        profile.city_town = 'Kisumu'
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+        self.assertFalse([query for query in queries if 'main_profileservice' in query['sql']])
+
+    def test_filter_is_exact_and_needs_every_service(self):
+        both = self.offer('both', 'Dinner, Massage')
+        self.offer('dinner-date', 'Dinner Date')
+        self.offer('massage-only', 'Massage')
+
+        def matches(*slugs):
+            return set(discovery.filter_profiles({'services': sorted(slugs)}))
+
+        self.assertEqual(matches('dinner'), {both})
+        self.assertEqual(matches('dinner', 'massage'), {both})
+        self.assertEqual(matches('dinner', 'unknown'), set())
+
+
+class ProximitySearchTests(TestCase):
+    """Profiles are geocoded from their place names and found by radius, with facet counts to match"""
+
+    def setUp(self):
+        self.places = {}
+        for town, county, gender in (
+            ('Nairobi', 'Nairobi', 'Male'), ('Westlands', 'Nairobi', 'Female'),
+            ('Thika', 'Kiambu', 'Female'), ('Mombasa', 'Mombasa', 'Female'),
+        ):
+            profile = Profile.objects.get(user=User.objects.create_user(town.lower()))
+            profile.city_town, profile.county, profile.gender = town, county, gender
+            profile.save()
+            self.places[town] = profile
+
+    def names(self, profiles):
+        return [profile.city_town for profile in profiles]
+
+    def test_geohash(self):
+        self.assertEqual(geohash_encode(57.64911, 10.40744), 'u4pruydqq')
+        self.assertTrue(self.places['Westlands'].geohash.startswith(geohash_encode(-1.2676, 36.8108, 6)))
+
+    def test_radius_nearest_first(self):
+        self.assertEqual(self.names(discovery.filter_profiles({'near': 'nairobi', 'radius': 10})),
+                         ['Nairobi', 'Westlands'])
+        self.assertEqual(self.names(discovery.filter_profiles({'near': 'westlands', 'radius': 60})),
+                         ['Westlands', 'Nairobi', 'Thika'])
+        self.assertFalse(discovery.filter_profiles({'near': 'atlantis'}).exists())
+
+    def test_nearest_widens_the_radius(self):
+        self.assertEqual(self.names(nearest(Profile.objects.all(), -1.2864, 36.8172, 3, radius_km=1)),
+                         ['Nairobi', 'Westlands', 'Thika'])
+
+    def test_facet_counts(self):
+        facets = discovery.compute_facets(discovery.filter_profiles({'near': 'nairobi', 'radius': 60}))
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(facets['counties'], [{'value': 'Nairobi', 'count': 2}, {'value': 'Kiambu', 'count': 1}])
+        genders = {entry['value']: entry['count'] for entry in facets['genders']}
+        self.assertEqual((genders['Male'], genders['Female']), (1, 2))
+
+
+class KeysetPaginatorTests(TestCase):
+    """Keyset pages visit every row once in order, forwards and back, whatever the key shape"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.other = Conversation.objects.create()
+        self.other.participants.add(self.bob)
+        now = timezone.now()
+        for number in range(11):
+            Message.objects.create(
+                conversation=self.other if number % 3 == 0 else self.conversation,
+                sender=self.alice if number % 2 else self.bob,
+                content=f'Message {number}',
+            )
+        # Ties on sent_at, and NULLs on read_at
+        for number, message in enumerate(Message.objects.order_by('id')):
+            Message.objects.filter(pk=message.pk).update(
+                sent_at=now - timedelta(minutes=number // 3),
+                read_at=None if number % 4 == 0 else now - timedelta(minutes=number % 5),
+            )
+
+    def walk(self, paginator):
+        """Ids forwards through every page, then the same pages walked back"""
+        forward, pages, cursor = [], [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([row.id for row in page])
+            forward.extend(pages[-1])
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        backward = [pages[-1]]
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            backward.insert(0, [row.id for row in page])
+        self.assertEqual(backward, pages)
+        return forward
+
+    def expected(self, queryset, *ordering):
+        return list(queryset.order_by(*ordering).values_list('id', flat=True))
+
+    def test_row_value_seek_with_ties(self):
+        messages = Message.objects.all()
+        paginator = KeysetPaginator(messages, ['-sent_at'], 4)
+        self.assertEqual(self.walk(paginator), self.expected(messages, '-sent_at', '-id'))
+
+    def test_mixed_directions_and_nulls_last(self):
+        messages = Message.objects.all()
+        paginator = KeysetPaginator(messages, ['read_at', '-sent_at'], 3)
+        expected = self.expected(messages, F('read_at').asc(nulls_last=True), '-sent_at', '-id')
+        self.assertEqual(self.walk(paginator), expected)
+
+    def test_partitions_are_merged_once(self):
+        messages = Message.objects.all()
+        paginator = KeysetPaginator(messages, ['-sent_at'], 4, partitions=[
+            Q(sender=self.alice), Q(conversation=self.other),
+        ])
+        wanted = messages.filter(Q(sender=self.alice) | Q(conversation=self.other))
+        self.assertEqual(self.walk(paginator), self.expected(wanted, '-sent_at', '-id'))
+
+    def test_bad_cursors_give_the_first_page(self):
+        paginator = KeysetPaginator(Message.objects.all(), ['-sent_at'], 4)
+        first = [row.id for row in paginator.page()]
+        for cursor in ('garbage', encode_cursor('next', [1, 2, 3]), encode_cursor('sideways', [])):
+            self.assertEqual([row.id for row in paginator.page(cursor)], first)
+
+    def test_cached_count(self):
+        cache.clear()
+        count = cached_count(Message.objects.filter(sender=self.alice))
+        self.assertEqual(count(), 5)
+        Message.objects.create(conversation=self.conversation, sender=self.alice, content='Later')
+        with self.assertNumQueries(0):
+            self.assertEqual(count(), 5)
+
+
+class ProvisioningTests(TestCase):
+    """Every user gets one Profile, Wallet and UserSetting, once"""
+
+    def test_new_users_are_provisioned(self):
+        user = User.objects.create_user('newcomer')
+        self.assertEqual(Profile.objects.filter(user=user).count(), 1)
+        self.assertTrue(Wallet.objects.filter(user=user).exists())
+        self.assertTrue(UserSetting.objects.filter(user=user).exists())
+
+    def test_user_saves_leave_the_profile_alone(self):
+        user = User.objects.create_user('returning')
+        user.last_login = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            user.save(update_fields=['last_login'])
+        self.assertEqual([query['sql'] for query in queries if 'main_' in query['sql']], [])
+
+    def test_get_profile_fills_the_gaps(self):
+        user = User.objects.create_user('legacy')
+        Profile.objects.filter(user=user).delete()
+        Wallet.objects.filter(user=user).delete()
+        user = User.objects.get(pk=user.pk)
+
+        profile = get_profile(user)
+        self.assertEqual(profile.phone_number, PHONE_PLACEHOLDER.format(user.id))
+        self.assertTrue(Wallet.objects.filter(user=user).exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(get_profile(user), profile)
+
+
+class BackfillTests(TestCase):
+    """``backfill_users`` provisions users created without signals, chunk by chunk, and is idempotent"""
+
+    def setUp(self):
+        User.objects.create_user('provisioned')
+        User.objects.bulk_create([User(username=f'imported{number}') for number in range(7)])
+        self.imported = User.objects.filter(username__startswith='imported')
+        # One imported user already has a wallet
+        Wallet.objects.create(user=self.imported.first())
+
+    def test_dry_run_only_counts(self):
+        self.assertEqual(backfill_users(batch_size=3, dry_run=True), {'profiles': 7, 'wallets': 6, 'settings': 7})
+        self.assertFalse(Profile.objects.filter(user__in=self.imported).exists())
+
+    def test_backfill(self):
+        progress = mock.Mock()
+        self.assertEqual(backfill_users(batch_size=3, progress=progress), {'profiles': 7, 'wallets': 6, 'settings': 7})
+        self.assertEqual(progress.call_args[0][0], progress.call_args[0][1])
+
+        for user in self.imported:
+            profile = Profile.objects.get(user=user)
+            self.assertEqual(profile.phone_number, PHONE_PLACEHOLDER.format(user.id))
+            self.assertEqual(profile.get_services_list(), ['Dinner Date'])
+            self.assertIsNotNone(profile.latitude)
+            self.assertEqual(Wallet.objects.filter(user=user).count(), 1)
+            self.assertEqual(UserSetting.objects.filter(user=user).count(), 1)
+        self.assertEqual(
+            match_profiles(Profile.objects.filter(user__in=self.imported), 'dinner').count(), 7
+        )
+
+        self.assertEqual(backfill_users(batch_size=3), {'profiles': 0, 'wallets': 0, 'settings': 0})
+
+    def test_command(self):
+        out = StringIO()
+        call_command('create_user_profiles', batch_size=4, stdout=out)
+        self.assertIn('Created 7 profiles, 6 wallets and 7 settings', out.getvalue())
+
+
+@limit_uploads(photo='photo')
+def _upload_probe(request):
+    """What a view behind ``limit_uploads`` gets to see"""
+    photo = request.FILES.get('photo')
+    return JsonResponse({
+        'photo': photo and {'content_type': photo.content_type, 'sha256': photo.sha256, 'size': photo.size},
+        'errors': upload_errors(request),
+    })
+
+
+class UploadLimitTests(TestCase):
+    """Uploads are checked while they stream in, and resumable uploads append chunks in order"""
+
+    def setUp(self):
+        staging = tempfile.TemporaryDirectory()
+        self.addCleanup(staging.cleanup)
+        patcher = mock.patch('main.uploads.UPLOAD_STAGING_DIR', staging.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('uploader')
+        self.jpeg = BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(self.jpeg, 'JPEG')
+        self.jpeg = self.jpeg.getvalue()
+
+    def post(self, data, name='photo.jpg', content_type='image/jpeg'):
+        request = RequestFactory().post('/', {'photo': SimpleUploadedFile(name, data, content_type)})
+        request._dont_enforce_csrf_checks = True
+        return json.loads(_upload_probe(request).content)
+
+    def test_sniffed_type_and_hash(self):
+        result = self.post(self.jpeg, content_type='application/octet-stream')
+        self.assertEqual(result['photo'], {
+            'content_type': 'image/jpeg', 'sha256': hashlib.sha256(self.jpeg).hexdigest(), 'size': len(self.jpeg),
+        })
+        self.assertEqual(result['errors'], [])
+
+    def test_rejections(self):
+        for data, content_type in (
+            (b'<html>' + b' ' * 100, 'image/jpeg'),      # not what it claims to be
+            (self.jpeg, 'video/mp4'),                    # declared type not allowed
+            (self.jpeg + b'\0' * (5 * MB), 'image/jpeg'),  # over the photo limit
+        ):
+            result = self.post(data, content_type=content_type)
+            self.assertIsNone(result['photo'])
+            self.assertEqual(len(result['errors']), 1)
+
+    def test_resumable_upload(self):
+        upload = start_upload(self.user, 'photo', 'photo.jpg', len(self.jpeg), 'image/jpeg')
+        half = len(self.jpeg) // 2
+        self.assertEqual(append_chunk(upload, 0, BytesIO(self.jpeg[:half]), half), half)
+
+        with self.assertRaises(UploadRejected) as rejected:
+            append_chunk(upload, 0, BytesIO(self.jpeg[:half]), half)
+        self.assertEqual(rejected.exception.status, 409)
+        with self.assertRaises(UploadRejected):
+            claim_upload(self.user, upload.id, 'photo')
+
+        rest = len(self.jpeg) - half
+        self.assertEqual(append_chunk(upload, half, BytesIO(self.jpeg[half:]), rest), len(self.jpeg))
+        claimed = claim_upload(self.user, upload.id, 'photo')
+        self.addCleanup(claimed.close)
+        self.assertEqual(claimed.read(), self.jpeg)
+        self.assertEqual(claimed.sha256, hashlib.sha256(self.jpeg).hexdigest())
+
+    def test_resumable_upload_checks_content(self):
+        upload = start_upload(self.user, 'photo', 'notes.txt', 200, '')
+        with self.assertRaises(UploadRejected):
+            append_chunk(upload, 0, BytesIO(b'just text ' * 20), 200)
+        with self.assertRaises(UploadRejected):
+            start_upload(self.user, 'photo', 'huge.jpg', 6 * MB, 'image/jpeg')
+
+
+class BlobReferenceTests(TestCase):
+    """Blobs count the rows pointing at them and are deleted once none do, after a grace period"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user('sharer')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.later = timezone.now() + BLOB_GRACE + timedelta(minutes=1)
+
+    def attach(self, data=b'same bytes'):
+        message = Message.objects.create(
+            conversation=self.conversation, sender=self.user, content='', message_type='file',
+            media_file=ContentFile(data, name='note.bin'),
+        )
+        return message, message.media_file.name
+
+    def ref_count(self, name):
+        return Blob.objects.get(name=name).ref_count
+
+    def test_identical_uploads_share_a_counted_blob(self):
+        first, name = self.attach()
+        second, same = self.attach()
+        self.assertEqual(same, name)
+        self.assertEqual(self.ref_count(name), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.ref_count(name), 1)
+        self.assertTrue(blob_storage.exists(name))
+
+    def test_unreferenced_blobs_go_after_the_grace_period(self):
+        message, name = self.attach()
+        with self.captureOnCommitCallbacks(execute=True):
+            message.delete()
+        # Still within the grace period
+        self.assertTrue(blob_storage.exists(name))
+        self.assertEqual(self.ref_count(name), 0)
+
+        self.assertTrue(collect(name, now=self.later))
+        self.assertFalse(blob_storage.exists(name))
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+
+    def test_replacing_a_file_releases_the_old_one(self):
+        message, old = self.attach()
+        message.media_file = ContentFile(b'other bytes', name='note.bin')
+        with self.captureOnCommitCallbacks(execute=True):
+            message.save()
+        self.assertEqual(self.ref_count(old), 0)
+        self.assertEqual(self.ref_count(message.media_file.name), 1)
+
+    def test_drifted_counts_never_delete_referenced_files(self):
+        _, name = self.attach()
+        Blob.objects.filter(name=name).update(ref_count=0, last_used_at=self.later - BLOB_GRACE * 2)
+        with self.assertLogs('main.blobs', 'WARNING'):
+            self.assertFalse(collect(name, now=self.later))
+        self.assertEqual(self.ref_count(name), 1)
+        self.assertTrue(blob_storage.exists(name))
+
+    def test_collect_garbage(self):
+        _, kept = self.attach()
+        Blob.objects.filter(name=kept).update(ref_count=5)
+        stray = blob_storage.save('stray.bin', ContentFile(b'no row'))
+        Blob.objects.filter(name=stray).delete()
+
+        with mock.patch('django.utils.timezone.now', return_value=self.later):
+            stats = collect_garbage()
+        self.assertEqual(stats, {'recounted': 1, 'collected': 0, 'strays': 1})
+        self.assertEqual(self.ref_count(kept), 1)
+        self.assertFalse(blob_storage.exists(stray))
+
+
+class MediaServingTests(TestCase):
+    """``serve`` answers ranges, conditional requests and validators for stored files"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.storage = FileSystemStorage(location=media.name)
+        self.data = bytes(range(256)) * 4
+        self.name = self.storage.save('clips/a.mp4', ContentFile(self.data))
+
+    def get(self, name=None, **headers):
+        request = RequestFactory().get('/', **headers)
+        response = serve(request, name or self.name, storage=self.storage)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+
+    def test_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), self.data[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+
+        response = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual((response.status_code, self.body(response)), (206, self.data[-5:]))
+        response = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(self.body(response), self.data[1000:])
+
+        # Several ranges, or one that is malformed, get the whole file
+        for header in ('bytes=0-1,5-6', 'bytes=9-3', 'pages=1'):
+            self.assertEqual(self.get(HTTP_RANGE=header).status_code, 200)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_conditional_requests(self):
+        etag = self.get()['ETag']
+        last_modified = self.get()['Last-Modified']
+
+        not_modified = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.assertEqual(self.get(HTTP_IF_MATCH='"something-else"').status_code, 412)
+        self.assertEqual(self.get(HTTP_IF_MATCH=etag).status_code, 200)
+
+    def test_if_range(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        # The client's copy is stale: send it all
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"').status_code, 200)
+
+    def test_blob_etag_is_its_hash(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            name = blob_storage.save('a.mp4', ContentFile(self.data))
+            response = serve(RequestFactory().get('/'), name, storage=blob_storage)
+            response.close()
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(self.data).hexdigest()}"')
+
+    def test_missing_file(self):
+        with self.assertRaises(Http404):
+            self.get('clips/missing.mp4')
@@ -0,0 +1,293 @@
+# main/transcoding.py
+"""
+Video transcoding and poster extraction.
+
+``profile_upload_video`` used to store the upload and nothing else:
+``duration`` stayed 0, there was no poster unless the uploader picked one,
+and every viewer downloaded the original file in whatever codec, bitrate
+and container it came in (a phone's 50 Mbit/s HEVC .mov plays badly or not
+at all in most browsers). A background task queued when a Video is created
+now runs a local ffmpeg and stores, in a ``derived/<filename>/`` directory
+next to the original:
+
+* ``web.mp4``: H.264/AAC, at most ``WEB_HEIGHT`` lines, with the moov atom
+  at the front (``+faststart``) so playback starts before the download ends;
+* an HLS ladder (``hls/master.m3u8``) of the ``HLS_LADDER`` renditions no
+  larger than the source, 4-second segments with aligned keyframes so
+  players can switch between them;
+* ``poster.jpg``, used as ``thumbnail`` when the uploader didn't give one;
+
+and records the probed duration. Everything comes out of one ffmpeg run
+that decodes the source once.
+
+Heights here are the short edge, so a portrait phone video gets the same
+ladder as a landscape one.
+
+Without ffmpeg (``FFMPEG_BINARY``/``FFPROBE_BINARY`` or on ``PATH``) videos
+are marked ``skipped`` and served as uploaded; ``manage.py transcode_videos``
+queues them again once it is installed.
+"""
+import json
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import tempfile
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Video
+from .tasks import enqueue, task
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = getattr(settings, 'FFMPEG_BINARY', None) or shutil.which('ffmpeg')
+FFPROBE = getattr(settings, 'FFPROBE_BINARY', None) or shutil.which('ffprobe')
+TIMEOUT = getattr(settings, 'VIDEO_TRANSCODE_TIMEOUT', 60 * 60)  # seconds per ffmpeg run
+
+DERIVED_DIR = 'derived'
+WEB_HEIGHT = 720
+WEB_CRF = 23
+AUDIO_KBPS = 128
+
+Rendition = namedtuple('Rendition', 'name height video_kbps audio_kbps')
+HLS_LADDER = [
+    Rendition('360p', 360, 800, 96),
+    Rendition('720p', 720, 2800, 128),
+    Rendition('1080p', 1080, 5000, 160),
+]
+SEGMENT_SECONDS = 4
+# Poster frame: this far in, or 10% of a shorter video (skips fade-ins)
+POSTER_SECONDS = 1.0
+
+Probe = namedtuple('Probe', 'width height duration has_audio')
+
+
+class TranscodingError(Exception):
+    """ffmpeg is missing, the file is not a video, or encoding failed"""
+
+
+def available():
+    return bool(FFMPEG and FFPROBE)
+
+
+def derived_dir(name):
+    """``videos/2024/01/02/a.mov`` -> ``videos/2024/01/02/derived/a.mov``"""
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, DERIVED_DIR, filename)
+
+
+def _run(args):
+    try:
+        return subprocess.run(args, capture_output=True, check=True, timeout=TIMEOUT)
+    except subprocess.CalledProcessError as error:
+        stderr = error.stderr.decode(errors='replace').strip().splitlines()
+        raise TranscodingError(f"{os.path.basename(args[0])} exited with {error.returncode}: "
+                               f"{stderr[-1] if stderr else ''}") from error
+    except subprocess.TimeoutExpired as error:
+        raise TranscodingError(f'{os.path.basename(args[0])} timed out after {TIMEOUT}s') from error
+
+
+def probe(path):
+    """Display size (after rotation), duration and whether there is audio"""
+    output = _run([
+        FFPROBE, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path,
+    ]).stdout
+    try:
+        info = json.loads(output)
+        streams = info.get('streams', [])
+        video = next(stream for stream in streams if stream.get('codec_type') == 'video')
+        width, height = int(video['width']), int(video['height'])
+    except (ValueError, KeyError, StopIteration) as error:
+        raise TranscodingError(f'{path} has no readable video stream') from error
+
+    # Phones record landscape and tag the rotation; ffmpeg applies it
+    rotation = video.get('tags', {}).get('rotate') or next(
+        (data['rotation'] for data in video.get('side_data_list', []) if 'rotation' in data), 0
+    )
+    if abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+    duration = float(info.get('format', {}).get('duration') or video.get('duration') or 0)
+    has_audio = any(stream.get('codec_type') == 'audio' for stream in streams)
+    return Probe(width, height, duration, has_audio)
+
+
+def _short_edge(source):
+    edge = min(source.width, source.height)
+    return edge - edge % 2
+
+
+def ladder(source):
+    """The renditions no larger than ``source``; just its own size if it is smaller than all of them"""
+    rungs = [rung for rung in HLS_LADDER if rung.height <= _short_edge(source)]
+    return rungs or [HLS_LADDER[0]._replace(height=_short_edge(source))]
+
+
+def _size(source, short):
+    """Even ``(width, height)`` of ``source`` scaled to a short edge of ``short``"""
+    long_edge = max(2, round(max(source.width, source.height) * short / min(source.width, source.height) / 2) * 2)
+    return (long_edge, short) if source.width >= source.height else (short, long_edge)
+
+
+def _scale(source, short):
+    return 'scale=%d:%d' % _size(source, short)
+
+
+def _h264(bitrate=None):
+    args = ['-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main', '-pix_fmt', 'yuv420p']
+    if bitrate:
+        # Capped so the BANDWIDTH advertised in the master playlist holds
+        args += ['-b:v', f'{bitrate}k', '-maxrate', f'{bitrate * 107 // 100}k', '-bufsize', f'{bitrate * 3 // 2}k']
+    else:
+        args += ['-crf', str(WEB_CRF)]
+    # Keyframes on segment boundaries in every rendition, whatever the frame rate
+    return args + ['-force_key_frames', f'expr:gte(t,n_forced*{SEGMENT_SECONDS})', '-sc_threshold', '0']
+
+
+def ffmpeg_command(source_path, source, output_dir):
+    """One ffmpeg invocation writing web.mp4, the HLS renditions and poster.jpg under ``output_dir``"""
+    web_height = min(WEB_HEIGHT, _short_edge(source))
+    rungs = ladder(source)
+    heights = [web_height, *(rung.height for rung in rungs)]
+    # Decode once, scale once per output
+    graph = [f"[0:v]split={len(heights) + 1}{''.join(f'[s{index}]' for index in range(len(heights) + 1))}"]
+    graph += [f'[s{index}]{_scale(source, height)}[v{index}]' for index, height in enumerate(heights)]
+    poster_at = min(POSTER_SECONDS, source.duration / 10)
+    graph.append(f'[s{len(heights)}]trim=start={poster_at:.3f},{_scale(source, web_height)}[poster]')
+
+    audio = ['-map', '0:a:0'] if source.has_audio else []
+    args = [FFMPEG, '-hide_banner', '-nostdin', '-y', '-loglevel', 'error', '-i', source_path,
+            '-filter_complex', ';'.join(graph)]
+
+    args += ['-map', '[v0]', *audio, *_h264()]
+    if source.has_audio:
+        args += ['-c:a', 'aac', '-b:a', f'{AUDIO_KBPS}k']
+    args += ['-movflags', '+faststart', os.path.join(output_dir, 'web.mp4')]
+
+    hls_dir = os.path.join(output_dir, 'hls')
+    for index, rung in enumerate(rungs, start=1):
+        args += ['-map', f'[v{index}]', *audio, *_h264(rung.video_kbps)]
+        if source.has_audio:
+            args += ['-c:a', 'aac', '-b:a', f'{rung.audio_kbps}k']
+        args += [
+            '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(hls_dir, f'{rung.name}_%04d.ts'),
+            os.path.join(hls_dir, f'{rung.name}.m3u8'),
+        ]
+
+    args += ['-map', '[poster]', '-frames:v', '1', '-q:v', '3', os.path.join(output_dir, 'poster.jpg')]
+    return args
+
+
+def master_playlist(source, rungs):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rung in rungs:
+        bandwidth = (rung.video_kbps * 107 // 100 + (rung.audio_kbps if source.has_audio else 0)) * 1000
+        lines.append('#EXT-X-STREAM-INF:BANDWIDTH=%d,RESOLUTION=%dx%d' % (bandwidth, *_size(source, rung.height)))
+        lines.append(f'{rung.name}.m3u8')
+    return '\n'.join(lines) + '\n'
+
+
+def delete_transcodes(name, storage=None):
+    """Delete everything transcoded from ``name``"""
+    storage = storage or default_storage
+
+    def delete_tree(directory):
+        try:
+            directories, files = storage.listdir(directory)
+        except FileNotFoundError:
+            return
+        for filename in files:
+            storage.delete(posixpath.join(directory, filename))
+        for subdirectory in directories:
+            delete_tree(posixpath.join(directory, subdirectory))
+
+    delete_tree(derived_dir(name))
+
+
+def _store(storage, local_dir, prefix):
+    """Copy every file under ``local_dir`` to ``prefix`` in storage, keeping the names playlists refer to"""
+    for directory, _, filenames in os.walk(local_dir):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = posixpath.join(prefix, *os.path.relpath(path, local_dir).split(os.sep))
+            if storage.exists(name):
+                storage.delete(name)
+            with open(path, 'rb') as handle:
+                storage.save(name, File(handle))
+
+
+def transcode(video):
+    """Transcode ``video`` and return the fields to update"""
+    if not available():
+        raise TranscodingError('ffmpeg/ffprobe not found')
+    storage = video.video_file.storage
+    # Outputs keep their names (playlists refer to them), so not the content-addressed storage
+    outputs = default_storage
+    with tempfile.TemporaryDirectory(prefix='transcode-') as workdir:
+        try:
+            source_path = storage.path(video.video_file.name)
+        except NotImplementedError:
+            # Remote storage: ffmpeg needs a local copy
+            source_path = os.path.join(workdir, 'source')
+            with storage.open(video.video_file.name) as remote, open(source_path, 'wb') as local:
+                shutil.copyfileobj(remote, local)
+
+        source = probe(source_path)
+        output_dir = os.path.join(workdir, 'out')
+        os.makedirs(os.path.join(output_dir, 'hls'))
+        _run(ffmpeg_command(source_path, source, output_dir))
+        with open(os.path.join(output_dir, 'hls', 'master.m3u8'), 'w') as playlist:
+            playlist.write(master_playlist(source, ladder(source)))
+
+        prefix = derived_dir(video.video_file.name)
+        _store(outputs, output_dir, prefix)
+
+    fields = {
+        'duration': round(source.duration),
+        'web_file': posixpath.join(prefix, 'web.mp4'),
+        'hls_playlist': posixpath.join(prefix, 'hls', 'master.m3u8'),
+        'processing_status': Video.READY,
+    }
+    if not video.thumbnail:
+        fields['thumbnail'] = posixpath.join(prefix, 'poster.jpg')
+    return fields
+
+
+@task(max_attempts=3)
+def transcode_video(video_id):
+    video = Video.objects.filter(id=video_id).first()
+    if video is None or not video.video_file:
+        return
+    # .update(), not .save(): views and likes are written concurrently
+    videos = Video.objects.filter(id=video_id)
+    if not available():
+        logger.info('ffmpeg not found; serving video %s as uploaded', video_id)
+        videos.update(processing_status=Video.SKIPPED)
+        return
+    videos.update(processing_status=Video.PROCESSING)
+    try:
+        fields = transcode(video)
+    except TranscodingError:
+        # Marked failed now; the queue retries a couple of times
+        videos.update(processing_status=Video.FAILED)
+        raise
+    videos.update(**fields)
+
+
+def queue_transcode(video, force=False):
+    """Queue ``video`` for transcoding, once per uploaded file unless ``force``"""
+    key = None if force else f'video-transcode:{video.id}:{video.video_file.name}'
+    return enqueue(transcode_video, {'video_id': video.id}, idempotency_key=key)
+
+
+@receiver(post_save, sender=Video)
+def video_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.video_file:
+        queue_transcode(instance)
@@ -0,0 +1,428 @@
+# main/uploads.py
+"""
+Streaming upload limits and resumable (chunked) uploads.
+
+Photos, videos, post media and message attachments used to arrive through
+Django's default upload handlers: the whole file was read (into memory, or a
+temp file in /tmp) before the view looked at it, the 5 MB photo limit was
+checked afterwards, videos had no limit at all, and saving copied the temp
+file into MEDIA_ROOT.
+
+Views that accept files are now wrapped in ``@limit_uploads(field=kind)``:
+
+* ``StreamingUploadHandler`` checks each file against ``UPLOAD_LIMITS[kind]``
+  as it arrives: the declared size and MIME type before the first byte, the
+  real type (sniffed from the first bytes) on the first chunk, and the size
+  on every chunk. A file that fails is dropped on the spot, the rest of it
+  is discarded unread into nowhere, and the reason is left in
+  ``request.upload_errors`` for the view to report.
+* The SHA-256 of the content is computed in the same pass and attached to
+  the file as ``sha256``.
+* Small files stay in memory; larger ones are spooled to
+  ``UPLOAD_STAGING_DIR``, which lives inside MEDIA_ROOT so that saving is a
+  rename into the final path rather than a copy.
+
+Large videos on flaky connections can instead be sent in pieces: create an
+upload (``POST /api/uploads/``), ``PATCH`` each chunk with its
+``Upload-Offset``, ask for the offset to resume after a dropped connection,
+and submit the form with ``upload_id`` in place of the file. Chunks are
+appended straight to the staging file, which is renamed into place once the
+form is saved. Abandoned uploads are removed by ``expire_uploads``.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from datetime import timedelta
+from functools import wraps
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .models import ChunkedUpload
+
+MB = 1024 * 1024
+# kind -> (max bytes, allowed MIME type prefixes)
+UPLOAD_LIMITS = {
+    'photo': (5 * MB, ('image/',)),
+    'post_image': (10 * MB, ('image/',)),
+    'post_video': (100 * MB, ('video/',)),
+    'video': (100 * MB, ('video/',)),
+    'video_thumbnail': (10 * MB, ('image/',)),
+    'message_media': (25 * MB, ('image/', 'video/', 'audio/')),
+    **getattr(settings, 'UPLOAD_LIMITS', {}),
+}
+UPLOAD_STAGING_DIR = str(getattr(settings, 'UPLOAD_STAGING_DIR', os.path.join(settings.MEDIA_ROOT, '.uploads')))
+UPLOAD_CHUNK_SIZE = getattr(settings, 'UPLOAD_CHUNK_SIZE', 4 * MB)  # suggested to clients
+UPLOAD_MAX_CHUNK_SIZE = getattr(settings, 'UPLOAD_MAX_CHUNK_SIZE', 16 * MB)
+UPLOAD_EXPIRY = timedelta(hours=getattr(settings, 'UPLOAD_EXPIRY_HOURS', 24))
+
+SNIFF_BYTES = 64
+# What browsers send when they don't know; the sniffed type decides
+GENERIC_TYPES = ('', 'application/octet-stream')
+READ_SIZE = 64 * 1024
+LOCK_TIMEOUT = 60
+
+
+class UploadRejected(Exception):
+    """A file is too large, of a type the field does not accept, or not what it claims to be"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff(head):
+    """MIME type from a file's first bytes, or None if unrecognised"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head.startswith(b'BM'):
+        return 'image/bmp'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'image/tiff'
+    if head.startswith(b'RIFF'):
+        return {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}.get(head[8:12])
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'avif', b'avis'):
+            return 'image/avif'
+        if brand in (b'heic', b'heix', b'heim', b'heis', b'mif1', b'msf1'):
+            return 'image/heic'
+        if brand in (b'M4A ', b'M4B '):
+            return 'audio/mp4'
+        return 'video/quicktime' if brand == b'qt  ' else 'video/mp4'
+    if head[4:8] in (b'moov', b'mdat', b'wide', b'free', b'skip'):
+        return 'video/quicktime'
+    if head.startswith(b'\x1aE\xdf\xa3'):
+        return 'video/webm'
+    if head.startswith(b'0&\xb2u\x8ef\xcf\x11'):
+        return 'video/x-ms-wmv'
+    if head.startswith(b'FLV'):
+        return 'video/x-flv'
+    if head.startswith(b'\x00\x00\x01\xba') or head.startswith(b'\x00\x00\x01\xb3'):
+        return 'video/mpeg'
+    if head.startswith(b'OggS'):
+        return 'audio/ogg'
+    if head.startswith(b'fLaC'):
+        return 'audio/flac'
+    if head.startswith(b'#!AMR'):
+        return 'audio/amr'
+    if head.startswith(b'ID3') or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'audio/mpeg'  # MP3 or ADTS AAC frame sync
+    return None
+
+
+def check_type(kind, content_type):
+    if not content_type.startswith(UPLOAD_LIMITS[kind][1]):
+        raise UploadRejected(f'{content_type or "This type of file"} is not allowed here', status=415)
+
+
+def check_size(kind, size):
+    max_size = UPLOAD_LIMITS[kind][0]
+    if size > max_size:
+        raise UploadRejected(f'File is larger than {max_size // MB} MB', status=413)
+
+
+def check_content(kind, head):
+    """The sniffed type of ``head``, if ``kind`` accepts it"""
+    content_type = sniff(head)
+    if content_type is None:
+        raise UploadRejected('Unrecognised file format', status=415)
+    check_type(kind, content_type)
+    return content_type
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    Enforce ``UPLOAD_LIMITS`` while a multipart body streams in, hashing each
+    file as it goes. ``fields`` maps file field names to limit kinds; files
+    in other fields are dropped.
+    """
+
+    def __init__(self, request, fields):
+        super().__init__(request)
+        self.fields = fields
+        request.upload_errors = {}
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.kind = self.fields.get(field_name)
+        # Set before anything can raise: on SkipFile the parser closes whatever ``file`` is
+        self.file = BytesIO()
+        self.size = 0
+        self.head = b''
+        self.sniffed = None
+        self.sha256 = hashlib.sha256()
+        if self.kind is None:
+            # Not a field the view reads (the photo form posts its files twice); drop it unread
+            self.discard()
+            raise SkipFile()
+        try:
+            if content_type not in GENERIC_TYPES:
+                check_type(self.kind, content_type)
+            if content_length:
+                check_size(self.kind, content_length)
+        except UploadRejected as error:
+            self.reject(error)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        try:
+            check_size(self.kind, self.size)
+            if self.sniffed is None:
+                self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+                if len(self.head) >= SNIFF_BYTES:
+                    self.sniffed = check_content(self.kind, self.head)
+        except UploadRejected as error:
+            self.reject(error)
+
+        self.sha256.update(raw_data)
+        if isinstance(self.file, BytesIO) and self.size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            self.spill()
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.sniffed is None:
+            # Shorter than SNIFF_BYTES. SkipFile isn't caught here, so drop it by returning nothing
+            try:
+                self.sniffed = check_content(self.kind, self.head)
+            except UploadRejected as error:
+                self.record(error)
+                self.discard()
+                return None
+        # Trust the bytes, not the browser
+        self.content_type = self.sniffed
+        self.file.seek(0)
+        if isinstance(self.file, BytesIO):
+            uploaded = InMemoryUploadedFile(
+                self.file, self.field_name, self.file_name, self.content_type, file_size, self.charset, {},
+            )
+        else:
+            uploaded = self.file
+            uploaded.size = file_size
+        uploaded.sha256 = self.sha256.hexdigest()
+        return uploaded
+
+    def spill(self):
+        """Move a file that outgrew memory to the staging directory, next to its final home"""
+        os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+        staged = _StagedUploadedFile(self.file_name, self.content_type, 0, self.charset, {})
+        staged.write(self.file.getvalue())
+        self.file = staged
+
+    def record(self, error):
+        self.request.upload_errors.setdefault(self.field_name, []).append(f'{self.file_name}: {error}')
+
+    def reject(self, error):
+        self.record(error)
+        self.discard()
+        raise SkipFile()
+
+    def discard(self):
+        self.file.close()
+
+    def upload_interrupted(self):
+        self.discard()
+
+
+class _StagedUploadedFile(TemporaryUploadedFile):
+    """A ``TemporaryUploadedFile`` in ``UPLOAD_STAGING_DIR``, so storage moves it with a rename"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + os.path.splitext(name)[1], dir=UPLOAD_STAGING_DIR)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+
+def limit_uploads(**fields):
+    """
+    Decorate a view accepting the file ``fields`` (``name=kind``) so they
+    stream through ``StreamingUploadHandler``. CSRF is checked after the
+    handlers are swapped in, as the middleware would otherwise read the
+    body first.
+    """
+    def decorator(view_func):
+        protected = view_func if getattr(view_func, 'csrf_exempt', False) else csrf_protect(view_func)
+
+        @csrf_exempt
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            request.upload_handlers = [StreamingUploadHandler(request, fields)]
+            return protected(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def upload_errors(request, form=None):
+    """
+    Messages for files ``limit_uploads`` dropped from ``request``. With a
+    ``form``, they also replace that field's errors (usually "required").
+    """
+    errors = getattr(request, 'upload_errors', {})
+    if form is not None:
+        for field, messages in errors.items():
+            if field in form.fields:
+                form.errors[field] = form.error_class(messages)
+            else:
+                form.add_error(None, messages)
+    return [message for messages in errors.values() for message in messages]
+
+
+# Resumable uploads
+
+def staging_path(upload):
+    return os.path.join(UPLOAD_STAGING_DIR, f'{upload.id}.part')
+
+
+def start_upload(user, kind, filename, size, content_type):
+    """Validate the declared file and create an empty ChunkedUpload for it"""
+    if kind not in UPLOAD_LIMITS:
+        raise UploadRejected(f'Unknown upload kind {kind!r}')
+    if size <= 0:
+        raise UploadRejected('Empty file')
+    if content_type not in GENERIC_TYPES:
+        check_type(kind, content_type)
+    check_size(kind, size)
+    upload = ChunkedUpload.objects.create(
+        user=user, kind=kind, filename=os.path.basename(filename)[:255] or 'upload',
+        content_type=content_type, size=size,
+    )
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    open(staging_path(upload), 'wb').close()
+    return upload
+
+
+def append_chunk(upload, offset, stream, length):
+    """
+    Append ``length`` bytes from ``stream`` at ``offset``, which must be the
+    upload's current offset. Returns the new offset; raises UploadRejected.
+    """
+    if upload.completed:
+        raise UploadRejected('Upload is already complete', status=409)
+    if offset != upload.offset:
+        raise UploadRejected(f'Expected offset {upload.offset}', status=409)
+    if length > UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadRejected(f'Chunks are limited to {UPLOAD_MAX_CHUNK_SIZE // MB} MB', status=413)
+    if offset + length > upload.size:
+        raise UploadRejected('Chunk runs past the declared size', status=413)
+
+    lock = f'chunked-upload:{upload.id}:lock'
+    if not cache.add(lock, True, LOCK_TIMEOUT):
+        raise UploadRejected('Another chunk is being written', status=409)
+    try:
+        with open(staging_path(upload), 'r+b') as part:
+            # Drop whatever a previous, interrupted write left past the offset
+            part.truncate(offset)
+            part.seek(offset)
+            head = b''
+            remaining = length
+            while remaining:
+                data = stream.read(min(READ_SIZE, remaining))
+                if not data:
+                    break
+                if offset == 0 and len(head) < SNIFF_BYTES:
+                    head += data[:SNIFF_BYTES - len(head)]
+                part.write(data)
+                remaining -= len(data)
+        if remaining:
+            # Connection dropped mid-chunk: keep nothing past the offset
+            raise UploadRejected('Chunk ended early')
+        if offset == 0:
+            upload.content_type = check_content(upload.kind, head)
+
+        upload.offset = offset + length
+        if upload.completed:
+            upload.sha256 = _hash_file(staging_path(upload))
+        ChunkedUpload.objects.filter(id=upload.id).update(
+            offset=upload.offset, content_type=upload.content_type, sha256=upload.sha256, updated_at=timezone.now(),
+        )
+        return upload.offset
+    finally:
+        cache.delete(lock)
+
+
+def _hash_file(path):
+    # Chunks can arrive in different processes, so the hash is taken once at the end
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for data in iter(lambda: part.read(READ_SIZE), b''):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+class CompletedUpload(UploadedFile):
+    """A finished ChunkedUpload, handed to a form like any uploaded file"""
+
+    def __init__(self, upload):
+        super().__init__(open(staging_path(upload), 'rb'), upload.filename, upload.content_type, upload.size)
+        self.upload = upload
+        self.sha256 = upload.sha256
+
+    def temporary_file_path(self):
+        return staging_path(self.upload)
+
+
+def claim_upload(user, upload_id, kind):
+    """The ``user``'s finished upload ``upload_id`` of ``kind``, as a file for ``request.FILES``"""
+    upload = ChunkedUpload.objects.filter(id=upload_id, user=user, kind=kind).first()
+    if upload is None or not upload.completed:
+        raise UploadRejected('Upload not found or not finished')
+    return CompletedUpload(upload)
+
+
+def files_with_uploads(request, **fields):
+    """
+    ``request.FILES`` plus the finished uploads named by ``<field>_upload_id``
+    POST values, for ``fields`` (``name=kind``). Rejections go to
+    ``request.upload_errors``.
+    """
+    files = request.FILES.copy()
+    for field, kind in fields.items():
+        upload_id = request.POST.get(f'{field}_upload_id')
+        if upload_id and field not in files:
+            try:
+                files[field] = claim_upload(request.user, upload_id, kind)
+            except (UploadRejected, ValueError) as error:
+                request.upload_errors = getattr(request, 'upload_errors', {})
+                request.upload_errors.setdefault(field, []).append(str(error))
+    return files
+
+
+def release_uploads(files):
+    """Forget the ChunkedUploads in ``files`` once their model is saved (storage has moved the files)"""
+    for uploaded in files.values():
+        if isinstance(uploaded, CompletedUpload):
+            uploaded.close()
+            if os.path.exists(uploaded.temporary_file_path()):
+                os.remove(uploaded.temporary_file_path())
+            uploaded.upload.delete()
+
+
+def expire_uploads():
+    """Delete unfinished or unclaimed uploads, and stray staged files, older than ``UPLOAD_EXPIRY``"""
+    cutoff = timezone.now() - UPLOAD_EXPIRY
+    expired = ChunkedUpload.objects.filter(updated_at__lt=cutoff)
+    for upload in expired.only('id'):
+        if os.path.exists(staging_path(upload)):
+            os.remove(staging_path(upload))
+    deleted = expired.delete()[0]
+
+    # Spooled request files normally go when the request ends; not if the process died
+    try:
+        names = os.listdir(UPLOAD_STAGING_DIR)
+    except FileNotFoundError:
+        return deleted
+    oldest = time.time() - UPLOAD_EXPIRY.total_seconds()
+    for name in names:
+        path = os.path.join(UPLOAD_STAGING_DIR, name)
+        if not name.endswith('.part') and os.path.getmtime(path) < oldest:
+            os.remove(path)
+    return deleted
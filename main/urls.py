@@ -5,6 +5,7 @@ from . import views
 
 urlpatterns = [
     path('', views.landing_view, name='landing'),
+    path('sw.js', views.service_worker, name='service_worker'),
     # ==================== ALLAUTH URLs ===================
     
     # ==================== DASHBOARD URLs ====================
@@ -20,6 +21,7 @@ urlpatterns = [
     # ==================== POST URLs ====================
     path('post/create/', views.post_create_view, name='post_create'),
     path('post/<int:post_id>/', views.post_detail_view, name='post_detail'),
+    path('post/<int:post_id>/video/', views.post_video_media, name='post_video_media'),
     path('post/<int:post_id>/edit/', views.post_edit_view, name='post_edit'), 
     path('post/<int:post_id>/interact/<str:interaction_type>/', 
          views.post_interact_view, name='post_interact'),
@@ -29,12 +31,18 @@ urlpatterns = [
     # main/urls.py - Add these to urlpatterns
           path('photos/upload/', views.photo_upload_view, name='upload_photo'),
      path('api/photos/upload/', views.api_photo_upload, name='api_photo_upload'),
+    path('api/uploads/', views.api_upload_start, name='api_upload_start'),
+    path('api/uploads/<uuid:upload_id>/', views.api_upload_chunk, name='api_upload_chunk'),
      path('api/photos/edit/', views.api_photo_edit, name='api_photo_edit'),
      path('api/photos/delete/', views.api_photo_delete, name='api_photo_delete'),
      path('api/photos/set-primary/', views.api_photo_set_primary, name='api_photo_set_primary'),
+     path('images/<path:path>', views.image_derivative, name='image_derivative'),
     
     # ==================== VIDEO URLs ====================
     path('video/<int:video_id>/', views.video_detail_view, name='video_detail'),
+    path('video/<int:video_id>/media/', views.video_media, name='video_media'),
+    path('video/<int:video_id>/poster/', views.video_poster, name='video_poster'),
+    path('video/<int:video_id>/hls/<str:filename>', views.video_hls, name='video_hls'),
     path('video/<int:video_id>/like/', views.video_like_view, name='video_like'),
     path('api/video/<int:video_id>/edit/', views.api_video_edit, name='api_video_edit'),
     path('api/video/<int:video_id>/delete/', views.api_video_delete, name='api_video_delete'),
@@ -49,6 +57,7 @@ urlpatterns = [
      path('conversation/clear/<int:conversation_id>/', 
          views.clear_conversation, 
          name='conversation_clear'),
+    path('message/<int:message_id>/media/', views.message_media, name='message_media'),
     path('conversation/<int:conversation_id>/delete/', 
          views.conversation_delete_view, name='conversation_delete'),
     path('contacts/', views.contacts_view, name='contacts'),
@@ -91,6 +100,10 @@ urlpatterns = [
     # ==================== API URLs ====================
     path('api/conversation/<int:conversation_id>/messages/', 
          views.api_get_conversation_messages, name='api_conversation_messages'),
+    path('api/conversation/<int:conversation_id>/history/', 
+         views.api_conversation_history, name='api_conversation_history'),
+    path('api/conversation/<int:conversation_id>/stream/', 
+         views.api_conversation_stream, name='api_conversation_stream'),
     path('api/notifications/', views.api_get_notifications, name='api_get_notifications'),
     path('api/update-online-status/', 
          views.api_update_online_status, name='api_update_online_status'),
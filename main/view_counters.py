@@ -0,0 +1,129 @@
+# main/view_counters.py
+"""
+Write-behind view counters for profiles, posts and videos.
+
+Detail views used to bump ``total_views``/``views`` with a read-modify-write
+``save()`` of the whole row, which rewrote every column and lost increments
+when two requests raced. ``record_view`` instead adds the increment to an
+in-process buffer; the buffer is flushed as one ``UPDATE ... SET views =
+views + n`` per (model, n) group at most every ``VIEW_COUNT_FLUSH_INTERVAL``
+seconds, and again when the process exits.
+
+Repeat views from the same viewer (user, session or IP) within
+``VIEW_DEDUPE_WINDOW`` seconds are ignored. The dedupe markers live in the
+cache, so with a shared cache backend they hold across processes as well.
+
+Increments still in the buffer are lost if the process is killed; views are
+a statistic, so that is traded for not writing on every hit.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import Post, Profile, Video
+
+logger = logging.getLogger(__name__)
+
+VIEW_COUNT_FLUSH_INTERVAL = getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10)
+VIEW_DEDUPE_WINDOW = getattr(settings, 'VIEW_DEDUPE_WINDOW', 60 * 30)
+
+# Model -> counter column
+COUNTED_FIELDS = {
+    Profile: 'total_views',
+    Post: 'views',
+    Video: 'views',
+}
+
+
+class ViewCounterBuffer:
+    """Thread-safe buffer of pending ``{model: {pk: increment}}``"""
+
+    def __init__(self, flush_interval=None):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(lambda: defaultdict(int))
+        self._last_flush = time.monotonic()
+        self.flush_interval = VIEW_COUNT_FLUSH_INTERVAL if flush_interval is None else flush_interval
+
+    def add(self, model, pk, amount=1):
+        with self._lock:
+            self._pending[model][pk] += amount
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def pending(self, model, pk):
+        with self._lock:
+            return self._pending.get(model, {}).get(pk, 0)
+
+    def flush(self):
+        """Write every buffered increment; returns the number of views written"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: defaultdict(int))
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        written = 0
+        try:
+            with transaction.atomic():
+                for model, counts in pending.items():
+                    field = COUNTED_FIELDS[model]
+                    # One UPDATE per distinct increment instead of one per row
+                    by_amount = defaultdict(list)
+                    for pk, amount in counts.items():
+                        by_amount[amount].append(pk)
+                    for amount, pks in by_amount.items():
+                        model.objects.filter(pk__in=pks).update(**{field: F(field) + amount})
+                        written += amount * len(pks)
+        except Exception as error:
+            # Put the increments back so the next flush retries them
+            with self._lock:
+                for model, counts in pending.items():
+                    for pk, amount in counts.items():
+                        self._pending[model][pk] += amount
+            logger.warning('View counter flush failed, will retry: %s', error)
+            return 0
+        return written
+
+
+view_counter = ViewCounterBuffer()
+atexit.register(view_counter.flush)
+
+
+def viewer_key(request):
+    """Identify the viewer for deduplication: user, then session, then IP"""
+    if request.user.is_authenticated:
+        return f'user:{request.user.id}'
+    if request.session.session_key:
+        return f'session:{request.session.session_key}'
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    ip = forwarded.split(',')[0].strip() if forwarded else request.META.get('REMOTE_ADDR', '')
+    return f'ip:{ip}'
+
+
+def record_view(obj, viewer):
+    """
+    Count one view of ``obj`` (a Profile, Post or Video) by ``viewer`` unless
+    the same viewer was already counted within the dedupe window. Returns
+    True when the view was counted.
+    """
+    model = type(obj)
+    marker = f'viewed:{model._meta.label_lower}:{obj.pk}:{viewer}'
+    # cache.add is atomic, so concurrent repeat views are counted once
+    if not cache.add(marker, 1, VIEW_DEDUPE_WINDOW):
+        return False
+    view_counter.add(model, obj.pk)
+    return True
+
+
+def displayed_views(obj):
+    """The stored counter plus any increments not flushed yet"""
+    model = type(obj)
+    return getattr(obj, COUNTED_FIELDS[model]) + view_counter.pending(model, obj.pk)
@@ -2,12 +2,15 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponseForbidden
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden, StreamingHttpResponse, Http404
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.db.models import Q, Count, Sum, Avg, F  # Add F to imports
-from django.core.paginator import Paginator
 from django.utils import timezone
 from datetime import datetime, timedelta
 import json
+import math
 # Add these imports at the top
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
@@ -25,52 +28,52 @@ from allauth.account.decorators import verified_email_required
 
 from .models import *
 from .forms import *
+from .avatars import avatar_urls, photo_added, set_primary_photo
+from .images import (
+    ImageProcessingError, current_original, derivative_name, ensure_derivatives, is_original_name, is_public_image,
+    parse_derivative_name,
+)
+from .inbox import build_inbox
+from .media_serving import is_blocked, is_protected, serve as serve_media
+from .service_worker import service_worker_script
+from .notifications import send_invitation
+from .tasks import enqueue
+from .uploads import (
+    UPLOAD_CHUNK_SIZE, UploadRejected, append_chunk, files_with_uploads, limit_uploads, release_uploads,
+    start_upload, upload_errors,
+)
+from .provisioning import get_profile
+from .middleware import query_budget
+from .pagination import CURSOR_PARAM, KeysetPaginator, cached_count, page_querystring
+from .profile_summary import get_profile_summary
+from .search import CONTACT_FIELDS, order_by_rank, search_profile_ids
+from .discovery import normalize_filters, search_page
+from .geo import DEFAULT_RADIUS_KM
+from .interactions import toggle_post_interaction, toggle_video_like
+from .view_counters import displayed_views, record_view, viewer_key
+from .messaging import message_window, serialize_message, parse_history_params
+from .realtime import (
+    conversation_channel, event_stream, publish_read_receipt, publish_typing,
+    wait_for_messages, LONG_POLL_MAX_WAIT,
+)
 
 
-def get_user_profile(user):
-    """Safe method to get or create user profile"""
-    try:
-        return user.profile
-    except Profile.DoesNotExist:
-        # Create profile with default values
-        profile = Profile.objects.create(
-            user=user,
-            phone_number=f"2547{user.id:08d}",  # Kenyan format
-            gender='Other',
-            sexual_orientation='Other',
-            age=25,
-            nationality='Kenyan',
-            county='Nairobi',
-            city_town='Nairobi',
-            location='Nairobi CBD',
-            services_offered='Dinner Date'
-        )
-        
-        # Also create wallet and settings if they don't exist
-        Wallet.objects.get_or_create(user=user)
-        UserSetting.objects.get_or_create(user=user)
-        
-        return profile
-
 # ==================== DASHBOARD VIEWS ====================
 @login_required
 def dashboard_view(request):
     user = request.user
     
     # Get user profile
-    profile = get_user_profile(user)
+    profile = get_profile(user)
     
     # Get unread messages count
-    unread_messages_count = Message.objects.filter(
-        conversation__participants=user,
-        is_read=False
-    ).exclude(sender=user).count()
+    unread_messages_count = UnreadCounter.total_for(user)
     
     # Get recent activity
     recent_posts = Post.objects.filter(user=user).order_by('-created_at')[:5]
     recent_messages = Message.objects.filter(
         Q(conversation__participants=user) & ~Q(sender=user)
-    ).order_by('-sent_at')[:5]
+    ).select_related('sender__profile__primary_photo').order_by('-sent_at')[:5]
     
     # Get pending bookings
     pending_bookings = ServiceBooking.objects.filter(
@@ -116,81 +119,23 @@ def dashboard_view(request):
     return render(request, 'dashboard/dashboard.html', context)
 
 
-def get_user_profile(user):
-    """Safe method to get or create user profile"""
-    try:
-        return user.profile
-    except Profile.DoesNotExist:
-        # Create profile with default values
-        profile = Profile.objects.create(
-            user=user,
-            phone_number=f"0700000000{user.id}",
-            gender='Other',
-            sexual_orientation='Other',
-            age=25,
-            nationality='Kenyan',
-            county='Nairobi',
-            city_town='Nairobi',
-            location='Nairobi CBD',
-            services_offered='Dinner Date'
-        )
-        
-        # Also create wallet and settings if they don't exist
-        Wallet.objects.get_or_create(user=user)
-        UserSetting.objects.get_or_create(user=user)
-        
-        return profile
-
-
+@query_budget(18)
 @login_required
 def profile_view(request, username=None):
     if username:
-        user = get_object_or_404(User, username=username)
+        user = get_object_or_404(User.objects.select_related('profile'), username=username)
     else:
         user = request.user
     
-    # Use safe method to get profile
-    profile = get_user_profile(user)
+    profile = get_profile(user)
     
-    # Increment profile views (for non-owners)
+    # Count the view (for non-owners); flushed to the database in batches
     if request.user != user:
-        profile.total_views += 1
-        profile.save()
-    
-    # Get primary photo with optimized query
-    try:
-        primary_photo = Photo.objects.filter(
-            profile=profile,
-            is_primary=True
-        ).select_related('profile').first()
-        
-        # If no primary photo, get the most recent photo
-        if not primary_photo:
-            primary_photo = Photo.objects.filter(
-                profile=profile
-            ).select_related('profile').order_by('-uploaded_at').first()
-            
-            # If we found a photo but it's not marked as primary, mark it
-            if primary_photo:
-                primary_photo.is_primary = True
-                primary_photo.save()
-    except Exception as e:
-        primary_photo = None
+        record_view(profile, viewer_key(request))
+    profile.total_views = displayed_views(profile)
     
-    # Get user's photos with optimization
-    photos = Photo.objects.filter(profile=profile).select_related('profile').order_by('-is_primary', '-uploaded_at')
-    
-    # Get user's videos
-    videos = Video.objects.filter(profile=profile).order_by('-uploaded_at')
-    
-    # Get user's posts with optimization - FIXED: Removed 'likes' from prefetch_related
-    posts = Post.objects.filter(user=user).select_related('user').annotate(
-    likes_count=Count('interactions', filter=Q(interactions__interaction_type='like'))
-).prefetch_related(
-    'comments__user__profile'
-).order_by('-created_at')[:10]
-    # Get services as list
-    services_list = profile.get_services_list()
+    # Photos, videos, posts, services and booking/call stats are cached per profile
+    summary = get_profile_summary(profile)
     
     # Check if user can contact this profile
     can_contact = True
@@ -207,56 +152,10 @@ def profile_view(request, username=None):
             can_contact = not contact.is_blocked
             is_contact = not contact.is_blocked
     
-    # Initialize stats with default values
     rating_stats = {'avg_rating': profile.rating, 'total_reviews': 0}
-    booking_stats = {'total_bookings': profile.total_bookings, 'total_earnings': 0}
-    call_stats = {'total_calls': profile.total_calls, 'total_duration': 0}
     
-    # Try to get booking stats if bookings app exists
-    try:
-        booking_stats = ServiceBooking.objects.filter(
-            service_provider=user,
-            status__in=['completed', 'confirmed']
-        ).aggregate(
-            total_bookings=Count('id'),
-            total_earnings=Sum('total_amount')
-        )
-        
-        # Update profile booking count if different
-        if profile.total_bookings != (booking_stats['total_bookings'] or 0):
-            profile.total_bookings = booking_stats['total_bookings'] or 0
-            profile.save()
-    except Exception as e:
-        # Use profile data
-        booking_stats = {
-            'total_bookings': profile.total_bookings or 0,
-            'total_earnings': 0
-        }
-    
-    # Try to get call stats if calls app exists
-    try:
-        call_stats = CallLog.objects.filter(
-            receiver=user,
-            status='completed'
-        ).aggregate(
-            total_calls=Count('id'),
-            total_duration=Sum('duration')
-        )
-        
-        # Update profile call count if different
-        if profile.total_calls != (call_stats['total_calls'] or 0):
-            profile.total_calls = call_stats['total_calls'] or 0
-            profile.save()
-    except Exception as e:
-        # Use profile data
-        call_stats = {
-            'total_calls': profile.total_calls or 0,
-            'total_duration': 0
-        }
-    
-    # Check online status - FIXED: Use last_active instead of last_seen
+    # Online status is derived for display only; it is not written back
     profile.is_online = profile.last_active >= timezone.now() - timedelta(minutes=5)
-    profile.save()  # Save the online status update
     
     # Get verification status
     verification_status = {
@@ -267,17 +166,17 @@ def profile_view(request, username=None):
     context = {
         'profile_user': user,
         'profile': profile,
-        'primary_photo': primary_photo,
-        'photos': photos,
-        'videos': videos,
-        'posts': posts,
-        'services_list': services_list,
+        'primary_photo': summary['primary_photo'],
+        'photos': summary['photos'],
+        'videos': summary['videos'],
+        'posts': summary['posts'],
+        'services_list': summary['services_list'],
         'is_owner': request.user == user,
         'can_contact': can_contact,
         'is_contact': is_contact,
         'rating_stats': rating_stats,
-        'booking_stats': booking_stats,
-        'call_stats': call_stats,
+        'booking_stats': summary['booking_stats'],
+        'call_stats': summary['call_stats'],
         'verification_status': verification_status,
         'now': timezone.now(),
         'debug': False,  # Set to False for production
@@ -291,28 +190,6 @@ def profile_view(request, username=None):
     return render(request, 'dashboard/profile.html', context)
 
 
-
-def get_user_profile(user):
-    """Safely get or create user profile"""
-    try:
-        profile = Profile.objects.get(user=user)
-    except Profile.DoesNotExist:
-        # Create profile if it doesn't exist
-        profile = Profile.objects.create(
-            user=user,
-            username=user.username,
-            email=user.email,
-            # Set default values
-            gender='',
-            age=18,
-            phone_number='',
-            county='',
-            city_town='',
-            location='',
-            services_offered='',
-        )
-    return profile
-
 @login_required
 def profile_edit_view(request):
     profile = request.user.profile
@@ -336,18 +213,18 @@ def profile_edit_view(request):
 
 
 @login_required
+@limit_uploads(image='photo')
 def profile_upload_photo(request):
     if request.method == 'POST':
         form = PhotoUploadForm(request.POST, request.FILES)
+        for error in upload_errors(request, form):
+            messages.error(request, error)
         if form.is_valid():
             photo = form.save(commit=False)
             photo.profile = request.user.profile
-            
-            # If this is set as primary, unset others
-            if photo.is_primary:
-                Photo.objects.filter(profile=request.user.profile).update(is_primary=False)
-            
             photo.save()
+            # Unsets the other primaries and updates the avatar pointer
+            photo_added(photo)
             messages.success(request, 'Photo uploaded successfully!')
             return redirect('profile')
     else:
@@ -356,13 +233,19 @@ def profile_upload_photo(request):
     return render(request, 'dashboard/upload_photo.html', {'form': form})
 
 @login_required
+@limit_uploads(video_file='video', thumbnail='video_thumbnail')
 def profile_upload_video(request):
     if request.method == 'POST':
-        form = VideoUploadForm(request.POST, request.FILES)
+        # Large videos may have arrived beforehand through the resumable upload API
+        files = files_with_uploads(request, video_file='video')
+        form = VideoUploadForm(request.POST, files)
+        for error in upload_errors(request, form):
+            messages.error(request, error)
         if form.is_valid():
             video = form.save(commit=False)
             video.profile = request.user.profile
             video.save()
+            release_uploads(files)
             messages.success(request, 'Video uploaded successfully!')
             return redirect('profile')
     else:
@@ -373,9 +256,12 @@ def profile_upload_video(request):
 # ==================== POST VIEWS ====================
 
 @login_required
+@limit_uploads(image='post_image', video='post_video')
 def post_create_view(request):
     if request.method == 'POST':
-        form = PostCreateForm(request.POST, request.FILES)
+        files = files_with_uploads(request, video='post_video')
+        form = PostCreateForm(request.POST, files)
+        upload_errors(request, form)
         if form.is_valid():
             post = form.save(commit=False)
             post.user = request.user
@@ -390,6 +276,7 @@ def post_create_view(request):
                     post.post_type = 'text'
             
             post.save()
+            release_uploads(files)
             messages.success(request, 'Post created successfully!')
             return redirect('post_detail', post_id=post.id)
     else:
@@ -397,15 +284,18 @@ def post_create_view(request):
     
     return render(request, 'dashboard/post_create.html', {'form': form})
 
+@query_budget(14)
 def post_detail_view(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     
-    # Increment views
+    # Count the view; flushed to the database in batches
     if request.user != post.user:
-        post.views += 1
-        post.save()
+        record_view(post, viewer_key(request))
+    post.views = displayed_views(post)
     
-    comments = Comment.objects.filter(post=post).order_by('created_at')
+    comments = Comment.objects.filter(post=post).select_related(
+        'user__profile__primary_photo'
+    ).order_by('created_at')
     comment_form = CommentForm()
     
     # Check if user has interacted with this post
@@ -422,8 +312,8 @@ def post_detail_view(request, post_id):
             comment.user = request.user
             comment.save()
             
-            post.comments_count += 1
-            post.save()
+            # Only touch comments_count; post.views includes unflushed views
+            Post.objects.filter(pk=post.pk).update(comments_count=F('comments_count') + 1)
             
             messages.success(request, 'Comment added!')
             return redirect('post_detail', post_id=post.id)
@@ -444,35 +334,21 @@ def post_interact_view(request, post_id, interaction_type):
     if interaction_type not in ['like', 'save', 'share', 'report']:
         return JsonResponse({'error': 'Invalid interaction type'}, status=400)
     
-    # Check if interaction already exists
-    interaction, created = PostInteraction.objects.get_or_create(
-        user=request.user,
-        post=post,
-        interaction_type=interaction_type
-    )
-    
-    if not created:
-        interaction.delete()
-        is_active = False
-    else:
-        is_active = True
-    
-    # Update post stats
-    if interaction_type == 'like':
-        post.likes = post.likes + 1 if created else max(0, post.likes - 1)
-        post.save()
+    # Toggle the interaction and move the like counter in one transaction
+    is_active, likes_count = toggle_post_interaction(request.user, post, interaction_type)
     
     return JsonResponse({
         'success': True,
         'is_active': is_active,
-        'likes_count': post.likes,
+        'likes_count': likes_count,
     })
 
 @login_required
 def post_archive_view(request, post_id):
     post = get_object_or_404(Post, id=post_id, user=request.user)
     post.is_archived = not post.is_archived
-    post.save()
+    # Leave the counters alone; they are updated with F() deltas elsewhere
+    post.save(update_fields=['is_archived', 'updated_at'])
     
     action = 'archived' if post.is_archived else 'unarchived'
     messages.success(request, f'Post {action} successfully!')
@@ -491,26 +367,21 @@ def post_delete_view(request, post_id):
 
 # ==================== MESSAGING VIEWS ====================
 
+@query_budget(10)
 @login_required
 def inbox_view(request):
-    conversations = Conversation.objects.filter(participants=request.user).order_by('-last_message_at')
-    
-    # Get unread counts and last message
-    for conversation in conversations:
-        conversation.unread_count = Message.objects.filter(
-            conversation=conversation,
-            is_read=False
-        ).exclude(sender=request.user).count()
-        
-        # Get other participant
-        other_participant = conversation.participants.exclude(id=request.user.id).first()
-        conversation.other_participant = other_participant
-        conversation.other_profile = other_participant.profile if other_participant else None
+    # Unread counts, other participant, profile and photo in a fixed number of queries
+    conversations, next_cursor = build_inbox(request.user, cursor=request.GET.get(CURSOR_PARAM))
     
-    return render(request, 'dashboard/inbox.html', {'conversations': conversations})
+    return render(request, 'dashboard/inbox.html', {
+        'conversations': conversations,
+        'next_cursor': next_cursor,
+        'page_query': page_querystring(request),
+    })
 
 
 @login_required
+@limit_uploads(media_file='message_media')
 def conversation_view(request, conversation_id=None, username=None):
     if conversation_id:
         conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
@@ -539,12 +410,17 @@ def conversation_view(request, conversation_id=None, username=None):
         return redirect('inbox')
     
     # Mark messages as read
-    Message.objects.filter(
+    read_at = timezone.now()
+    marked = Message.objects.filter(
         conversation=conversation,
         is_read=False
-    ).exclude(sender=request.user).update(is_read=True, read_at=timezone.now())
+    ).exclude(sender=request.user).update(is_read=True, read_at=read_at)
+    UnreadCounter.mark_read(request.user, conversation)
+    if marked:
+        publish_read_receipt(conversation.id, request.user, read_at)
     
-    messages_list = Message.objects.filter(conversation=conversation).order_by('sent_at')
+    # Only the newest window is rendered; older messages load on scroll
+    messages_list, has_more = message_window(conversation)
     
     # Get other user info
     other_user = conversation.participants.exclude(id=request.user.id).first()
@@ -553,12 +429,13 @@ def conversation_view(request, conversation_id=None, username=None):
     # Handle form submission
     if request.method == 'POST':
         form = MessageForm(request.POST, request.FILES)
+        upload_errors(request, form)
         if form.is_valid():
             message = form.save(commit=False)
             message.conversation = conversation
             message.sender = request.user
             
-            # Determine message type based on file
+            # Determine message type based on file (the sniffed type, see main.uploads)
             if 'media_file' in request.FILES:
                 media_file = request.FILES['media_file']
                 if media_file.content_type.startswith('image/'):
@@ -575,15 +452,7 @@ def conversation_view(request, conversation_id=None, username=None):
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return JsonResponse({
                     'success': True,
-                    'message': {
-                        'id': message.id,
-                        'content': message.content,
-                        'message_type': message.message_type,
-                        'media_url': message.media_file.url if message.media_file else None,
-                        'sent_at': message.sent_at.isoformat(),
-                        'sender': message.sender.username,
-                        'is_read': message.is_read,
-                    }
+                    'message': serialize_message(message),
                 })
             
             messages.success(request, 'Message sent!')
@@ -600,6 +469,8 @@ def conversation_view(request, conversation_id=None, username=None):
     context = {
         'conversation': conversation,
         'messages': messages_list,
+        'has_more_messages': has_more,
+        'oldest_message_id': messages_list[0].id if messages_list else None,
         'form': form,
         'other_user': other_user,
         'other_profile': other_profile,
@@ -608,21 +479,10 @@ def conversation_view(request, conversation_id=None, username=None):
     
     # If AJAX request for initial load
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        messages_data = []
-        for msg in messages_list:
-            messages_data.append({
-                'id': msg.id,
-                'content': msg.content,
-                'message_type': msg.message_type,
-                'media_url': msg.media_file.url if msg.media_file else None,
-                'sent_at': msg.sent_at.isoformat(),
-                'sender': msg.sender.username,
-                'is_read': msg.is_read,
-            })
-        
         return JsonResponse({
             'conversation_id': conversation.id,
-            'messages': messages_data,
+            'messages': [serialize_message(msg) for msg in messages_list],
+            'has_more': has_more,
             'other_user': {
                 'username': other_user.username,
                 'is_online': other_profile.is_online if other_profile else False,
@@ -640,6 +500,7 @@ def conversation_delete_view(request, conversation_id):
     if request.method == 'POST':
         # Remove user from conversation participants
         conversation.participants.remove(request.user)
+        UnreadCounter.objects.filter(user=request.user, conversation=conversation).delete()
         
         # If no participants left, delete the conversation
         if conversation.participants.count() == 0:
@@ -655,9 +516,14 @@ def conversation_delete_view(request, conversation_id):
         'other_user': other_user,
     })
 
+@query_budget(8)
 @login_required
 def contacts_view(request):
-    contacts = Contact.objects.filter(user=request.user).order_by('-is_favorite', 'contact_user__username')
+    contacts = Contact.objects.filter(user=request.user).select_related(
+        'contact_user__profile__primary_photo'
+    ).prefetch_related(
+        'contact_user__profile__profile_services__service'
+    ).order_by('-is_favorite', 'contact_user__username')
     form = ContactAddForm()
     
     if request.method == 'POST':
@@ -904,6 +770,8 @@ def booking_list_view(request):
     # Get all bookings for the user
     bookings = ServiceBooking.objects.filter(
         Q(client=request.user) | Q(service_provider=request.user)
+    ).select_related(
+        'client__profile__primary_photo', 'service_provider__profile__primary_photo'
     ).order_by('-created_at')
     
     # Filter by status if provided
@@ -911,70 +779,42 @@ def booking_list_view(request):
     if status_filter:
         bookings = bookings.filter(status=status_filter)
     
-    # Pagination
-    paginator = Paginator(bookings, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination, one index seek per side of the booking
+    paginator = KeysetPaginator(
+        bookings, ['-created_at'], 10, count=cached_count(bookings),
+        partitions=[Q(client=request.user), Q(service_provider=request.user)],
+    )
+    page_obj = paginator.page(request.GET.get('cursor'))
     
-    return render(request, 'dashboard/booking_list.html', {'page_obj': page_obj, 'status_filter': status_filter})
+    return render(request, 'dashboard/booking_list.html', {
+        'page_obj': page_obj,
+        'status_filter': status_filter,
+        'page_query': page_querystring(request),
+    })
 
 # ==================== DISCOVERY VIEWS ====================
 
+@query_budget(15)
 def search_view(request):
-    profiles = Profile.objects.all().select_related('user')
     form = SearchForm(request.GET)
-    
-    if form.is_valid():
-        query = form.cleaned_data.get('query')
-        gender = form.cleaned_data.get('gender')
-        county = form.cleaned_data.get('county')
-        min_age = form.cleaned_data.get('min_age')
-        max_age = form.cleaned_data.get('max_age')
-        services = form.cleaned_data.get('services')
-        is_vip = form.cleaned_data.get('is_vip')
-        
-        # Apply filters
-        if query:
-            profiles = profiles.filter(
-                Q(user__username__icontains=query) |
-                Q(city_town__icontains=query) |
-                Q(services_offered__icontains=query)
-            )
-        
-        if gender:
-            profiles = profiles.filter(gender=gender)
-        
-        if county:
-            profiles = profiles.filter(county__icontains=county)
-        
-        if min_age:
-            profiles = profiles.filter(age__gte=min_age)
-        
-        if max_age:
-            profiles = profiles.filter(age__lte=max_age)
-        
-        if services:
-            profiles = profiles.filter(services_offered__icontains=services)
-        
-        if is_vip:
-            profiles = profiles.filter(is_vip=True)
-    
-    # Only show available profiles to non-authenticated users
-    if not request.user.is_authenticated:
-        profiles = profiles.filter(is_available=True)
-    
-    # Order by VIP status and last activity
-    profiles = profiles.order_by('-is_vip', '-last_active')
-    
-    # Pagination
-    paginator = Paginator(profiles, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    filters = normalize_filters(form.cleaned_data) if form.is_valid() else {}
+    
+    # Results and facet counts, cached per normalized filter set
+    page_obj, facets = search_page(
+        filters,
+        request.GET.get('cursor'),
+        # Only show available profiles to non-authenticated users
+        available_only=not request.user.is_authenticated,
+    )
     
     context = {
         'form': form,
         'page_obj': page_obj,
         'profiles': page_obj,
+        'facets': facets,
+        'page_query': page_querystring(request),
+        'radius_choices': [5, 10, 25, 50, 100],
+        'default_radius': DEFAULT_RADIUS_KM,
     }
     
     return render(request, 'dashboard/search.html', context)
@@ -1016,7 +856,8 @@ def invitation_create_view(request):
             invitation.inviter = request.user
             invitation.save()
             
-            # TODO: Send invitation email/SMS
+            # Sent by the task worker; SMS has no gateway yet
+            enqueue(send_invitation, {'invitation_id': invitation.id})
             messages.success(request, f'Invitation sent to {invitation.invitee_email}!')
             return redirect('invitations')
     else:
@@ -1058,16 +899,19 @@ def settings_view(request):
     
     return render(request, 'dashboard/settings.html', {'form': form})
 
+@query_budget(8)
 @login_required
 def archived_posts_view(request):
     posts = Post.objects.filter(user=request.user, is_archived=True).order_by('-created_at')
     
-    # Pagination
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: deep pages cost the same as the first
+    paginator = KeysetPaginator(posts, ['-created_at'], 10, count=cached_count(posts))
+    page_obj = paginator.page(request.GET.get('cursor'))
     
-    return render(request, 'dashboard/archived_posts.html', {'page_obj': page_obj})
+    return render(request, 'dashboard/archived_posts.html', {
+        'page_obj': page_obj,
+        'page_query': page_querystring(request),
+    })
 
 # ==================== CALL VIEWS ====================
 
@@ -1151,6 +995,8 @@ def call_detail_view(request, call_id):
 def call_history_view(request):
     calls = CallLog.objects.filter(
         Q(caller=request.user) | Q(receiver=request.user)
+    ).select_related(
+        'caller__profile__primary_photo', 'receiver__profile__primary_photo'
     ).order_by('-started_at')
     
     # Filter by call type if provided
@@ -1158,14 +1004,17 @@ def call_history_view(request):
     if call_type in ['audio', 'video']:
         calls = calls.filter(call_type=call_type)
     
-    # Pagination
-    paginator = Paginator(calls, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination, one index seek per side of the call
+    paginator = KeysetPaginator(
+        calls, ['-started_at'], 20, count=cached_count(calls),
+        partitions=[Q(caller=request.user), Q(receiver=request.user)],
+    )
+    page_obj = paginator.page(request.GET.get('cursor'))
     
     return render(request, 'dashboard/call_history.html', {
         'page_obj': page_obj,
         'call_type': call_type,
+        'page_query': page_querystring(request),
     })
 
 # ==================== API VIEWS ====================
@@ -1180,16 +1029,31 @@ def api_get_conversation_messages(request, conversation_id):
     # Get messages after a certain timestamp (for real-time updates)
     last_message_id = request.GET.get('last_message_id', 0)
     
+    # Long-poll: ?wait=N blocks up to N seconds for a new message. Under ASGI
+    # sync views share one thread, so clients there must use the stream instead.
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = 0
+    # nan would never time out
+    wait = max(0, min(wait, LONG_POLL_MAX_WAIT)) if math.isfinite(wait) else 0
+    if isinstance(request, ASGIRequest) or not request.META.get('wsgi.multithread'):
+        # A single-threaded worker would serve nobody else while this waits
+        wait = 0
+    
     messages = Message.objects.filter(
         conversation=conversation,
         id__gt=last_message_id
-    ).order_by('sent_at')
+    ).select_related('sender').order_by('sent_at')
+    
+    new_messages = wait_for_messages(conversation.id, messages, wait)
     
     messages_data = []
-    for msg in messages:
+    for msg in new_messages:
         messages_data.append({
             'id': msg.id,
             'sender': msg.sender.username,
+            'sender_id': msg.sender_id,
             'content': msg.content,
             'message_type': msg.message_type,
             'sent_at': msg.sent_at.strftime('%Y-%m-%d %H:%M:%S'),
@@ -1198,16 +1062,52 @@ def api_get_conversation_messages(request, conversation_id):
     
     return JsonResponse({'messages': messages_data})
 
+@login_required
+def api_conversation_history(request, conversation_id):
+    """Keyset-paginated history: the newest ``limit`` messages before ``before``"""
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
+    before, limit = parse_history_params(request.GET)
+    
+    messages_list, has_more = message_window(conversation, before=before, limit=limit)
+    
+    return JsonResponse({
+        'messages': [serialize_message(msg) for msg in messages_list],
+        'has_more': has_more,
+        'next_before': messages_list[0].id if has_more else None,
+    })
+
+def _is_conversation_participant(request, conversation_id):
+    return request.user.is_authenticated and Conversation.objects.filter(
+        id=conversation_id, participants=request.user
+    ).exists()
+
+async def api_conversation_stream(request, conversation_id):
+    """Server-Sent Events: new messages, read receipts and typing for a conversation"""
+    if not isinstance(request, ASGIRequest):
+        # A long-lived stream would pin a WSGI worker; tell the client to keep polling
+        return HttpResponse(status=204)
+    
+    if not await sync_to_async(_is_conversation_participant)(request, conversation_id):
+        return JsonResponse({'error': 'Conversation not found'}, status=404)
+    
+    response = StreamingHttpResponse(
+        event_stream(conversation_channel(conversation_id)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def api_get_notifications(request):
     if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
         return JsonResponse({'error': 'Invalid request'}, status=400)
     
     # Get unread messages count
-    unread_messages = Message.objects.filter(
-        conversation__participants=request.user,
-        is_read=False
-    ).exclude(sender=request.user).count()
+    unread_messages = UnreadCounter.total_for(request.user)
     
     # Get pending bookings
     pending_bookings = ServiceBooking.objects.filter(
@@ -1236,8 +1136,8 @@ def api_update_online_status(request):
     status = request.GET.get('status', 'online')
     
     if status in ['online', 'offline']:
-        request.user.profile.is_online = (status == 'online')
-        request.user.profile.save()
+        # A plain UPDATE: a full save would invalidate search results and summaries every ping
+        Profile.objects.filter(user=request.user).update(is_online=(status == 'online'), last_active=timezone.now())
         
         return JsonResponse({'success': True, 'status': status})
     
@@ -1347,10 +1247,7 @@ def api_get_notifications(request):
     
     try:
         # Get unread messages count
-        unread_messages = Message.objects.filter(
-            conversation__participants=request.user,
-            is_read=False
-        ).exclude(sender=request.user).count()
+        unread_messages = UnreadCounter.total_for(request.user)
         
         # Get pending bookings
         pending_bookings = ServiceBooking.objects.filter(
@@ -1403,9 +1300,9 @@ def api_update_online_status(request):
         
         if status in ['online', 'offline']:
             # Use safe profile access
-            profile = get_user_profile(request.user)
-            profile.is_online = (status == 'online')
-            profile.save()
+            profile = get_profile(request.user)
+            # A plain UPDATE: a full save would invalidate search results and summaries every ping
+            Profile.objects.filter(pk=profile.pk).update(is_online=(status == 'online'), last_active=timezone.now())
             
             return JsonResponse({'success': True, 'status': status})
         
@@ -1478,10 +1375,7 @@ def api_get_notifications(request):
     
     try:
         # Get unread messages count
-        unread_messages = Message.objects.filter(
-            conversation__participants=request.user,
-            is_read=False
-        ).exclude(sender=request.user).count()
+        unread_messages = UnreadCounter.total_for(request.user)
         
         # Get pending bookings
         pending_bookings = ServiceBooking.objects.filter(
@@ -1532,9 +1426,9 @@ def api_update_online_status(request):
         status = request.GET.get('status', 'online')
         
         if status in ['online', 'offline']:
-            profile = get_user_profile(request.user)
-            profile.is_online = (status == 'online')
-            profile.save()
+            profile = get_profile(request.user)
+            # A plain UPDATE: a full save would invalidate search results and summaries every ping
+            Profile.objects.filter(pk=profile.pk).update(is_online=(status == 'online'), last_active=timezone.now())
             
             return JsonResponse({'success': True, 'status': status})
         
@@ -1578,6 +1472,7 @@ def api_save_search(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@query_budget(6)
 @login_required
 def api_search_users(request):
     """API endpoint to search users for messaging"""
@@ -1589,22 +1484,25 @@ def api_search_users(request):
         if len(query) < 2:
             return JsonResponse({'users': []})
         
-        # Search for users
-        users = User.objects.filter(
-            Q(username__icontains=query) | 
-            Q(email__icontains=query) |
-            Q(profile__phone_number__icontains=query)
-        ).exclude(id=request.user.id)[:10]
+        # Search the index on username, email and phone number
+        matched_ids = search_profile_ids(query, fields=CONTACT_FIELDS, limit=11)
+        profiles = order_by_rank(
+            Profile.objects.filter(id__in=matched_ids).exclude(user=request.user).select_related('user'),
+            matched_ids
+        ).order_by('search_rank')[:10]
         
+        profiles = list(profiles)
+        avatars = avatar_urls([profile.user_id for profile in profiles])
         users_data = []
-        for user in users:
+        for profile in profiles:
+            user = profile.user
             users_data.append({
                 'id': user.id,
                 'username': user.username,
                 'email': user.email,
-                'city_town': user.profile.city_town,
-                'is_online': user.profile.is_online,
-                'avatar_url': user.profile.photos.first().image.url if user.profile.photos.exists() else None
+                'city_town': profile.city_town,
+                'is_online': profile.is_online,
+                'avatar_url': avatars.get(user.id)
             })
         
         return JsonResponse({'users': users_data})
@@ -1694,6 +1592,9 @@ def api_typing_indicator(request):
         cache_key = f'typing:{conversation_id}:{request.user.id}'
         cache.set(cache_key, is_typing, timeout=5)
         
+        if Conversation.objects.filter(id=conversation_id, participants=request.user).exists():
+            publish_typing(conversation_id, request.user, is_typing)
+        
         return JsonResponse({'success': True})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
@@ -1729,6 +1630,7 @@ def api_clear_chat(request, conversation_id):
     
     # Soft delete messages
     Message.objects.filter(conversation=conversation).delete()
+    UnreadCounter.objects.filter(conversation=conversation).update(count=0)
     
     return JsonResponse({'success': True})
 
@@ -1750,9 +1652,9 @@ def video_detail_view(request, video_id):
             messages.error(request, 'You cannot view this video.')
             return redirect('dashboard')
         
-        # Increment views
-        video.views += 1
-        video.save()
+        # Count the view; flushed to the database in batches
+        record_view(video, viewer_key(request))
+    video.views = displayed_views(video)
     
     # Check if user has liked the video
     try:
@@ -1766,7 +1668,9 @@ def video_detail_view(request, video_id):
     ).exclude(id=video_id).order_by('-uploaded_at')[:4]
     
     # Get video comments
-    video_comments = VideoComment.objects.filter(video=video).order_by('-created_at')[:50]
+    video_comments = VideoComment.objects.filter(video=video).select_related(
+        'user__profile__primary_photo'
+    ).order_by('-created_at')[:50]
     
     context = {
         'video': video,
@@ -1781,6 +1685,38 @@ def video_detail_view(request, video_id):
     
     return render(request, 'dashboard/video_detail.html', context)
 
+@login_required
+def video_media(request, video_id):
+    """The video file itself: the web transcode when there is one, otherwise the upload"""
+    video = get_object_or_404(Video.objects.select_related('profile__user'), id=video_id)
+    if is_blocked(video.profile.user, request.user):
+        return HttpResponseForbidden('You cannot view this video.')
+    return serve_media(request, (video.web_file or video.video_file).name)
+
+
+@login_required
+def video_poster(request, video_id):
+    """The thumbnail; the transcoder's poster lives next to the transcodes and is named after the original"""
+    video = get_object_or_404(Video.objects.select_related('profile__user'), id=video_id)
+    if not video.thumbnail:
+        raise Http404('No thumbnail')
+    if is_blocked(video.profile.user, request.user):
+        return HttpResponseForbidden('You cannot view this video.')
+    return serve_media(request, video.thumbnail.name, cache_control='private, max-age=86400')
+
+
+@login_required
+def video_hls(request, video_id, filename):
+    """HLS playlists and segments, which refer to each other by relative URL"""
+    video = get_object_or_404(Video.objects.select_related('profile__user'), id=video_id)
+    if not video.hls_playlist or filename.startswith('.'):
+        raise Http404('No HLS rendition')
+    if is_blocked(video.profile.user, request.user):
+        return HttpResponseForbidden('You cannot view this video.')
+    name = f"{video.hls_playlist.name.rsplit('/', 1)[0]}/{filename}"
+    return serve_media(request, name, cache_control='private, max-age=86400')
+
+
 @login_required
 @require_POST
 def video_like_view(request, video_id):
@@ -1788,31 +1724,14 @@ def video_like_view(request, video_id):
     video = get_object_or_404(Video, id=video_id)
     
     try:
-        # Check if user has already liked the video
-        like, created = VideoLike.objects.get_or_create(
-            user=request.user,
-            video=video
-        )
-        
-        if not created:
-            # User already liked the video, so unlike it
-            like.delete()
-            liked = False
-            # Decrement likes count
-            if video.likes > 0:
-                video.likes -= 1
-        else:
-            liked = True
-            # Increment likes count
-            video.likes += 1
-        
-        video.save()
+        # Toggle the like and move the counter in one transaction
+        liked, likes_count = toggle_video_like(request.user, video)
         
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({
                 'success': True,
                 'liked': liked,
-                'likes_count': video.likes,
+                'likes_count': likes_count,
             })
         
         messages.success(request, f'Video {"liked" if liked else "unliked"}!')
@@ -1863,7 +1782,8 @@ def api_video_edit(request, video_id):
                     return JsonResponse({'error': 'Thumbnail image is too large. Max size is 10MB'}, status=400)
                 video.thumbnail = thumbnail
             
-            video.save()
+            # Leave the counters alone; they are updated with F() deltas elsewhere
+            video.save(update_fields=['title', 'description', 'thumbnail'])
             
             return JsonResponse({
                 'success': True,
@@ -1872,7 +1792,7 @@ def api_video_edit(request, video_id):
                     'id': video.id,
                     'title': video.title,
                     'description': video.description,
-                    'thumbnail_url': video.thumbnail.url if video.thumbnail else ''
+                    'thumbnail_url': video.poster_url
                 }
             })
         else:
@@ -1936,17 +1856,7 @@ def api_video_comment(request, video_id):
             text=text
         )
         
-        # Get avatar URL
-        avatar_url = ''
-        try:
-            if request.user.profile.photos.exists():
-                primary_photo = request.user.profile.photos.filter(is_primary=True).first()
-                if not primary_photo:
-                    primary_photo = request.user.profile.photos.first()
-                if primary_photo:
-                    avatar_url = primary_photo.image.url
-        except:
-            pass
+        avatar_url = avatar_urls([request.user]).get(request.user.id, '')
         
         return JsonResponse({
             'success': True,
@@ -2006,12 +1916,9 @@ def photo_upload_view(request):
         if form.is_valid():
             photo = form.save(commit=False)
             photo.profile = request.user.profile
-            
-            # If this is set as primary, unset others
-            if photo.is_primary:
-                Photo.objects.filter(profile=request.user.profile).update(is_primary=False)
-            
             photo.save()
+            # Unsets the other primaries and updates the avatar pointer
+            photo_added(photo)
             messages.success(request, 'Photo uploaded successfully!')
             return redirect('upload_photo')
     else:
@@ -2026,6 +1933,7 @@ def photo_upload_view(request):
 
 
 @login_required
+@limit_uploads(images='photo')
 @csrf_exempt
 @require_POST
 def api_photo_upload(request):
@@ -2038,29 +1946,21 @@ def api_photo_upload(request):
         caption = request.POST.get('caption', '').strip()
         is_primary = request.POST.get('is_primary') == 'on'
         
-        if not images:
-            return JsonResponse({'error': 'No images provided'}, status=400)
+        # Type and size (5MB) were checked while the files streamed in
+        rejected = upload_errors(request)
         
-        # If setting as primary, unset current primary
-        if is_primary:
-            Photo.objects.filter(profile=request.user.profile).update(is_primary=False)
+        if not images:
+            return JsonResponse({'error': 'No images provided', 'rejected': rejected}, status=400)
         
         photo_ids = []
         for image in images:
-            # Validate file type
-            if not image.content_type.startswith('image/'):
-                continue
-            
-            # Validate file size (5MB)
-            if image.size > 5 * 1024 * 1024:
-                continue
-            
             photo = Photo.objects.create(
                 profile=request.user.profile,
                 image=image,
                 caption=caption,
                 is_primary=is_primary
             )
+            photo_added(photo)
             photo_ids.append(photo.id)
             
             # Only first photo can be primary if multiple uploaded
@@ -2070,7 +1970,8 @@ def api_photo_upload(request):
         return JsonResponse({
             'success': True,
             'message': f'{len(photo_ids)} photo(s) uploaded successfully',
-            'photo_ids': photo_ids
+            'photo_ids': photo_ids,
+            'rejected': rejected,
         })
         
     except Exception as e:
@@ -2098,14 +1999,11 @@ def api_photo_edit(request):
         
         # Update photo
         photo.caption = caption
+        photo.save()
         
         # Handle primary photo change
         if is_primary and not photo.is_primary:
-            # Unset current primary
-            Photo.objects.filter(profile=request.user.profile).update(is_primary=False)
-            photo.is_primary = True
-        
-        photo.save()
+            set_primary_photo(photo)
         
         return JsonResponse({
             'success': True,
@@ -2141,15 +2039,14 @@ def api_photo_delete(request):
         # Store info before deletion
         was_primary = photo.is_primary
         
-        # Delete the photo
+        # Delete the photo; the avatar pointer moves to the newest remaining one
         photo.delete()
         
-        # If it was primary, set a new primary (most recent photo)
+        # If it was primary, mark the most recent photo primary
         if was_primary:
             latest_photo = Photo.objects.filter(profile=request.user.profile).first()
             if latest_photo:
-                latest_photo.is_primary = True
-                latest_photo.save()
+                set_primary_photo(latest_photo)
         
         return JsonResponse({
             'success': True,
@@ -2178,13 +2075,8 @@ def api_photo_set_primary(request):
         if not photo_id:
             return JsonResponse({'error': 'Photo ID is required'}, status=400)
         
-        # Unset current primary
-        Photo.objects.filter(profile=request.user.profile).update(is_primary=False)
-        
-        # Set new primary
         photo = Photo.objects.get(id=photo_id, profile=request.user.profile)
-        photo.is_primary = True
-        photo.save()
+        set_primary_photo(photo)
         
         return JsonResponse({
             'success': True,
@@ -2197,6 +2089,115 @@ def api_photo_set_primary(request):
     except Exception as e:
         print(f"Error in api_photo_set_primary: {e}")
         return JsonResponse({'error': 'Failed to set primary photo'}, status=500)
+
+
+def post_video_media(request, post_id):
+    post = get_object_or_404(Post.objects.select_related('user'), id=post_id)
+    if not post.video:
+        raise Http404('Post has no video')
+    if is_blocked(post.user, request.user):
+        return HttpResponseForbidden('You cannot view this video.')
+    return serve_media(request, post.video.name)
+
+
+@login_required
+def message_media(request, message_id):
+    message = get_object_or_404(Message, id=message_id, conversation__participants=request.user)
+    if not message.media_file:
+        raise Http404('Message has no media')
+    return serve_media(request, message.media_file.name)
+
+
+def media_file(request, path):
+    """MEDIA_URL in development, with the byte ranges static() lacks"""
+    if is_protected(path):
+        # Only through the views that check blocks
+        raise Http404('Media not found')
+    return serve_media(request, path, cache_control='no-cache')
+
+
+def service_worker(request):
+    """The service worker, from the site root so its scope covers every page"""
+    response = HttpResponse(service_worker_script(), content_type='application/javascript')
+    # Browsers compare the script on each visit; a new version means new caches
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def image_derivative(request, path):
+    """Generate a missing image derivative on first request and redirect to the file"""
+    parsed = parse_derivative_name(path)
+    if parsed is None or not is_original_name(parsed[0]):
+        raise Http404('Not an image derivative')
+    original, size, fmt = parsed
+    
+    if not default_storage.exists(path):
+        # Its EXIF may have been stripped into a new blob since the page was rendered
+        original = current_original(original)
+        path = derivative_name(original, size, fmt)
+    if not default_storage.exists(path):
+        # Message attachments are blobs too, and private
+        if not is_public_image(original) or not default_storage.exists(original):
+            raise Http404('Image not found')
+        try:
+            ready = ensure_derivatives(original, derived=path)
+        except ImageProcessingError:
+            raise Http404('Image could not be processed')
+        if not ready:
+            # Another request is generating them; send the original meanwhile
+            return redirect(default_storage.url(original))
+    
+    response = redirect(default_storage.url(path))
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+def _upload_state(upload):
+    return {
+        'id': str(upload.id),
+        'offset': upload.offset,
+        'size': upload.size,
+        'complete': upload.completed,
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+    }
+
+
+@login_required
+@require_POST
+def api_upload_start(request):
+    """Start a resumable upload; the file is then sent with PATCH to api_upload_chunk"""
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'size is required'}, status=400)
+    try:
+        upload = start_upload(
+            request.user, request.POST.get('kind', ''), request.POST.get('filename', ''), size,
+            request.POST.get('content_type', ''),
+        )
+    except UploadRejected as error:
+        return JsonResponse({'error': str(error)}, status=error.status)
+    return JsonResponse(_upload_state(upload), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PATCH'])
+def api_upload_chunk(request, upload_id):
+    """GET: how much has arrived (to resume). PATCH: append the body at the Upload-Offset header"""
+    upload = get_object_or_404(ChunkedUpload, id=upload_id, user=request.user)
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return JsonResponse({'error': 'Upload-Offset and Content-Length are required'}, status=400)
+        try:
+            # Read from the request stream in pieces, never as request.body
+            append_chunk(upload, offset, request, length)
+        except UploadRejected as error:
+            upload.refresh_from_db()
+            return JsonResponse({'error': str(error), **_upload_state(upload)}, status=error.status)
+    return JsonResponse(_upload_state(upload))
     
 
 @login_required
@@ -0,0 +1,54 @@
+$(document).ready(function() {
+    // Password strength checker
+    $('#id_password1').on('input', function() {
+        const password = $(this).val();
+        const strengthFill = $('#strengthFill');
+        const strengthText = $('#strengthText');
+
+        // Check rules
+        const hasLength = password.length >= 8;
+        const hasUpper = /[A-Z]/.test(password);
+        const hasNumber = /[0-9]/.test(password);
+        const hasSpecial = /[^A-Za-z0-9]/.test(password);
+
+        // Update rule indicators
+        $('#rule-length').toggleClass('invalid', !hasLength);
+        $('#rule-upper').toggleClass('invalid', !hasUpper);
+        $('#rule-number').toggleClass('invalid', !hasNumber);
+        $('#rule-special').toggleClass('invalid', !hasSpecial);
+
+        // Calculate score
+        let score = 0;
+        if (hasLength) score++;
+        if (hasUpper) score++;
+        if (hasNumber) score++;
+        if (hasSpecial) score++;
+
+        const colors = ['#ff4757', '#ffa502', '#2ed573', '#1e90ff'];
+        const labels = ['Very Weak', 'Weak', 'Good', 'Strong'];
+
+        const width = (score * 25) + '%';
+        strengthFill.css({
+            'width': width,
+            'background-color': colors[score] || colors[0]
+        });
+        strengthText.text('Password strength: ' + (labels[score] || 'Very Weak'));
+        strengthText.css('color', colors[score] || colors[0]);
+    });
+
+    // Password match check
+    $('#id_password2').on('input', function() {
+        const pass1 = $('#id_password1').val();
+        const pass2 = $(this).val();
+
+        if (pass1 && pass2) {
+            if (pass1 === pass2) {
+                $(this).removeClass('error');
+                $('#rule-match').removeClass('invalid');
+            } else {
+                $(this).addClass('error');
+                $('#rule-match').addClass('invalid');
+            }
+        }
+    });
+});
@@ -0,0 +1,46 @@
+$(document).ready(function() {
+    // Password strength checker
+    $('#id_password1').on('input', function() {
+        const password = $(this).val();
+        const strengthFill = $('#strengthFill');
+        const strengthText = $('#strengthText');
+
+        let score = 0;
+        if (password.length >= 8) score++;
+        if (/[A-Z]/.test(password)) score++;
+        if (/[0-9]/.test(password)) score++;
+        if (/[^A-Za-z0-9]/.test(password)) score++;
+
+        const colors = ['#ff4757', '#ffa502', '#2ed573', '#1e90ff'];
+        const labels = ['Very Weak', 'Weak', 'Good', 'Strong'];
+
+        const width = (score * 25) + '%';
+        strengthFill.css({
+            'width': width,
+            'background-color': colors[score] || colors[0]
+        });
+        strengthText.text('Password strength: ' + (labels[score] || 'Very Weak'));
+        strengthText.css('color', colors[score] || colors[0]);
+    });
+
+    // Account type selection
+    $('.type-option input').change(function() {
+        $('.type-card').removeClass('active');
+        $(this).siblings('.type-card').addClass('active');
+    });
+
+    // Initial active state
+    $('.type-option input:checked').siblings('.type-card').addClass('active');
+
+    // Password confirmation check
+    $('#id_password2').on('input', function() {
+        const pass1 = $('#id_password1').val();
+        const pass2 = $(this).val();
+
+        if (pass1 && pass2 && pass1 !== pass2) {
+            $(this).addClass('error');
+        } else {
+            $(this).removeClass('error');
+        }
+    });
+});
@@ -0,0 +1,45 @@
+$(document).ready(function() {
+    // Password visibility toggle
+    $('.password-toggle').click(function() {
+        const target = $(this).data('target');
+        const input = $('#' + target);
+        const icon = $(this).find('i');
+        const type = input.attr('type') === 'password' ? 'text' : 'password';
+        input.attr('type', type);
+        icon.toggleClass('fa-eye fa-eye-slash');
+    });
+
+    // Form validation
+    $('form').on('submit', function(e) {
+        let valid = true;
+        $(this).find('.form-input[required]').each(function() {
+            if (!$(this).val().trim()) {
+                valid = false;
+                $(this).addClass('error');
+            } else {
+                $(this).removeClass('error');
+            }
+        });
+
+        if (!valid) {
+            e.preventDefault();
+            return false;
+        }
+
+        // Add loading state
+        const submitBtn = $(this).find('button[type="submit"]');
+        submitBtn.prop('disabled', true).html('<i class="fas fa-spinner fa-spin"></i> Processing...');
+
+        return true;
+    });
+
+    // Auto-focus first input
+    $('.form-input').first().focus();
+
+    // CSRF setup
+    $.ajaxSetup({
+        headers: {
+            'X-CSRFToken': $('meta[name="csrf-token"]').attr('content')
+        }
+    });
+});
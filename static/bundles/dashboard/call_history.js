@@ -0,0 +1,48 @@
+$(document).ready(function() {
+    // Filter functionality
+    $('.filter-btn').click(function() {
+        $('.filter-btn').removeClass('active');
+        $(this).addClass('active');
+
+        const filter = $(this).data('filter');
+
+        if (filter === 'all') {
+            $('.call-card').show();
+        } else {
+            $('.call-card').hide();
+            $(`.call-card[data-${filter}]`).show();
+
+            // Special handling for direction filters
+            if (filter === 'outgoing' || filter === 'incoming') {
+                $(`.call-card[data-direction="${filter}"]`).show();
+            }
+        }
+    });
+
+    // Set active filter based on URL
+    const urlParams = new URLSearchParams(window.location.search);
+    const callType = urlParams.get('type');
+    if (callType) {
+        $('.filter-btn').removeClass('active');
+        $(`[data-filter="${callType}"]`).addClass('active');
+
+        // Apply filter
+        $('.call-card').hide();
+        $(`.call-card[data-type="${callType}"]`).show();
+    }
+
+    // Initialize call duration formatting
+    $('.duration-display').each(function() {
+        const duration = $(this).text().trim();
+        if (duration !== '-' && !isNaN(duration)) {
+            const mins = parseInt(duration);
+            if (mins < 60) {
+                $(this).text(mins + ' min');
+            } else {
+                const hours = Math.floor(mins / 60);
+                const remainingMins = mins % 60;
+                $(this).text(hours + 'h ' + remainingMins + 'm');
+            }
+        }
+    });
+});
@@ -0,0 +1,153 @@
+$(document).ready(function() {
+    // Fixed navbar scroll effect
+    $(window).scroll(function() {
+        if ($(this).scrollTop() > 50) {
+            $('#landingHeader').addClass('scrolled');
+        } else {
+            $('#landingHeader').removeClass('scrolled');
+        }
+    });
+
+    // Mobile menu functionality
+    $('#mobileMenuToggle').click(function() {
+        $('#mobileNav').addClass('active');
+        $('#mobileOverlay').addClass('active');
+        $('body').css('overflow', 'hidden');
+    });
+
+    $('#mobileNavClose').click(function() {
+        $('#mobileNav').removeClass('active');
+        $('#mobileOverlay').removeClass('active');
+        $('body').css('overflow', 'auto');
+    });
+
+    $('#mobileOverlay').click(function() {
+        $('#mobileNav').removeClass('active');
+        $('#mobileOverlay').removeClass('active');
+        $('body').css('overflow', 'auto');
+    });
+
+    // Smooth scrolling for anchor links
+    $('a[href^="#"]').on('click', function(e) {
+        if ($(this).attr('href') === '#') return;
+
+        e.preventDefault();
+        const target = $(this).attr('href');
+
+        if (target === '#home') {
+            $('html, body').animate({
+                scrollTop: 0
+            }, 600);
+        } else {
+            const offset = $('#landingHeader').outerHeight() + 20;
+            $('html, body').animate({
+                scrollTop: $(target).offset().top - offset
+            }, 600);
+        }
+
+        // Close mobile menu if open
+        $('#mobileNav').removeClass('active');
+        $('#mobileOverlay').removeClass('active');
+        $('body').css('overflow', 'auto');
+
+        // Update active nav link
+        $('.landing-nav a, .mobile-nav-links a').removeClass('active');
+        $(this).addClass('active');
+    });
+
+    // Update active nav on scroll
+    $(window).on('scroll', function() {
+        const scrollPos = $(document).scrollTop();
+        const headerHeight = $('#landingHeader').outerHeight();
+
+        // Only update if not at the very top
+        if (scrollPos > 100) {
+            $('.landing-nav a, .mobile-nav-links a').each(function() {
+                const currLink = $(this);
+                const refElement = $(currLink.attr('href'));
+
+                if (refElement.length && refElement.position().top <= scrollPos + headerHeight + 100 && 
+                    refElement.position().top + refElement.height() > scrollPos) {
+                    $('.landing-nav a, .mobile-nav-links a').removeClass('active');
+                    currLink.addClass('active');
+                }
+            });
+        }
+    });
+
+    // Testimonial slider functionality
+    let testimonialIndex = 0;
+    const testimonials = [
+        {
+            name: "Sarah M.",
+            role: "Cooperative Society Member",
+            text: "CoopConnect helped me find not just a partner, but someone who shares my passion for cooperative development. We've been together for two years now and are planning to start our own cooperative business together.",
+            color: "var(--coop-green)"
+        },
+        {
+            name: "James K.",
+            role: "Cooperative Society Chairman",
+            text: "As a cooperative leader, I've used CoopConnect to network with other societies and find partnerships. The platform has been instrumental in expanding our cooperative's reach and impact.",
+            color: "var(--coop-blue)"
+        },
+        {
+            name: "Grace W.",
+            role: "Agricultural Cooperative Member",
+            text: "I found both business partners and friends through CoopConnect. The verification system gave me confidence that I was connecting with genuine cooperative members.",
+            color: "#8a2be2"
+        }
+    ];
+
+    function rotateTestimonial() {
+        testimonialIndex = (testimonialIndex + 1) % testimonials.length;
+        const testimonial = testimonials[testimonialIndex];
+
+        $('.testimonial-card').fadeOut(300, function() {
+            $(this).html(`
+                <div class="testimonial-avatar">
+                    <div style="background: ${testimonial.color}; height: 100%; display: flex; align-items: center; justify-content: center; color: white; font-size: 1.8rem;">
+                        <i class="fas fa-user"></i>
+                    </div>
+                </div>
+                <p class="testimonial-text">
+                    "${testimonial.text}"
+                </p>
+                <div class="testimonial-author">${testimonial.name}</div>
+                <div class="testimonial-role">${testimonial.role}</div>
+            `).fadeIn(300);
+        });
+    }
+
+    // Rotate testimonials every 8 seconds
+    setInterval(rotateTestimonial, 8000);
+
+    // Auto-hide messages after 5 seconds
+    setTimeout(function() {
+        $('.alert').fadeOut(300, function() {
+            $(this).remove();
+        });
+    }, 5000);
+
+    // Animate elements on scroll
+    function animateOnScroll() {
+        $('.feature-card, .testimonial-card').each(function() {
+            const elementTop = $(this).offset().top;
+            const elementBottom = elementTop + $(this).outerHeight();
+            const viewportTop = $(window).scrollTop();
+            const viewportBottom = viewportTop + $(window).height();
+
+            if (elementBottom > viewportTop && elementTop < viewportBottom) {
+                $(this).addClass('fade-in');
+            }
+        });
+    }
+
+    // Initial check for animations
+    animateOnScroll();
+    $(window).scroll(animateOnScroll);
+
+    // Set initial scroll class
+    if ($(window).scrollTop() > 50) {
+        $('#landingHeader').addClass('scrolled');
+    }
+});
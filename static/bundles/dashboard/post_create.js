@@ -0,0 +1,242 @@
+$(document).ready(function() {
+    const postTypeBtns = document.querySelectorAll('.post-type-btn');
+    const mediaUpload = document.getElementById('mediaUpload');
+    const mediaInput = document.getElementById('mediaInput');
+    const mediaPreview = document.getElementById('mediaPreview');
+    const postTypeInput = document.getElementById('postType');
+    const mediaLabel = document.getElementById('mediaLabel');
+    const mediaTitle = document.getElementById('mediaTitle');
+    const mediaDescription = document.getElementById('mediaDescription');
+    const postContent = document.getElementById('postContent');
+    const charCount = document.getElementById('charCount');
+    const privacyOptions = document.querySelectorAll('.privacy-option');
+    const privacySetting = document.getElementById('privacySetting');
+
+    let mediaFiles = [];
+    let currentPostType = 'text';
+
+    // Post type selection
+    postTypeBtns.forEach(btn => {
+        btn.addEventListener('click', function() {
+            postTypeBtns.forEach(b => b.classList.remove('active'));
+            this.classList.add('active');
+
+            currentPostType = this.dataset.type;
+            postTypeInput.value = currentPostType;
+
+            // Update media upload section
+            updateMediaUpload(currentPostType);
+        });
+    });
+
+    function updateMediaUpload(type) {
+        if (type === 'text') {
+            mediaUpload.style.display = 'none';
+            mediaInput.name = '';
+        } else if (type === 'image') {
+            mediaUpload.style.display = 'block';
+            mediaLabel.textContent = 'Upload Image';
+            mediaTitle.textContent = 'Select Image';
+            mediaDescription.textContent = 'Maximum file size: 10MB • Supported formats: JPG, PNG, GIF';
+            mediaInput.name = 'image';
+            mediaInput.accept = 'image/*';
+            mediaInput.multiple = false;
+        } else if (type === 'video') {
+            mediaUpload.style.display = 'block';
+            mediaLabel.textContent = 'Upload Video';
+            mediaTitle.textContent = 'Select Video';
+            mediaDescription.textContent = 'Maximum file size: 50MB • Maximum duration: 2 minutes';
+            mediaInput.name = 'video';
+            mediaInput.accept = 'video/*';
+            mediaInput.multiple = false;
+        }
+
+        // Clear previews
+        mediaPreview.innerHTML = '';
+        mediaFiles = [];
+    }
+
+    // Media file selection
+    mediaInput.addEventListener('change', function() {
+        if (this.files.length > 0) {
+            const file = this.files[0];
+            mediaFiles = [file];
+            displayMediaPreview(file);
+        }
+    });
+
+    function displayMediaPreview(file) {
+        mediaPreview.innerHTML = '';
+
+        const previewItem = document.createElement('div');
+        previewItem.className = 'preview-item';
+
+        if (file.type.startsWith('image/')) {
+            const reader = new FileReader();
+            reader.onload = function(e) {
+                previewItem.innerHTML = `
+                    <img src="${e.target.result}" alt="Preview">
+                    <button type="button" class="remove-preview">
+                        <i class="fas fa-times"></i>
+                    </button>
+                `;
+            };
+            reader.readAsDataURL(file);
+        } else if (file.type.startsWith('video/')) {
+            const videoURL = URL.createObjectURL(file);
+            previewItem.innerHTML = `
+                <video controls>
+                    <source src="${videoURL}" type="${file.type}">
+                </video>
+                <button type="button" class="remove-preview">
+                    <i class="fas fa-times"></i>
+                </button>
+            `;
+        }
+
+        mediaPreview.appendChild(previewItem);
+
+        // Add remove functionality
+        const removeBtn = previewItem.querySelector('.remove-preview');
+        removeBtn.addEventListener('click', function() {
+            mediaPreview.innerHTML = '';
+            mediaFiles = [];
+            mediaInput.value = '';
+        });
+    }
+
+    // Character count
+    postContent.addEventListener('input', function() {
+        const length = this.value.length;
+        charCount.textContent = `${length}/2000 characters`;
+
+        if (length > 1800) {
+            charCount.classList.add('warning');
+            charCount.classList.remove('danger');
+        } else if (length > 1950) {
+            charCount.classList.remove('warning');
+            charCount.classList.add('danger');
+        } else {
+            charCount.classList.remove('warning', 'danger');
+        }
+    });
+
+    // Privacy selection
+    privacyOptions.forEach(option => {
+        option.addEventListener('click', function() {
+            privacyOptions.forEach(opt => opt.classList.remove('active'));
+            this.classList.add('active');
+            privacySetting.value = this.dataset.privacy;
+        });
+    });
+
+    // Save draft
+    $('#saveDraft').click(function() {
+        const content = postContent.value;
+        const postType = postTypeInput.value;
+
+        if (!content.trim()) {
+            alert('Please enter some content before saving as draft');
+            return;
+        }
+
+        // Save to localStorage
+        const draft = {
+            content: content,
+            post_type: postType,
+            privacy: privacySetting.value,
+            timestamp: new Date().toISOString()
+        };
+
+        localStorage.setItem('postDraft', JSON.stringify(draft));
+
+        // Show success message
+        showModal(`
+            <div class="text-center p-4">
+                <i class="fas fa-save fa-3x text-success mb-3"></i>
+                <h3>Draft Saved!</h3>
+                <p>Your post has been saved as a draft. You can continue editing later.</p>
+                <button class="btn btn-primary mt-3" onclick="hideModal()">OK</button>
+            </div>
+        `);
+    });
+
+    // Load draft if exists
+    const savedDraft = localStorage.getItem('postDraft');
+    if (savedDraft) {
+        const draft = JSON.parse(savedDraft);
+
+        // Ask user if they want to load the draft
+        showModal(`
+            <div class="text-center p-4">
+                <i class="fas fa-file-alt fa-3x text-info mb-3"></i>
+                <h3>Saved Draft Found</h3>
+                <p>You have a saved draft from ${new Date(draft.timestamp).toLocaleString()}</p>
+                <p>Would you like to load it?</p>
+                <div class="d-flex gap-3 justify-center mt-4">
+                    <button class="btn btn-primary" onclick="loadDraft()">Load Draft</button>
+                    <button class="btn btn-secondary" onclick="discardDraft()">Discard Draft</button>
+                </div>
+            </div>
+        `);
+    }
+
+    // Form validation
+    $('#postForm').on('submit', function(e) {
+        const content = postContent.value.trim();
+
+        if (!content) {
+            e.preventDefault();
+            alert('Please enter some content for your post');
+            postContent.focus();
+            return false;
+        }
+
+        // Validate media for image/video posts
+        if (currentPostType !== 'text' && mediaFiles.length === 0) {
+            e.preventDefault();
+            alert(`Please select a ${currentPostType} to upload`);
+            return false;
+        }
+
+        // Validate video duration (if video post)
+        if (currentPostType === 'video' && mediaFiles.length > 0) {
+            const videoFile = mediaFiles[0];
+            if (videoFile.size > 50 * 1024 * 1024) { // 50MB
+                e.preventDefault();
+                alert('Video file must be less than 50MB');
+                return false;
+            }
+        }
+
+        // Clear draft on successful submission
+        localStorage.removeItem('postDraft');
+
+        return true;
+    });
+});
+
+// Load draft function
+function loadDraft() {
+    const draft = JSON.parse(localStorage.getItem('postDraft'));
+
+    $('#postContent').val(draft.content);
+    $('#postType').val(draft.post_type);
+    $('#privacySetting').val(draft.privacy);
+
+    // Update UI
+    $('.post-type-btn').removeClass('active');
+    $(`.post-type-btn[data-type="${draft.post_type}"]`).addClass('active');
+    updateMediaUpload(draft.post_type);
+
+    $('.privacy-option').removeClass('active');
+    $(`.privacy-option[data-privacy="${draft.privacy}"]`).addClass('active');
+
+    hideModal();
+}
+
+// Discard draft function
+function discardDraft() {
+    localStorage.removeItem('postDraft');
+    hideModal();
+}
@@ -0,0 +1,88 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Character counter
+    const textarea = document.getElementById('id_content');
+    const charCounter = document.getElementById('charCounter');
+    const charCount = document.getElementById('charCount');
+
+    if (textarea) {
+        // Initialize count
+        charCount.textContent = textarea.value.length;
+
+        // Update count on input
+        textarea.addEventListener('input', function() {
+            const count = this.value.length;
+            charCount.textContent = count;
+
+            // Change color based on length
+            if (count > 4500) {
+                charCounter.style.color = 'var(--danger)';
+            } else if (count > 4000) {
+                charCounter.style.color = 'var(--warning)';
+            } else {
+                charCounter.style.color = 'var(--text-muted)';
+            }
+        });
+
+        // Auto-resize textarea
+        textarea.addEventListener('input', function() {
+            this.style.height = 'auto';
+            this.style.height = (this.scrollHeight) + 'px';
+        });
+
+        // Trigger input to set initial height
+        textarea.dispatchEvent(new Event('input'));
+    }
+
+    // File input preview
+    const imageInput = document.getElementById('id_image');
+    const videoInput = document.getElementById('id_video');
+
+    if (imageInput) {
+        imageInput.addEventListener('change', function(e) {
+            const file = e.target.files[0];
+            if (file) {
+                // Update UI to show selected file
+                const label = this.nextElementSibling;
+                if (label && label.classList.contains('media-browse-btn')) {
+                    label.innerHTML = `<i class="fas fa-check me-2"></i>Selected`;
+                    label.style.background = 'rgba(0, 168, 89, 0.2)';
+                }
+            }
+        });
+    }
+
+    if (videoInput) {
+        videoInput.addEventListener('change', function(e) {
+            const file = e.target.files[0];
+            if (file) {
+                // Update UI to show selected file
+                const label = this.nextElementSibling;
+                if (label && label.classList.contains('media-browse-btn')) {
+                    label.innerHTML = `<i class="fas fa-check me-2"></i>Selected`;
+                    label.style.background = 'rgba(0, 168, 89, 0.2)';
+                }
+            }
+        });
+    }
+
+    // Form submission handling
+    const form = document.querySelector('.post-edit-form');
+    if (form) {
+        form.addEventListener('submit', function(e) {
+            const submitBtn = this.querySelector('button[type="submit"]');
+            if (submitBtn) {
+                submitBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i> Updating...';
+                submitBtn.disabled = true;
+            }
+        });
+    }
+
+    // Add smooth scrolling to error messages
+    const errorMessages = document.querySelectorAll('.form-error');
+    if (errorMessages.length > 0) {
+        errorMessages[0].scrollIntoView({
+            behavior: 'smooth',
+            block: 'center'
+        });
+    }
+});
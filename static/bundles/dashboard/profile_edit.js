@@ -0,0 +1,124 @@
+$(document).ready(function() {
+    // Form validation
+    $('#profileForm').on('submit', function(e) {
+        const age = $('input[name="age"]').val();
+        if (age < 18 || age > 100) {
+            e.preventDefault();
+            showAlert('Age must be between 18 and 100 years', 'error');
+            return false;
+        }
+
+        const phone = $('input[name="phone_number"]').val();
+        if (!phone.match(/^[\d\s\-\+\(\)]{10,20}$/)) {
+            e.preventDefault();
+            showAlert('Please enter a valid phone number', 'error');
+            return false;
+        }
+
+        // Check if at least one service is provided
+        const services = $('textarea[name="services_offered"]').val().trim();
+        if (!services) {
+            e.preventDefault();
+            showAlert('Please add at least one service you offer', 'warning');
+            return false;
+        }
+
+        return true;
+    });
+
+    // Rate formatting
+    $('.rate-input').on('blur', function() {
+        const value = parseFloat($(this).val());
+        if (!isNaN(value) && value > 0) {
+            $(this).val(value.toFixed(2));
+        }
+    });
+
+    // Service badges functionality
+    function removeService(service) {
+        const textarea = $('textarea[name="services_offered"]');
+        let services = textarea.val().split(',').map(s => s.trim());
+        services = services.filter(s => s !== service);
+        textarea.val(services.join(', '));
+
+        // Remove badge from display
+        $(event.target).closest('.service-badge').remove();
+    }
+
+    // Update service badges in real-time
+    $('textarea[name="services_offered"]').on('input', function() {
+        const services = $(this).val().split(',').map(s => s.trim()).filter(s => s);
+        const badgesContainer = $('.service-badges');
+
+        if (services.length > 0) {
+            badgesContainer.html('');
+            services.forEach(service => {
+                badgesContainer.append(`
+                    <span class="service-badge">
+                        ${service}
+                        <button type="button" class="remove-service" onclick="removeService('${service.replace(/'/g, "\\'")}')">
+                            <i class="fas fa-times"></i>
+                        </button>
+                    </span>
+                `);
+            });
+        } else {
+            badgesContainer.html('');
+        }
+    });
+
+    // Alert function
+    function showAlert(message, type) {
+        const alert = $(`
+            <div class="alert-message alert-${type}">
+                <i class="fas fa-${type === 'error' ? 'exclamation-circle' : 'exclamation-triangle'}"></i>
+                ${message}
+                <button class="alert-close"><i class="fas fa-times"></i></button>
+            </div>
+        `);
+
+        // Add styles if not already added
+        if (!$('#alert-styles').length) {
+            $('<style id="alert-styles">').text(`
+                .alert-message {
+                    position: fixed;
+                    top: 20px;
+                    right: 20px;
+                    padding: 15px 20px;
+                    border-radius: 10px;
+                    color: white;
+                    font-weight: 500;
+                    z-index: 10000;
+                    animation: slideIn 0.3s ease, fadeOut 0.3s ease 2.7s;
+                    max-width: 350px;
+                    box-shadow: 0 5px 15px rgba(0,0,0,0.3);
+                    display: flex;
+                    align-items: center;
+                    gap: 12px;
+                }
+                .alert-error { background: #ff4444; }
+                .alert-warning { background: #ff9800; }
+                .alert-success { background: var(--coop-green); }
+                .alert-close {
+                    background: none;
+                    border: none;
+                    color: white;
+                    cursor: pointer;
+                    margin-left: auto;
+                    padding: 0;
+                    font-size: 14px;
+                }
+            `).appendTo('head');
+        }
+
+        $('body').append(alert);
+
+        // Remove alert after 3 seconds
+        setTimeout(() => {
+            alert.remove();
+        }, 3000);
+
+        // Close button
+        alert.find('.alert-close').click(() => alert.remove());
+    }
+});
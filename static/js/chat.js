@@ -9,7 +9,8 @@ class ChatManager {
         this.typingIndicator = document.getElementById('typing-indicator');
         this.isTyping = false;
         this.typingTimeout = null;
-        this.pollInterval = null;
+        this.polling = false;
+        this.eventSource = null;
         this.lastMessageId = 0;
         this.csrfToken = this.getCsrfToken();
         
@@ -19,7 +20,7 @@ class ChatManager {
     init() {
         this.bindEvents();
         this.scrollToBottom();
-        this.startPolling();
+        this.startRealtime();
     }
     
     bindEvents() {
@@ -79,11 +80,13 @@ class ChatManager {
                 this.messageForm.reset();
                 this.autoResize();
                 
-                // Add message to UI
-                this.addMessage(data.message, true);
+                // Add message to UI (unless the stream already delivered it)
+                if (!this.hasMessage(data.message.id)) {
+                    this.addMessage(data.message, true);
+                }
                 
                 // Update last message ID
-                this.lastMessageId = data.message.id;
+                this.lastMessageId = Math.max(this.lastMessageId, data.message.id);
                 
                 // Scroll to bottom
                 this.scrollToBottom();
@@ -135,22 +138,15 @@ class ChatManager {
         this.sendTypingIndicator(false);
     }
     
-    async fetchNewMessages() {
+    async fetchNewMessages(wait = 0) {
         try {
-            const response = await fetch(`/api/conversation/${this.conversationId}/messages/?last_id=${this.lastMessageId}`);
+            const response = await fetch(`/api/conversation/${this.conversationId}/messages/?last_message_id=${this.lastMessageId}&wait=${wait}`, {
+                headers: { 'X-Requested-With': 'XMLHttpRequest' }
+            });
             const data = await response.json();
             
             if (data.messages && data.messages.length > 0) {
-                data.messages.forEach(message => {
-                    this.addMessage(message, false);
-                    this.lastMessageId = Math.max(this.lastMessageId, message.id);
-                });
-                
-                // Scroll to bottom if we were near the bottom
-                const isNearBottom = this.messagesContainer.scrollHeight - this.messagesContainer.scrollTop <= this.messagesContainer.clientHeight + 100;
-                if (isNearBottom) {
-                    this.scrollToBottom();
-                }
+                data.messages.forEach(message => this.receiveMessage(message));
             }
             
             // Update typing indicator
@@ -160,18 +156,97 @@ class ChatManager {
                 this.hideTypingIndicator();
             }
             
+            return data.messages ? data.messages.length : 0;
         } catch (error) {
             console.error('Error fetching messages:', error);
+            return 0;
+        }
+    }
+    
+    hasMessage(messageId) {
+        return this.messagesContainer.querySelector(`[data-message-id="${messageId}"]`) !== null;
+    }
+    
+    receiveMessage(message) {
+        this.lastMessageId = Math.max(this.lastMessageId, message.id);
+        // Our own sends are echoed by the stream and may beat the POST response
+        if (this.hasMessage(message.id)) {
+            return;
+        }
+        
+        // Scroll to bottom if we were near the bottom
+        const isNearBottom = this.messagesContainer.scrollHeight - this.messagesContainer.scrollTop <= this.messagesContainer.clientHeight + 100;
+        this.addMessage(message, String(message.sender_id) !== String(this.otherUserId));
+        if (isNearBottom) {
+            this.scrollToBottom();
         }
     }
     
-    startPolling() {
-        this.pollInterval = setInterval(() => this.fetchNewMessages(), 2000);
+    startRealtime() {
+        // Server push over SSE; the server answers 204 when it can't stream (WSGI)
+        if (!window.EventSource) {
+            this.startPolling();
+            return;
+        }
+        
+        this.eventSource = new EventSource(`/api/conversation/${this.conversationId}/stream/`);
+        
+        this.eventSource.addEventListener('message', (e) => {
+            this.receiveMessage(JSON.parse(e.data));
+        });
+        
+        this.eventSource.addEventListener('typing', (e) => {
+            const data = JSON.parse(e.data);
+            if (String(data.user_id) !== String(this.otherUserId)) {
+                return;
+            }
+            if (data.is_typing) {
+                this.showTypingIndicator();
+            } else {
+                this.hideTypingIndicator();
+            }
+        });
+        
+        this.eventSource.addEventListener('read', (e) => {
+            if (String(JSON.parse(e.data).reader_id) !== String(this.otherUserId)) {
+                return;
+            }
+            this.messagesContainer.querySelectorAll('.message-bubble.sent .message-status').forEach(status => {
+                status.classList.add('read');
+                status.innerHTML = '<i class="fas fa-check-double"></i>';
+            });
+        });
+        
+        this.eventSource.onerror = () => {
+            // CLOSED means the browser gave up reconnecting (e.g. 204 under WSGI)
+            if (this.eventSource.readyState === EventSource.CLOSED) {
+                this.eventSource = null;
+                this.startPolling();
+            }
+        };
+    }
+    
+    async startPolling() {
+        // Long-poll: each request waits server-side until a message arrives
+        if (this.polling) {
+            return;
+        }
+        this.polling = true;
+        while (this.polling) {
+            const started = Date.now();
+            const received = await this.fetchNewMessages(25);
+            // An immediate empty answer means the server couldn't hold the request
+            if (!received && Date.now() - started < 1000) {
+                await new Promise(resolve => setTimeout(resolve, 2000));
+            }
+        }
     }
     
     stopPolling() {
-        if (this.pollInterval) {
-            clearInterval(this.pollInterval);
+        this.polling = false;
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
         }
     }
     
@@ -1,83 +1,198 @@
 // static/js/sw.js - Service Worker for SparkConnect
+//
+// Served from /sw.js by main.service_worker, which prepends SW_CONFIG: the
+// cache version, the precache list and the URL patterns used below.
+//
+// - precache: the hashed bundles the dashboard pages link, per version; a
+//   file that fails to download is skipped rather than failing the install
+// - static files: cache first when hashed (they never change), otherwise
+//   stale-while-revalidate
+// - avatar thumbnails: stale-while-revalidate
+// - dashboard pages, conversation and notification JSON: network first,
+//   falling back to the last copy when offline or slower than
+//   networkTimeout (the network response still refreshes the cache);
+//   long polls (?wait=) go straight to the network
+// - pages and JSON are private: they are kept in caches named after the
+//   X-Cache-Partition key the server sends signed-in users, and only
+//   responses carrying it are stored. A new key deletes the other user's
+//   caches; a response without one (signed out), a 401/403, a redirect to
+//   the login page, or going to the login or logout page deletes them all
+// - activate deletes every cache that isn't the current version's
 
-const CACHE_NAME = 'sparkconnect-v1.0';
-const urlsToCache = [
-    '/',
-    '/static/css/style.css',
-    '/static/js/main.js'
-];
+const CONFIG = self.SW_CONFIG;
+const PRECACHE = `precache-${CONFIG.version}`;
+const CACHES = {
+    static: `static-${CONFIG.version}`,
+    // Pages link the hashed assets of their version
+    pages: `pages-${CONFIG.version}`,
+    api: 'api-v1',
+    avatars: 'avatars-v1',
+};
+// Per user: `${prefix}:${partition}`
+const USER_CACHES = [CACHES.pages, CACHES.api];
+const PRECACHED = new Set(CONFIG.precache);
+const HASHED = /\.[0-9a-f]{12}\.\w+$/;
+const API = CONFIG.api.map(pattern => new RegExp(pattern));
+const AVATARS = new RegExp(CONFIG.avatars);
 
-// Install Service Worker
 self.addEventListener('install', event => {
-    console.log('Service Worker installing...');
     event.waitUntil(
-        caches.open(CACHE_NAME)
-            .then(cache => {
-                console.log('Cache opened');
-                return cache.addAll(urlsToCache);
-            })
+        caches.open(PRECACHE)
+            .then(cache => Promise.allSettled(CONFIG.precache.map(url => cache.add(url))))
+            .then(() => self.skipWaiting())
     );
 });
 
-// Activate Service Worker
 self.addEventListener('activate', event => {
-    console.log('Service Worker activating...');
+    const current = new Set([PRECACHE, ...Object.values(CACHES)]);
     event.waitUntil(
-        caches.keys().then(cacheNames => {
-            return Promise.all(
-                cacheNames.map(cacheName => {
-                    if (cacheName !== CACHE_NAME) {
-                        console.log('Deleting old cache:', cacheName);
-                        return caches.delete(cacheName);
-                    }
-                })
-            );
-        })
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => !current.has(name) && !isUserCache(name)).map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
     );
 });
 
-// Fetch Strategy: Cache First, then Network
 self.addEventListener('fetch', event => {
-    // Skip non-GET requests
-    if (event.request.method !== 'GET') return;
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
 
-    // Skip API requests
-    if (event.request.url.includes('/api/')) {
+    if (url.pathname === CONFIG.logoutUrl || url.pathname === CONFIG.loginUrl) {
+        // Cached pages and messages belong to the user logging out, or to
+        // whoever was signed in before
+        event.waitUntil(clearUserCaches());
         return;
     }
+    if (request.method !== 'GET') return;
 
-    event.respondWith(
-        caches.match(event.request)
-            .then(response => {
-                // Return cached response if found
-                if (response) {
-                    return response;
-                }
+    if (request.mode === 'navigate') {
+        if (CONFIG.pages.some(prefix => url.pathname.startsWith(prefix))) {
+            event.respondWith(networkFirst(event, CACHES.pages, CONFIG.limits.pages, offlinePage));
+        }
+    } else if (API.some(pattern => pattern.test(url.pathname))) {
+        // Long polls (?wait=N) are slow on purpose; racing them against the
+        // cache would answer from it and re-poll while the server still waits
+        if (url.searchParams.has('wait')) return;
+        event.respondWith(networkFirst(event, CACHES.api, CONFIG.limits.api, offlineJson));
+    } else if (AVATARS.test(url.pathname)) {
+        event.respondWith(staleWhileRevalidate(event, CACHES.avatars, CONFIG.limits.avatars));
+    } else if (url.pathname.startsWith(CONFIG.staticUrl)) {
+        event.respondWith(
+            PRECACHED.has(url.pathname) || HASHED.test(url.pathname)
+                ? cacheFirst(event, CACHES.static)
+                : staleWhileRevalidate(event, CACHES.static)
+        );
+    }
+});
 
-                return fetch(event.request)
-                    .then(response => {
-                        // Don't cache if not a valid response
-                        if (!response || response.status !== 200 || response.type !== 'basic') {
-                            return response;
-                        }
-
-                        // Clone the response
-                        const responseToCache = response.clone();
-
-                        caches.open(CACHE_NAME)
-                            .then(cache => {
-                                cache.put(event.request, responseToCache);
-                            });
-
-                        return response;
-                    })
-                    .catch(() => {
-                        // If offline, return offline page or cached response
-                        return caches.match('/');
-                    });
-            })
+function isUserCache(name) {
+    return USER_CACHES.some(prefix => name.startsWith(`${prefix}:`));
+}
+
+async function clearUserCaches(keep) {
+    const names = await caches.keys();
+    await Promise.all(
+        names.filter(name => isUserCache(name) && !name.endsWith(`:${keep}`)).map(name => caches.delete(name))
     );
-});
+}
+
+function signedOut(response) {
+    if (response.status === 401 || response.status === 403 || response.type === 'opaqueredirect') return true;
+    return response.redirected && new URL(response.url).pathname === CONFIG.loginUrl;
+}
+
+async function storeForUser(cacheName, request, response, limit) {
+    const partition = response.headers.get(CONFIG.partitionHeader);
+    if (!partition || signedOut(response)) {
+        await clearUserCaches();
+        return;
+    }
+    // Another user's caches go as soon as this one's responses arrive
+    await clearUserCaches(partition);
+    if (response.ok) await store(`${cacheName}:${partition}`, request, response, limit);
+}
+
+async function matchUser(request, cacheName) {
+    // At most one partition is kept, see storeForUser
+    const names = (await caches.keys()).filter(name => name.startsWith(`${cacheName}:`));
+    for (const name of names) {
+        const cached = await caches.match(request, { cacheName: name });
+        if (cached) return cached;
+    }
+    return undefined;
+}
+
+async function store(cacheName, request, response, limit) {
+    const cache = await caches.open(cacheName);
+    await cache.put(request, response);
+    if (limit) {
+        // Oldest first: put() moves an entry to the end
+        const keys = await cache.keys();
+        await Promise.all(keys.slice(0, Math.max(0, keys.length - limit)).map(key => cache.delete(key)));
+    }
+}
+
+function fetchAndStore(event, cacheName, limit) {
+    const network = fetch(event.request);
+    event.waitUntil(
+        network
+            .then(response => response.ok && store(cacheName, event.request, response.clone(), limit))
+            .catch(() => {})
+    );
+    return network;
+}
+
+async function cacheFirst(event, cacheName) {
+    const cached = await caches.match(event.request);
+    return cached || fetchAndStore(event, cacheName);
+}
+
+async function staleWhileRevalidate(event, cacheName, limit) {
+    const network = fetchAndStore(event, cacheName, limit);
+    const cached = await caches.match(event.request, { cacheName });
+    return cached || network;
+}
+
+function fetchAndStoreForUser(event, cacheName, limit) {
+    const network = fetch(event.request);
+    event.waitUntil(
+        network
+            .then(response => storeForUser(cacheName, event.request, response.clone(), limit))
+            .catch(() => {})
+    );
+    return network;
+}
+
+// For the per-user caches only
+async function networkFirst(event, cacheName, limit, fallback) {
+    const network = fetchAndStoreForUser(event, cacheName, limit);
+    const slow = new Promise(resolve => setTimeout(resolve, CONFIG.networkTimeout))
+        .then(() => matchUser(event.request, cacheName));
+    try {
+        // The cached copy only if the network is slow, otherwise keep waiting
+        return (await Promise.race([network, slow])) || await network;
+    } catch (error) {
+        return (await matchUser(event.request, cacheName)) || fallback();
+    }
+}
+
+function offlinePage() {
+    return new Response(
+        '<!DOCTYPE html><meta charset="utf-8"><meta name="viewport" content="width=device-width">' +
+        '<title>Offline</title><p style="font-family:sans-serif;text-align:center;margin-top:30vh">' +
+        'You are offline. This page will load once you are back online.</p>',
+        { status: 503, headers: { 'Content-Type': 'text/html; charset=utf-8' } }
+    );
+}
+
+function offlineJson() {
+    return new Response(
+        JSON.stringify({ success: false, offline: true, error: 'You are offline' }),
+        { status: 503, headers: { 'Content-Type': 'application/json' } }
+    );
+}
 
 // Simple push notification handler
 self.addEventListener('push', event => {